@@ -1,30 +1,34 @@
 import argparse
+import asyncio
 import logging
 import re
 import sys
 import tomllib
-from collections import defaultdict
-from datetime import datetime
+from dataclasses import replace
 from pathlib import Path
 
-from .api.model_runner import normalize_usage_dispatch, run_model_dispatch
+from .api.clients import close_clients
+from .api.limits import ProviderLimiter
+from .api.model_runner import provider_group
+from .api.response_cache import ResponseCache
+from .api.retry import RetryPolicy
+from .code import rescore
+from .code.batch import batch_collect, batch_submit
+from .code.budget import Budget
+from .code.build_cache import BuildCache
 from .code.config import (
     build_prompt_context,
     generate_schema,
     get_paths,
     load_exam_context,
-    load_file,
+    load_toml,
     programs_loading,
-    render_prompts,
-    save_json_and_html,
-)
-from .code.evals import (
-    add_line_numbers,
-    compilation_test,
-    compute_final_score,
-    pvcheck_test,
-    time_test,
 )
+from .code.evals import add_line_numbers
+from .code.ledger import JobLedger
+from .code.pipeline import RunSettings, UsageTotals, run_batch
+from .code.sandbox import configure_sandbox
+from .code.session import ExamSession
 
 
 class APIError(Exception):
@@ -46,10 +50,32 @@ DATA_DIR = PKG_ROOT / "data"
 TEMPLATES_DIR = DATA_DIR / "templates"
 
 
-def init_argparser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(description="Evaluates a given C program")
-    parser.add_argument("program", type=str, help="C program file to evaluate")
-    parser.add_argument("model", type=str, help="Model to use for evaluation")
+def init_argparser(batch: str | None = None) -> argparse.ArgumentParser:
+    """Options of a run; batch ("submit" or "collect") adds the batch ones."""
+    if batch == "submit":
+        parser = argparse.ArgumentParser(
+            prog="checkmyc batch submit",
+            description="Tests the programs and writes the Batch API requests "
+            "of their evaluations",
+        )
+    elif batch == "collect":
+        parser = argparse.ArgumentParser(
+            prog="checkmyc batch collect",
+            description="Scores the programs of a batch from its results (same "
+            "arguments as the submit)",
+        )
+    else:
+        parser = argparse.ArgumentParser(description="Evaluates a given C program")
+    parser.add_argument(
+        "program", type=str, help="C program file or directory of programs to evaluate"
+    )
+    parser.add_argument(
+        "model",
+        type=str,
+        nargs="+",
+        help="Model to use for evaluation; several models evaluate every program "
+        "and are compared",
+    )
     parser.add_argument("--input", "-i", type=str, help="Input file for the C program")
     parser.add_argument(
         "--context", "-cx", type=str, help="File containing program context"
@@ -79,7 +105,11 @@ def init_argparser() -> argparse.ArgumentParser:
         "--system_prompt", "-sp", type=str, default="sp6.md", help="System prompts file"
     )
     parser.add_argument(
-        "--provider", "-pr", type=str, help="Provider (openai/gemini/openrouter)"
+        "--provider",
+        "-pr",
+        type=str,
+        nargs="+",
+        help="Provider (openai/gemini/openrouter), for all the models or one each",
     )
     parser.add_argument(
         "--prompt_price",
@@ -99,23 +129,158 @@ def init_argparser() -> argparse.ArgumentParser:
         "--temperature", "-t", type=float, default=0.3, help="Model temperature"
     )
     parser.add_argument("--output", "-o", type=str, help="Output directory for results")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of programs compiled and tested concurrently",
+    )
+    parser.add_argument(
+        "--max_inflight",
+        "-mi",
+        type=int,
+        default=16,
+        help="Maximum number of concurrent model calls per provider",
+    )
+    parser.add_argument(
+        "--bench_runs",
+        "-br",
+        type=int,
+        default=1,
+        help="Number of timed runs of the performance test",
+    )
+    parser.add_argument(
+        "--bench_warmup",
+        "-bw",
+        type=int,
+        default=0,
+        help="Number of untimed warm-up runs before the performance test",
+    )
+    parser.add_argument(
+        "--scaling",
+        "-sc",
+        action="store_true",
+        help=(
+            "Estimate time complexity against the reference solution on the "
+            "inputs of the exam's scaling/ directory (at least 4 valid inputs, "
+            "ordered by line count, e.g. 1000 to 100000 lines)"
+        ),
+    )
+    parser.add_argument(
+        "--diagnostics",
+        "-dg",
+        action="store_true",
+        help="Add the compiler's warnings and errors to the user prompt",
+    )
+    parser.add_argument(
+        "--dedup",
+        "-dd",
+        type=float,
+        nargs="?",
+        const=0.9,
+        default=None,
+        metavar="SIMILARITY",
+        help="Evaluate once programs that are near-duplicates (token similarity "
+        "at least SIMILARITY, default 0.9) and reuse the model result for the "
+        "others",
+    )
+    parser.add_argument(
+        "--compact_code",
+        "-cc",
+        action="store_true",
+        help="Mark the program's lines as '12|' and drop trailing whitespace",
+    )
+    parser.add_argument(
+        "--fold",
+        "-fo",
+        nargs="+",
+        choices=["blank", "comments"],
+        default=[],
+        help="Leave blank lines and/or comment blocks out of the prompt, keeping "
+        "the original line numbers",
+    )
+    parser.add_argument(
+        "--cascade",
+        "-cs",
+        type=str,
+        metavar="CHEAP_MODEL",
+        help="Evaluate with CHEAP_MODEL first and escalate to model only when "
+        "its result looks unreliable ([cascade] in llm.toml)",
+    )
+    parser.add_argument(
+        "--split_topics",
+        "-st",
+        action="store_true",
+        help="Evaluate each topic, and the summary, in its own concurrent model "
+        "call instead of a single one",
+    )
+    parser.add_argument(
+        "--samples",
+        "-sa",
+        type=int,
+        default=1,
+        metavar="K",
+        help="Evaluate each program K times concurrently and aggregate the "
+        "topic scores ([samples] in llm.toml)",
+    )
+    parser.add_argument(
+        "--budget",
+        "-bg",
+        type=float,
+        help="Maximum USD to spend on model calls; calls that would exceed it "
+        "move to --fallback_model, or are not made",
+    )
+    parser.add_argument(
+        "--fallback_model",
+        "-fm",
+        type=str,
+        help="Cheaper model of the same provider used when --budget is short",
+    )
+    parser.add_argument(
+        "--no_cache",
+        "-nc",
+        action="store_true",
+        help="Neither read nor store model responses in the response cache",
+    )
+    parser.add_argument(
+        "--refresh",
+        "-rf",
+        action="store_true",
+        help="Ignore cached model responses and overwrite them with new ones",
+    )
+    parser.add_argument(
+        "--resume",
+        "-rs",
+        action="store_true",
+        help="Skip the stages and programs already completed by a previous run",
+    )
+    if batch:
+        parser.add_argument(
+            "--base_url",
+            "-bu",
+            type=str,
+            help="Endpoint of the Batch API (default: OpenAI's, or OPENAI_BASE_URL)",
+        )
+    if batch == "submit":
+        parser.add_argument(
+            "--upload",
+            "-ul",
+            action="store_true",
+            help="Upload the request file and start the batch",
+        )
+    if batch == "collect":
+        parser.add_argument(
+            "--results",
+            "-re",
+            type=str,
+            nargs="+",
+            help="Batch result files or batch ids (default: the batches started "
+            "by submit --upload)",
+        )
     return parser
 
 
-def compute_cost(model_name, tokens_count, pricing_data):
-    if model_name not in pricing_data:
-        return " Not specified in llm.toml"
-
-    model_prices = pricing_data[model_name]
-    tot_cost = 0
-    for token_type, count in tokens_count.items():
-        if token_type not in model_prices:
-            continue
-        rate = model_prices[token_type]  # USD per 1M tokens
-        tot_cost += (count / 1000000) * rate
-    return tot_cost
-
-
 def make_safe_dirname(s: str) -> str:
     safe_name = re.sub(r"[^a-zA-Z0-9-_]", "_", s)
     safe_name = re.sub(r"_+", "_", safe_name)
@@ -128,9 +293,42 @@ logger = logging.getLogger(__name__)
 
 
 def main():
-    parser = init_argparser()
-    input_args = parser.parse_args()
+    if sys.argv[1:2] == ["rescore"]:
+        return rescore.main(sys.argv[2:])
+    argv, batch = sys.argv[1:], None
+    if argv[:1] == ["batch"]:
+        if argv[1:2] not in (["submit"], ["collect"]):
+            raise SystemExit("usage: checkmyc batch {submit,collect} ...")
+        argv, batch = argv[2:], argv[1]
+
+    parser = init_argparser(batch)
+    input_args = parser.parse_args(argv)
     debug = input_args.debug
+
+    # MODELS (several make an ensemble run, compared at the end)
+    models = input_args.model
+    providers = input_args.provider or [None]
+    if len(providers) not in (1, len(models)):
+        parser.error("--provider takes a single provider or one per model")
+    providers = providers * len(models) if len(providers) == 1 else providers
+    if len(set(models)) < len(models):
+        parser.error("each model can be given only once")
+    if len(models) > 1 and (input_args.budget is not None or input_args.cascade):
+        parser.error("--budget and --cascade take a single model")
+    if batch:
+        # One request per program, in the OpenAI Batch API format
+        if len(models) > 1 or provider_group(providers[0]) != "openai":
+            parser.error("batch mode takes a single model with provider openai")
+        unsupported = {
+            "--budget": input_args.budget is not None,
+            "--cascade": input_args.cascade,
+            "--samples": input_args.samples > 1,
+            "--split_topics": input_args.split_topics,
+            "--dedup": input_args.dedup,
+        }
+        if any(unsupported.values()):
+            options = ", ".join(k for k, v in unsupported.items() if v)
+            parser.error(f"{options} not available in batch mode")
     path_flag = input_args.config
 
     # CONFIGURATION LOAD
@@ -144,23 +342,16 @@ def main():
 
     paths = get_paths(general_config, path_flag, input_args)
     combined_weights = general_config.get("combined_weights", {})
+    configure_sandbox(general_config.get("sandbox", {}))
 
     # LLM CONFIG LOAD
-    llm_config_path = paths.get("llm_config")
-    if not llm_config_path:
-        raise FileNotFoundError("llm_config path missing in config.toml")
-    with open(llm_config_path, "rb") as f:
-        llm_config = tomllib.load(f)
+    llm_config = load_toml(paths.get("llm_config"), "llm_config")
     topics, analysis = llm_config["topics"], llm_config["analysis"]
     llm_weights = {a["name"]: a["weight"] for a in topics}
     pricing = llm_config.get("models", {})
 
     # QUESTIONS CONFIG LOAD
-    questions_config_path = paths.get("questions_config")
-    if not questions_config_path:
-        raise FileNotFoundError("questions_config path missing in config.toml")
-    with open(questions_config_path, "rb") as f:
-        questions = tomllib.load(f)
+    questions = load_toml(paths.get("questions_config"), "questions_config")
     tests_weights = questions["tests_weights"]
     tests = list(tests_weights.keys())
 
@@ -183,99 +374,175 @@ def main():
     if not usr_prompt_path or not Path(usr_prompt_path).exists():
         raise FileNotFoundError(f"User prompt not found: {usr_prompt_path}")
 
-    system_prompt_name = Path(sys_prompt_path).stem
-    user_prompt_name = Path(usr_prompt_path).stem
-
-    for program_path in program_paths:
-        program_name = Path(program_path).name
-        abs_program_path = "file://" + str(Path(program_path).resolve())
-        program_info = {"name": program_name, "path": abs_program_path}
-        program_text = add_line_numbers(load_file(program_path))
-
-        # OBJECTIVE TESTS
-        metrics = dict.fromkeys(tests, -1.0)
-        metrics[tests[0]] = compilation_test(str(program_path))
-        metrics[tests[1]] = time_test(exam_ctx.program_input)
-        pvcheck_csv_scores = defaultdict(list)
-        if exam_dir and exam_ctx.pvcheck_flag:
-            metrics[tests[2]] = pvcheck_test(
-                questions["questions_weights"],
-                pvcheck_csv_scores,
-                str(exam_ctx.exam_path),
-            )
-
-        # PROMPT COMPILING
-        templ_context = {
+    # CODE RENDERING (line numbers always refer to the original files)
+    code_render = {}
+    if input_args.compact_code:
+        code_render["compact"] = True
+    for what in input_args.fold:
+        code_render[f"fold_{what}"] = True
+    solution = exam_ctx.solution
+    if code_render and solution:
+        solution = add_line_numbers(solution, numbered=False, **code_render)
+
+    # EXAM SESSION (prompt sections, reference solution and pvcheck.test, once)
+    complexity = questions.get("complexity", {}) if input_args.scaling else None
+    session = ExamSession.build(
+        exam_ctx,
+        Path(sys_prompt_path),
+        Path(usr_prompt_path),
+        {
             "schema_flag": False,
             "schema": schema,
             "topics": args_md,
             "context": exam_ctx.context,
-            "solution": exam_ctx.solution,
-            "program": program_text,
-        }
-
-        system_prompt, user_prompt = render_prompts(
-            str(sys_prompt_path), str(usr_prompt_path), templ_context
+            "solution": solution,
+        },
+        questions["questions_weights"],
+        complexity,
+    )
+    # The complexity test is weighted and reported only when it can run
+    if session.reference_complexity is None:
+        complexity = None
+    else:
+        tests_weights = {**tests_weights, "complexity": complexity.get("weight", 2.0)}
+        tests = list(tests_weights.keys())
+
+    # RESPONSE CACHE
+    cache = None
+    if not input_args.no_cache and paths.get("response_cache"):
+        cache_config = general_config.get("cache", {})
+        cache = ResponseCache(
+            paths["response_cache"],
+            cache_config.get("max_size_mb", 512),
+            cache_config.get("max_age_days", 30),
         )
-
-        if debug:
-            with open(
-                PROJECT_ROOT / "rendered_prompts" / "system_prompt.md",
-                "w",
-                encoding="utf-8",
-            ) as f:
-                f.write(system_prompt)
-            with open(
-                PROJECT_ROOT / "rendered_prompts" / "user_prompt.md",
-                "w",
-                encoding="utf-8",
-            ) as f:
-                f.write(user_prompt)
-
-        # TEMPERATURE
-        temperature = input_args.temperature
-
-        # MODEL CALL
-        model = input_args.model
-        provider = input_args.provider
-        parsed, usage, provider = run_model_dispatch(
-            provider, model, system_prompt, user_prompt, schema, temperature, debug
+        cache.evict()
+
+    # BUILD CACHE
+    build_cache = None
+    if paths.get("build_cache"):
+        cache_config = general_config.get("cache", {})
+        build_cache = BuildCache(
+            paths["build_cache"],
+            cache_config.get("build_max_size_mb", 256),
+            cache_config.get("max_age_days", 30),
         )
-        tokens = normalize_usage_dispatch(provider, usage)
-
-        call_cost = compute_cost(model, tokens, pricing)
-
-        # FINAL SCORE
-        combined = compute_final_score(
-            metrics,
-            parsed,
-            tests_weights,
-            llm_weights,
-            combined_weights,
-            exam_ctx.quest_weights,
-            pvcheck_csv_scores,
+        build_cache.evict()
+
+    # BUDGET (projected from llm.toml prices and the expected completion size)
+    completion_tokens = general_config.get("budget", {}).get("completion_tokens", 1000)
+    budget = None
+    if input_args.budget is not None:
+        budget = Budget(
+            input_args.budget,
+            models[0],
+            pricing,
+            completion_tokens,
+            input_args.fallback_model,
         )
 
-        # SAVE OUTPUT path
-        timestamp = datetime.now().strftime("%H-%M-%S")
-        output_dir = Path(paths.get("output")) / make_safe_dirname(input_args.model)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        output_name = (
-            f"{timestamp}_{program_name}_{system_prompt_name}_{user_prompt_name}.json"
-        )
-        output_path = output_dir / output_name
-
-        save_json_and_html(
-            program_info,
-            output_path,
-            parsed,
-            input_args.model,
-            provider,
-            tokens,
-            call_cost,
-            combined,
+    # JOB LEDGER (always written, so that any run can be resumed)
+    output_dir = Path(paths.get("output")) / make_safe_dirname(models[0])
+    ledger = JobLedger(output_dir / "ledger.sqlite")
+
+    settings = RunSettings(
+        model=models[0],
+        provider=providers[0],
+        temperature=input_args.temperature,
+        debug=debug,
+        tests=tests,
+        tests_weights=tests_weights,
+        questions=questions,
+        llm_weights=llm_weights,
+        combined_weights=combined_weights,
+        pricing=pricing,
+        schema=schema,
+        topics_md=args_md,
+        sys_prompt_path=Path(sys_prompt_path),
+        usr_prompt_path=Path(usr_prompt_path),
+        exam_dir=exam_dir,
+        exam_ctx=exam_ctx,
+        output_dir=output_dir,
+        session=session,
+        cache=cache,
+        build_cache=build_cache,
+        refresh=input_args.refresh,
+        retry=RetryPolicy(**general_config.get("retry", {})),
+        performance=questions.get("performance", {}),
+        complexity=complexity,
+        bench_runs=input_args.bench_runs,
+        bench_warmup=input_args.bench_warmup,
+        ledger=ledger,
+        resume=input_args.resume,
+        diagnostics_prompt=input_args.diagnostics,
+        dedup_threshold=input_args.dedup,
+        code_render=code_render,
+        budget=budget,
+        cascade_model=input_args.cascade,
+        cascade=llm_config.get("cascade", {}),
+        split_topics=input_args.split_topics,
+        samples=max(1, input_args.samples),
+        sampling=llm_config.get("samples", {}),
+        completion_tokens=completion_tokens,
+    )
+    # Each model writes its own reports, ledger and usage totals
+    ensemble = [settings]
+    for model, provider in zip(models[1:], providers[1:], strict=True):
+        output_dir = Path(paths.get("output")) / make_safe_dirname(model)
+        ensemble.append(
+            replace(
+                settings,
+                model=model,
+                provider=provider,
+                output_dir=output_dir,
+                ledger=JobLedger(output_dir / "ledger.sqlite"),
+                totals=UsageTotals(),
+            )
         )
 
+    # PROVIDER CONCURRENCY (config values cap --max_inflight, AIMD below that)
+    limits = {
+        p: min(n, input_args.max_inflight)
+        for p, n in general_config.get("limits", {}).items()
+    }
+    limiter = ProviderLimiter(input_args.max_inflight, limits)
+
+    # EVALUATION (a single program keeps failing loudly)
+    try:
+        if batch == "submit":
+            failed = batch_submit(
+                program_paths,
+                settings,
+                input_args.jobs,
+                input_args.upload,
+                input_args.base_url,
+            )
+        elif batch == "collect":
+            failed = batch_collect(
+                program_paths,
+                settings,
+                input_args.results,
+                input_args.base_url,
+                general_config.get("batch", {}).get("discount", 0.5),
+            )
+            if settings.totals.calls:
+                logger.info(settings.totals.summary())
+        else:
+            failed = asyncio.run(
+                run_batch(
+                    program_paths,
+                    ensemble,
+                    input_args.jobs,
+                    limiter,
+                    fail_fast=len(program_paths) == 1,
+                )
+            )
+    finally:
+        session.close()
+        close_clients()
+    if failed:
+        raise APIError(f"{len(failed)} evaluation(s) failed: {', '.join(failed)}")
+
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+import requests
+from google import genai
+from openai import AsyncOpenAI, OpenAI
+from requests.adapters import HTTPAdapter
+
+# Connections kept alive per host; should cover the number of in-flight calls
+POOL_MAXSIZE = 32
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(key, factory):
+    """Return the client registered under key, creating it on first use."""
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = factory()
+        return client
+
+
+def openai_client(api_key: str, base_url: str | None = None, max_retries=2) -> OpenAI:
+    """Shared OpenAI SDK client (also used for OpenRouter through base_url)."""
+    return _get_or_create(
+        ("openai", base_url, api_key, max_retries),
+        lambda: OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries),
+    )
+
+
+def async_openai_client(
+    api_key: str, base_url: str | None = None, max_retries=2
+) -> AsyncOpenAI:
+    """Shared async OpenAI SDK client for the running event loop.
+
+    Async connection pools are bound to the loop that opened them, so each
+    loop gets its own client.
+    """
+    loop = asyncio.get_running_loop()
+    return _get_or_create(
+        ("openai-async", id(loop), base_url, api_key, max_retries),
+        lambda: AsyncOpenAI(
+            api_key=api_key, base_url=base_url, max_retries=max_retries
+        ),
+    )
+
+
+def gemini_client(api_key: str) -> genai.Client:
+    """Shared Google GenAI client."""
+    return _get_or_create(("google", api_key), lambda: genai.Client(api_key=api_key))
+
+
+def http_session(api_key: str) -> requests.Session:
+    """Shared keep-alive session for raw HTTP calls authenticated with api_key."""
+
+    def factory():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(
+            {
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            }
+        )
+        return session
+
+    return _get_or_create(("http", api_key), factory)
+
+
+def close_clients() -> None:
+    """Close every pooled sync client and forget them."""
+    with _lock:
+        keys = [k for k in _clients if k[0] != "openai-async"]
+        clients = [_clients.pop(k) for k in keys]
+    for client in clients:
+        close = getattr(client, "close", None)
+        if close:
+            close()
+
+
+async def aclose_clients() -> None:
+    """Close the async clients of the running loop, Gemini's included."""
+    loop_id = id(asyncio.get_running_loop())
+    with _lock:
+        keys = [k for k in _clients if k[:2] == ("openai-async", loop_id)]
+        clients = [_clients.pop(k) for k in keys]
+        gemini = [c for k, c in _clients.items() if k[0] == "google"]
+    for client in clients:
+        await client.close()
+    for client in gemini:
+        await client.aio.aclose()
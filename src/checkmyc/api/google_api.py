@@ -1,31 +1,33 @@
 import json
 
-from google import genai
-from google.genai import types
+from google.genai import errors as genai_errors, types
 
+from ..api.clients import gemini_client
 from ..api.utils_api import (
-    APIError,
     InvalidResponseError,
     check_api_key,
     json_to_gemini_schema,
+    to_api_error,
 )
 
 
 def normalize_usage_gemini(usage: dict) -> dict:
     return {
-        "prompt_tokens": usage.get("prompt_token_count", 0),
-        "completion_tokens": usage.get("candidates_token_count", 0),
-        "cached_tokens": usage.get("cached_content_token_count", 0),
-        "total_tokens": usage.get("total_token_count", 0),
+        "prompt_tokens": usage.get("prompt_token_count") or 0,
+        "completion_tokens": usage.get("candidates_token_count") or 0,
+        "cached_tokens": usage.get("cached_content_token_count") or 0,
+        "total_tokens": usage.get("total_token_count") or 0,
     }
 
 
-def run_gemini(sys_prompt, usr_prompt, schema, model, temperature, debug):
-    """Execute a Gemini API call with structured JSON output"""
+def _gemini_request(
+    sys_prompt, usr_prompt, schema, model, temperature, candidates=1
+) -> dict:
+    """Build the generate_content arguments for a structured JSON evaluation.
 
-    key = check_api_key("GEMINI_API_KEY")
+    candidates is the number of answers to sample from the same prompt.
+    """
     gemini_schema = json_to_gemini_schema(schema)
-    client = genai.Client(api_key=key)
 
     contents = [
         types.Content(
@@ -38,31 +40,35 @@ def run_gemini(sys_prompt, usr_prompt, schema, model, temperature, debug):
         )
     ]
 
-    try:
-        response = client.models.generate_content(
-            model=model,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                temperature=temperature,
-                response_mime_type="application/json",
-                response_schema=gemini_schema,
-                candidate_count=1,
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(
-                    disable=True
-                ),
+    return {
+        "model": model,
+        "contents": contents,
+        "config": types.GenerateContentConfig(
+            temperature=temperature,
+            response_mime_type="application/json",
+            response_schema=gemini_schema,
+            candidate_count=candidates,
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(
+                disable=True
             ),
-        )
-    except APIError as e:
-        raise APIError(f"Gemini API call failed: {e}") from e
-    except Exception as e:
-        raise Exception(f"An unexpected error occurred: {e}") from e
+        ),
+    }
+
 
+def _parse_gemini(response, debug, candidates=1):
+    """Return the parsed answer, or the list of them for several candidates."""
     if debug:
         print(response)
 
     try:
-        parsed = json.loads(response.text)
-    except json.JSONDecodeError as e:
+        if candidates > 1:
+            parsed = [
+                json.loads("".join(part.text or "" for part in c.content.parts))
+                for c in response.candidates
+            ]
+        else:
+            parsed = json.loads(response.text)
+    except (AttributeError, TypeError, json.JSONDecodeError) as e:
         raise InvalidResponseError(
             f"Malformed or invalid JSON in Gemini response: {response.text}"
         ) from e
@@ -70,3 +76,43 @@ def run_gemini(sys_prompt, usr_prompt, schema, model, temperature, debug):
     usage_info = response.usage_metadata.model_dump() if response.usage_metadata else {}
 
     return parsed, usage_info
+
+
+def run_gemini(sys_prompt, usr_prompt, schema, model, temperature, debug):
+    """Execute a Gemini API call with structured JSON output"""
+
+    key = check_api_key("GEMINI_API_KEY")
+    client = gemini_client(key)
+
+    try:
+        response = client.models.generate_content(
+            **_gemini_request(sys_prompt, usr_prompt, schema, model, temperature)
+        )
+    except genai_errors.APIError as e:
+        raise to_api_error(e, f"Gemini API call failed: {e}") from e
+    except Exception as e:
+        raise Exception(f"An unexpected error occurred: {e}") from e
+
+    return _parse_gemini(response, debug)
+
+
+async def run_gemini_async(
+    sys_prompt, usr_prompt, schema, model, temperature, debug, candidates=1
+):
+    """Async variant of run_gemini; with candidates > 1 it returns a list."""
+
+    key = check_api_key("GEMINI_API_KEY")
+    client = gemini_client(key)
+
+    try:
+        response = await client.aio.models.generate_content(
+            **_gemini_request(
+                sys_prompt, usr_prompt, schema, model, temperature, candidates
+            )
+        )
+    except genai_errors.APIError as e:
+        raise to_api_error(e, f"Gemini API call failed: {e}") from e
+    except Exception as e:
+        raise Exception(f"An unexpected error occurred: {e}") from e
+
+    return _parse_gemini(response, debug, candidates)
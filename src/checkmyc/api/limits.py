@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+
+class AdaptiveLimiter:
+    """Concurrency window for one provider, tuned by AIMD.
+
+    Every successful call widens the window by 1/limit (about +1 per full
+    window of successes); a throttling response halves it, at most once per
+    cooldown so that a burst of 429s from the same window counts once. The
+    number of in-flight calls therefore settles just below what the provider
+    accepts.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, cooldown: float = 2.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.cooldown = cooldown
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class ProviderLimiter:
+    """Bound the number of concurrent model calls sent to each provider."""
+
+    def __init__(self, default_limit: int, limits: dict | None = None):
+        self.default_limit = max(1, default_limit)
+        self.limits = limits or {}
+        self._windows: dict[str, AdaptiveLimiter] = {}
+
+    def slot(self, provider: str) -> AdaptiveLimiter:
+        """Return the adaptive window guarding calls to provider."""
+        if provider not in self._windows:
+            limit = self.limits.get(provider, self.default_limit)
+            self._windows[provider] = AdaptiveLimiter(limit)
+        return self._windows[provider]
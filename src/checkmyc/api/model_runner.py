@@ -1,9 +1,11 @@
-from .google_api import normalize_usage_gemini, run_gemini
-from .openai_api import normalize_usage_openai, run_openai
+from .google_api import normalize_usage_gemini, run_gemini, run_gemini_async
+from .openai_api import normalize_usage_openai, run_openai, run_openai_async
 from .openrouter_api import (
     normalize_usage_openrouter,
     run_openrouter,
+    run_openrouter_async,
     run_router_request,
+    run_router_request_async,
 )
 
 PROVIDERS = {
@@ -12,6 +14,26 @@ PROVIDERS = {
     "openrouter": (run_openrouter, normalize_usage_openrouter),
 }
 
+ASYNC_PROVIDERS = {
+    "openai": run_openai_async,
+    "google": run_gemini_async,
+    "openrouter": run_openrouter_async,
+}
+
+
+# APIs that sample several answers to the same prompt in one request
+NATIVE_SAMPLES = ("google",)
+
+
+def provider_group(provider) -> str:
+    """Return the API actually used for provider (anything else is OpenRouter)."""
+    return provider if provider in ("google", "openai") else "openrouter"
+
+
+def native_samples(provider) -> bool:
+    """Tell whether provider's API returns several candidates in one call."""
+    return bool(provider) and provider_group(provider) in NATIVE_SAMPLES
+
 
 def run_model_dispatch(
     provider, model, system_prompt, user_prompt, schema, temperature, debug
@@ -31,6 +53,44 @@ def run_model_dispatch(
     return parsed, usage, provider
 
 
+async def run_model_dispatch_async(
+    provider,
+    model,
+    system_prompt,
+    user_prompt,
+    schema,
+    temperature,
+    debug,
+    prompt_cache_key=None,
+    candidates=1,
+):
+    """Async variant of run_model_dispatch.
+
+    prompt_cache_key is forwarded to the APIs that accept one (OpenAI). With
+    candidates > 1 (native_samples providers only) parsed is a list of that
+    many answers, and usage covers all of them.
+    """
+    if candidates > 1 and not native_samples(provider):
+        raise ValueError(f"{provider or 'openrouter'} cannot sample {candidates}")
+    if provider:
+        group = provider_group(provider)
+        extra = (
+            {"prompt_cache_key": prompt_cache_key}
+            if group == "openai" and prompt_cache_key
+            else {}
+        )
+        if candidates > 1:
+            extra["candidates"] = candidates
+        parsed, usage = await ASYNC_PROVIDERS[group](
+            system_prompt, user_prompt, schema, model, temperature, debug, **extra
+        )
+        return parsed, usage, provider
+    parsed, usage, provider = await run_router_request_async(
+        system_prompt, user_prompt, schema, model, 0, 0, temperature, debug
+    )
+    return parsed, usage, provider
+
+
 def normalize_usage_dispatch(provider, usage):
     if provider:
         if provider == "google" or provider == "openai":
@@ -39,3 +99,35 @@ def normalize_usage_dispatch(provider, usage):
             _, norm_func = PROVIDERS["openrouter"]
         return norm_func(usage)
     return normalize_usage_openrouter(usage)
+
+
+def compute_cost(model_name, tokens_count, pricing_data):
+    """Return the USD cost of a call from the per-1M-token prices in llm.toml.
+
+    Cached tokens are part of the prompt tokens: when the model has a
+    cached_tokens price they are billed at that rate instead of the prompt one.
+    """
+    if model_name not in pricing_data:
+        return " Not specified in llm.toml"
+
+    model_prices = pricing_data[model_name]
+    tokens_count = dict(tokens_count)
+    if "cached_tokens" in model_prices:
+        cached = tokens_count.get("cached_tokens", 0)
+        tokens_count["prompt_tokens"] = tokens_count.get("prompt_tokens", 0) - cached
+    tot_cost = 0
+    for token_type, count in tokens_count.items():
+        if token_type not in model_prices:
+            continue
+        rate = model_prices[token_type]  # USD per 1M tokens
+        tot_cost += (count / 1000000) * rate
+    return tot_cost
+
+
+def cache_savings(model_name, tokens_count, pricing_data) -> float:
+    """Return the USD saved by the cached prompt tokens of a call."""
+    model_prices = pricing_data.get(model_name, {})
+    if "cached_tokens" not in model_prices:
+        return 0.0
+    discount = model_prices.get("prompt_tokens", 0) - model_prices["cached_tokens"]
+    return tokens_count.get("cached_tokens", 0) / 1000000 * discount
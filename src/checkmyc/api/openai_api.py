@@ -1,42 +1,50 @@
 import json
 
-from openai import OpenAI
-
-from ..api.utils_api import APIError, InvalidResponseError, check_api_key
+from ..api.clients import async_openai_client, openai_client
+from ..api.utils_api import InvalidResponseError, check_api_key, to_api_error
 
 
 def normalize_usage_openai(usage: dict) -> dict:
     return {
         "prompt_tokens": usage.get("input_tokens", 0),
         "completion_tokens": usage.get("output_tokens", 0),
-        "cached_tokens": usage.get("cached_tokens", 0),
+        "cached_tokens": (usage.get("input_tokens_details") or {}).get(
+            "cached_tokens", 0
+        ),
         "total_tokens": usage.get("total_tokens", usage.get("total", 0)),
     }
 
 
-def run_openai(sys_prompt, usr_prompt, schema, model, temperature, debug):
-    key = check_api_key("OPENAI_API_KEY")
-    client = OpenAI(api_key=key, max_retries=0)
-    try:
-        response = client.responses.create(
-            model=model,
-            input=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": usr_prompt},
-            ],
-            text={
-                "format": {
-                    "type": "json_schema",
-                    "name": "response_schema",
-                    "strict": True,
-                    "schema": schema,
-                }
-            },
-            temperature=temperature,
-        )
-    except Exception as e:
-        raise APIError(f"OpenAI API call failed: {e}") from e
+def _responses_request(
+    sys_prompt, usr_prompt, schema, model, temperature, prompt_cache_key=None
+) -> dict:
+    """Build the Responses API arguments for a structured JSON evaluation.
 
+    prompt_cache_key groups requests sharing a prompt prefix, so that they are
+    routed to the same provider-side prompt cache.
+    """
+    request = {
+        "model": model,
+        "input": [
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": usr_prompt},
+        ],
+        "text": {
+            "format": {
+                "type": "json_schema",
+                "name": "response_schema",
+                "strict": True,
+                "schema": schema,
+            }
+        },
+        "temperature": temperature,
+    }
+    if prompt_cache_key:
+        request["prompt_cache_key"] = prompt_cache_key
+    return request
+
+
+def _parse_response(response, debug):
     if debug:
         print(response)
 
@@ -46,3 +54,126 @@ def run_openai(sys_prompt, usr_prompt, schema, model, temperature, debug):
     except (AttributeError, IndexError, json.JSONDecodeError) as err:
         raise InvalidResponseError("Invalid JSON in response.") from err
     return parsed, response.usage.model_dump()
+
+
+def run_openai(
+    sys_prompt, usr_prompt, schema, model, temperature, debug, prompt_cache_key=None
+):
+    key = check_api_key("OPENAI_API_KEY")
+    client = openai_client(key, max_retries=0)
+    try:
+        response = client.responses.create(
+            **_responses_request(
+                sys_prompt, usr_prompt, schema, model, temperature, prompt_cache_key
+            )
+        )
+    except Exception as e:
+        raise to_api_error(e, f"OpenAI API call failed: {e}") from e
+
+    return _parse_response(response, debug)
+
+
+async def run_openai_async(
+    sys_prompt, usr_prompt, schema, model, temperature, debug, prompt_cache_key=None
+):
+    """Async variant of run_openai."""
+    key = check_api_key("OPENAI_API_KEY")
+    client = async_openai_client(key, max_retries=0)
+    try:
+        response = await client.responses.create(
+            **_responses_request(
+                sys_prompt, usr_prompt, schema, model, temperature, prompt_cache_key
+            )
+        )
+    except Exception as e:
+        raise to_api_error(e, f"OpenAI API call failed: {e}") from e
+
+    return _parse_response(response, debug)
+
+
+# Batch API: requests of a whole run in one file, answered within the window
+BATCH_ENDPOINT = "/v1/responses"
+BATCH_WINDOW = "24h"
+# Batch states after which no more results come
+BATCH_ENDED = ("completed", "expired", "cancelled", "failed")
+
+
+def batch_request_line(
+    custom_id,
+    sys_prompt,
+    usr_prompt,
+    schema,
+    model,
+    temperature,
+    prompt_cache_key=None,
+) -> dict:
+    """Return the line of a Batch API request file for an evaluation."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": _responses_request(
+            sys_prompt, usr_prompt, schema, model, temperature, prompt_cache_key
+        ),
+    }
+
+
+def submit_batch(requests_path, base_url=None) -> str:
+    """Upload a Batch API request file, start its batch and return the batch id."""
+    key = check_api_key("OPENAI_API_KEY")
+    client = openai_client(key, base_url)
+    try:
+        with open(requests_path, "rb") as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_WINDOW,
+        )
+    except Exception as e:
+        raise to_api_error(e, f"OpenAI batch submission failed: {e}") from e
+    return batch.id
+
+
+def fetch_batch(batch_id, base_url=None) -> tuple[str, list[dict]]:
+    """Return the status of a batch and, once it ended, its result lines.
+
+    The lines of failed requests come from the batch's error file.
+    """
+    key = check_api_key("OPENAI_API_KEY")
+    client = openai_client(key, base_url)
+    lines = []
+    try:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in BATCH_ENDED:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    text = client.files.content(file_id).text
+                    lines += [json.loads(line) for line in text.splitlines() if line]
+    except json.JSONDecodeError as e:
+        raise InvalidResponseError(f"Malformed batch results of {batch_id}") from e
+    except Exception as e:
+        raise to_api_error(e, f"OpenAI batch retrieval failed: {e}") from e
+    return batch.status, lines
+
+
+def parse_batch_result(line: dict):
+    """Return (parsed, usage) of a Batch API result line, like _parse_response."""
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        raise InvalidResponseError(
+            f"Batch request failed: {line.get('error') or response.get('body')}"
+        )
+    body = response.get("body") or {}
+    try:
+        text = next(
+            content["text"]
+            for item in body["output"]
+            if item.get("type") == "message"
+            for content in item["content"]
+            if content.get("type") == "output_text"
+        )
+        parsed = json.loads(text)
+    except (KeyError, TypeError, StopIteration, json.JSONDecodeError) as err:
+        raise InvalidResponseError("Invalid JSON in batch response.") from err
+    return parsed, body.get("usage") or {}
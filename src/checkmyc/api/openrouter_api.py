@@ -1,75 +1,127 @@
 import json
-from typing import re
+import re
 
 import requests
-from openai import OpenAI
 
-from ..api.utils_api import APIError, InvalidResponseError, check_api_key
+from ..api.clients import async_openai_client, http_session, openai_client
+from ..api.utils_api import InvalidResponseError, check_api_key, to_api_error
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1"
 
 
 def normalize_usage_openrouter(usage: dict) -> dict:
     return {
-        "prompt_tokens": getattr(usage, "prompt_tokens", 0),
-        "completion_tokens": getattr(usage, "completion_tokens", 0),
-        "cached_tokens": getattr(
-            getattr(usage, "prompt_tokens_details", {}), "cached_tokens", 0
-        )
-        + getattr(getattr(usage, "completion_tokens_details", {}), "cached_tokens", 0),
-        "total_tokens": getattr(usage, "total_tokens", 0),
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        or 0,
+        "total_tokens": usage.get("total_tokens") or 0,
     }
 
 
-def run_openrouter(sys_prompt, usr_prompt, schema, model, temperature, debug):
-    """Execute an API call using OpenRouter with structured JSON output"""
-    key = check_api_key("OPENROUTER_API_KEY1")
+def _chat_request(sys_prompt, usr_prompt, schema, model, temperature) -> dict:
+    """Build the chat completion arguments shared by every OpenRouter call."""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": usr_prompt},
+        ],
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "output_schema", "strict": True, "schema": schema},
+        },
+        "temperature": temperature,
+    }
 
-    client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=key)
 
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": usr_prompt},
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "output_schema",
-                    "strict": True,
-                    "schema": schema,
-                },
+def _router_options(prompt_max_price, completion_max_price) -> dict:
+    """OpenRouter-specific fields for provider routing and price constraints."""
+    return {
+        "provider": {
+            "sort": "price",
+            "max_price": {
+                "prompt": prompt_max_price,
+                "completion": completion_max_price,
             },
-            temperature=temperature,
-        )
-    except Exception as e:
-        raise APIError(f"OpenRouter API call failed: {e}") from e
+            "allow_fallbacks": True,
+        },
+        "structured_output": True,
+        "usage": {"include": True},
+    }
 
-    if debug:
-        print(response)
 
-    # Robust aggregation
-    message = getattr(response.choices[0], "message", {})
-    content = getattr(message, "content", "").strip()
+def _extract_json(message: dict):
+    """Parse the JSON answer of a chat message, falling back to its reasoning."""
+    content = (message.get("content") or "").strip()
 
-    # Fallback: try reasoning field if content empty
+    # Fallback: if content empty, try to extract from reasoning field
     if not content:
-        reasoning = getattr(message, "reasoning", "")
+        reasoning = message.get("reasoning") or ""
         if reasoning:
             match = re.search(r"```json\s*(\{.*\})\s*```", reasoning, re.DOTALL)
             content = match.group(1).strip() if match else reasoning.strip()
 
-    if not content:
-        raise InvalidResponseError(f"Empty or malformed response: {response}")
+    return json.loads(content)
+
+
+def _parse_completion(response, debug):
+    if debug:
+        print(response)
 
     try:
-        parsed = json.loads(content.strip())
-    except json.JSONDecodeError as e:
-        raise InvalidResponseError(f"Invalid JSON in response: {content}") from e
+        message = response.choices[0].message.model_dump()
+        parsed = _extract_json(message)
+    except (AttributeError, IndexError, json.JSONDecodeError) as e:
+        raise InvalidResponseError(f"Empty or malformed response: {response}") from e
 
     return parsed, response.usage.model_dump()
 
 
+def _parse_router_data(data: dict, debug):
+    if debug:
+        print(data)
+
+    try:
+        parsed = _extract_json(data["choices"][0]["message"])
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        raise InvalidResponseError(f"Malformed OpenRouter response: {data}") from e
+
+    return parsed, data.get("usage") or {}, data.get("provider")
+
+
+def run_openrouter(sys_prompt, usr_prompt, schema, model, temperature, debug):
+    """Execute an API call using OpenRouter with structured JSON output"""
+    key = check_api_key("OPENROUTER_API_KEY1")
+    client = openai_client(key, base_url=OPENROUTER_URL)
+
+    try:
+        response = client.chat.completions.create(
+            **_chat_request(sys_prompt, usr_prompt, schema, model, temperature)
+        )
+    except Exception as e:
+        raise to_api_error(e, f"OpenRouter API call failed: {e}") from e
+
+    return _parse_completion(response, debug)
+
+
+async def run_openrouter_async(
+    sys_prompt, usr_prompt, schema, model, temperature, debug
+):
+    """Async variant of run_openrouter."""
+    key = check_api_key("OPENROUTER_API_KEY1")
+    client = async_openai_client(key, base_url=OPENROUTER_URL, max_retries=0)
+
+    try:
+        response = await client.chat.completions.create(
+            **_chat_request(sys_prompt, usr_prompt, schema, model, temperature)
+        )
+    except Exception as e:
+        raise to_api_error(e, f"OpenRouter API call failed: {e}") from e
+
+    return _parse_completion(response, debug)
+
+
 def run_router_request(
     sys_prompt,
     usr_prompt,
@@ -82,67 +134,56 @@ def run_router_request(
 ):
     """Execute direct OpenRouter API call with explicit provider control and price constraints."""
     key = check_api_key("OPENROUTER_API_KEY1")
-
-    headers = {
-        "Authorization": f"Bearer {key}",
-        "Content-Type": "application/json",
-    }
+    session = http_session(key)
 
     payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": usr_prompt},
-        ],
-        "response_format": {
-            "type": "json_schema",
-            "json_schema": {"name": "output_schema", "strict": True, "schema": schema},
-        },
-        "provider": {
-            "sort": "price",
-            "max_price": {
-                "prompt": prompt_max_price,
-                "completion": completion_max_price,
-            },
-            "allow_fallbacks": True,
-        },
-        "temperature": temperature,
-        "structured_output": True,
-        "usage": {"include": True},
+        **_chat_request(sys_prompt, usr_prompt, schema, model, temperature),
+        **_router_options(prompt_max_price, completion_max_price),
     }
 
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
+        response = session.post(
+            f"{OPENROUTER_URL}/chat/completions",
             json=payload,
             timeout=60,
         )
         response.raise_for_status()
         data = response.json()
     except requests.RequestException as e:
-        raise APIError(f"OpenRouter HTTP error: {e}") from e
+        raise to_api_error(e, f"OpenRouter HTTP error: {e}") from e
     except json.JSONDecodeError as e:
         raise InvalidResponseError(
             f"Invalid JSON from OpenRouter: {response.text}"
         ) from e
 
-    if debug:
-        print(data)
+    return _parse_router_data(data, debug)
+
+
+async def run_router_request_async(
+    sys_prompt,
+    usr_prompt,
+    schema,
+    model,
+    prompt_max_price,
+    completion_max_price,
+    temperature,
+    debug,
+):
+    """Async variant of run_router_request.
+
+    The routing fields are sent through the SDK's extra_body; the chosen
+    provider comes back as an extra field of the completion.
+    """
+    key = check_api_key("OPENROUTER_API_KEY1")
+    client = async_openai_client(key, base_url=OPENROUTER_URL, max_retries=0)
 
     try:
-        message = data["choices"][0]["message"]
-        content = message.get("content", "").strip()
-
-        # Fallback: if content empty, try to extract from reasoning field
-        if not content:
-            reasoning = message.get("reasoning", "")
-            if reasoning:
-                match = re.search(r"```json\s*(\{.*\})\s*```", reasoning, re.DOTALL)
-                content = match.group(1).strip() if match else reasoning.strip()
-
-        parsed = json.loads(content)
-    except (KeyError, json.JSONDecodeError) as e:
-        raise InvalidResponseError(f"Malformed OpenRouter response: {data}") from e
+        response = await client.chat.completions.create(
+            **_chat_request(sys_prompt, usr_prompt, schema, model, temperature),
+            extra_body=_router_options(prompt_max_price, completion_max_price),
+            timeout=60,
+        )
+    except Exception as e:
+        raise to_api_error(e, f"OpenRouter HTTP error: {e}") from e
 
-    return parsed, data.get("usage", {}), data.get("provider")
+    return _parse_router_data(response.model_dump(), debug)
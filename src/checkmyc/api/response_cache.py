@@ -0,0 +1,121 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections.abc import Iterator
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    provider TEXT,
+    parsed TEXT NOT NULL,
+    usage TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+
+def cache_key(
+    provider, model, sys_prompt, usr_prompt, schema, temperature, variant=None
+) -> str:
+    """Hash everything that determines a model response into a cache key.
+
+    variant tells apart responses to the same request that are meant to
+    differ, such as the samples of --samples.
+    """
+    material = [provider or "", model, sys_prompt, usr_prompt, schema, temperature]
+    if variant is not None:
+        material.append(variant)
+    material = json.dumps(
+        material,
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """On-disk SQLite cache of parsed model responses and their raw usage."""
+
+    def __init__(self, path: Path, max_size_mb: float = 512, max_age_days=30):
+        self.path = Path(path)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 3600
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One connection per operation keeps the cache usable from any thread
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+            yield conn
+
+    def get(self, key: str):
+        """Return (parsed, usage, provider) for key, or None on a miss."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT parsed, usage, provider, created_at FROM responses "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            parsed, usage, provider, created_at = row
+            if time.time() - created_at > self.max_age:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        return json.loads(parsed), json.loads(usage), provider
+
+    def put(self, key: str, parsed, usage, provider) -> None:
+        parsed_json = json.dumps(parsed, ensure_ascii=False)
+        usage_json = json.dumps(usage, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, provider, parsed, usage, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    provider,
+                    parsed_json,
+                    usage_json,
+                    len(parsed_json) + len(usage_json),
+                    now,
+                    now,
+                ),
+            )
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones above max size."""
+        with self._connect() as conn:
+            removed = conn.execute(
+                "DELETE FROM responses WHERE created_at < ?",
+                (time.time() - self.max_age,),
+            ).rowcount
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total > self.max_size:
+                rows = conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at"
+                ).fetchall()
+                stale = []
+                for key, size in rows:
+                    if total <= self.max_size:
+                        break
+                    stale.append((key,))
+                    total -= size
+                conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                removed += len(stale)
+        return removed
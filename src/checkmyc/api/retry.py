@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+
+from .limits import AdaptiveLimiter
+from .utils_api import RetryableAPIError
+
+logger = logging.getLogger(__name__)
+
+# Statuses meaning "slow down" rather than a one-off failure
+THROTTLE_STATUS = {429, 503, 529}
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def backoff(self, attempt: int, retry_after: float | None) -> float:
+        """Delay before the next attempt: the provider's hint or full jitter."""
+        if retry_after is not None:
+            # Small jitter so throttled calls do not all come back together
+            return min(self.max_delay, retry_after + random.uniform(0, 1))
+        cap = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, cap)
+
+
+async def call_with_retry(call, window: AdaptiveLimiter, policy: RetryPolicy, name=""):
+    """Await call() inside window, retrying transient provider errors.
+
+    call is a zero-argument function returning a fresh coroutine. Throttling
+    responses shrink the window; successes grow it back. The wait between
+    attempts happens outside the window, so it does not hold a slot.
+    """
+    for attempt in range(1, policy.max_attempts + 1):
+        async with window:
+            try:
+                result = await call()
+            except RetryableAPIError as e:
+                if e.status in THROTTLE_STATUS:
+                    window.on_throttle()
+                if attempt == policy.max_attempts:
+                    raise
+                delay = policy.backoff(attempt, e.retry_after)
+                logger.warning(
+                    f"{name}: attempt {attempt} failed ({e}), retrying in "
+                    f"{delay:.1f}s (window {int(window.limit)})"
+                )
+            else:
+                window.on_success()
+                return result
+        await asyncio.sleep(delay)
@@ -1,6 +1,14 @@
 import os
+import re
+import time
+from email.utils import parsedate_to_datetime
 
-from google.genai import types
+import openai
+import requests
+from google.genai import errors as genai_errors, types
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits, overloads
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
 
 
 class APIError(Exception):
@@ -11,6 +19,88 @@ class InvalidResponseError(APIError):
     pass
 
 
+class RetryableAPIError(APIError):
+    """Transient failure (rate limit, overload, network) that may succeed later."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _parse_duration(value: str) -> float | None:
+    """Parse rate-limit reset values such as '20ms', '1.5s' or '6m0s'."""
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts or "".join(n + u for n, u in parts) != value.strip():
+        return None
+    return sum(float(n) * units[u] for n, u in parts)
+
+
+def _to_float(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_from_headers(headers) -> float | None:
+    """Return how many seconds the provider asks us to wait, if it says so."""
+    if not headers:
+        return None
+    headers = {k.lower(): v for k, v in headers.items()}
+
+    if (ms := _to_float(headers.get("retry-after-ms"))) is not None:
+        return max(0.0, ms / 1000)
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        if (seconds := _to_float(value)) is not None:
+            return max(0.0, seconds)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    # OpenAI style resets ("6m0s"): wait for the exhausted budget, if known
+    resets, exhausted = [], []
+    for kind in ("requests", "tokens"):
+        reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}", ""))
+        if reset is None:
+            continue
+        resets.append(reset)
+        if _to_float(headers.get(f"x-ratelimit-remaining-{kind}")) == 0:
+            exhausted.append(reset)
+    if exhausted:
+        return max(exhausted)
+    if resets:
+        return min(resets)
+
+    # OpenRouter reports the reset as epoch milliseconds
+    if (reset_ms := _to_float(headers.get("x-ratelimit-reset"))) is not None:
+        return max(0.0, reset_ms / 1000 - time.time())
+    return None
+
+
+def to_api_error(error: Exception, message: str) -> APIError:
+    """Wrap an SDK/HTTP exception, marking transient failures as retryable."""
+    status, headers = None, None
+    if isinstance(error, openai.APIStatusError):
+        status, headers = error.status_code, error.response.headers
+    elif isinstance(error, openai.APIConnectionError | requests.ConnectionError):
+        return RetryableAPIError(message)
+    elif isinstance(error, requests.Timeout):
+        return RetryableAPIError(message, status=408)
+    elif isinstance(error, requests.HTTPError) and error.response is not None:
+        status, headers = error.response.status_code, error.response.headers
+    elif isinstance(error, genai_errors.APIError):
+        status = error.code
+        headers = getattr(error.response, "headers", None)
+
+    if status in RETRYABLE_STATUS:
+        return RetryableAPIError(message, status, retry_after_from_headers(headers))
+    return APIError(message)
+
+
 def check_api_key(env_var) -> str:
     key = os.getenv(env_var)
     if not key:
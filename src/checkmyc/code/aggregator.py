@@ -8,8 +8,7 @@ from typing import Any
 
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-from src.checkmyc.__main__ import compute_cost
-from src.checkmyc.api.model_runner import normalize_usage_dispatch
+from src.checkmyc.api.model_runner import compute_cost, normalize_usage_dispatch
 from src.checkmyc.api.openai_api import run_openai
 from src.checkmyc.code.config import render_prompts
 
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from ..api.model_runner import cache_savings, compute_cost, normalize_usage_dispatch
+from ..api.openai_api import (
+    BATCH_ENDED,
+    batch_request_line,
+    fetch_batch,
+    parse_batch_result,
+    submit_batch,
+)
+from .cascade import repair_evaluation
+from .pipeline import (
+    Job,
+    RunSettings,
+    Submission,
+    call_key,
+    load_job,
+    prepare_submission,
+    record_stage,
+    save_submission,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def custom_id(job: Job) -> str:
+    """Stable id of a program's request: same path and source, same id."""
+    digest = hashlib.sha256(f"{job.program}\0{job.source_hash}".encode()).hexdigest()
+    return f"{Path(job.program).stem[:40]}-{digest[:16]}"
+
+
+def batch_submit(
+    program_paths: list[Path],
+    settings: RunSettings,
+    jobs: int,
+    upload: bool = False,
+    base_url: str | None = None,
+) -> list[str]:
+    """Test every program and write the Batch API requests of their evaluations.
+
+    The objective tests run in a pool of `jobs` threads as in a normal run.
+    Each program is recorded in the ledger (stage "batch") with its request
+    id and what batch_collect needs to score it. With upload, the file is
+    sent to the provider and the batch started. Return the names of the
+    programs that could not be prepared.
+    """
+    failed, lines = [], []
+
+    def prepare(program_path):
+        job = load_job(program_path, settings)
+        return job, prepare_submission(program_path, settings, job), custom_id(job)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [(p, pool.submit(prepare, p)) for p in program_paths]
+        prepared = []
+        for program_path, future in futures:
+            try:
+                prepared.append(future.result())
+            except Exception as e:
+                logger.error(f"{Path(program_path).name}: preparation failed: {e}")
+                failed.append(Path(program_path).name)
+
+    for _, submission, request_id in prepared:
+        lines.append(
+            batch_request_line(
+                request_id,
+                submission.system_prompt,
+                submission.user_prompt,
+                settings.schema,
+                settings.model,
+                settings.temperature,
+                settings.session.prompt_cache_key,
+            )
+        )
+    if not lines:
+        return failed
+
+    timestamp = datetime.now().strftime("%H-%M-%S")
+    batch_dir = settings.output_dir / "batch"
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    requests_path = batch_dir / f"{timestamp}_requests.jsonl"
+    with requests_path.open("w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    logger.info(f"{len(lines)} batch requests written to {requests_path}")
+
+    batch_id = submit_batch(requests_path, base_url) if upload else None
+    for job, submission, request_id in prepared:
+        record_stage(
+            settings,
+            job,
+            "batch",
+            "done",
+            {
+                "custom_id": request_id,
+                "batch_id": batch_id,
+                "key": call_key(submission, settings, settings.model),
+                "requests": str(requests_path),
+                "program_info": submission.program_info,
+                "metrics": submission.metrics,
+                "pvcheck_csv_scores": submission.pvcheck_csv_scores,
+                "code_tokens": submission.code_tokens,
+                "program_lines": submission.program_lines,
+            },
+        )
+    if batch_id:
+        logger.info(
+            f"Batch {batch_id} started: collect it with `checkmyc batch collect`"
+        )
+    return failed
+
+
+def load_results(paths: list[str], batch_ids: set[str], base_url=None) -> dict:
+    """Return {custom_id: result line} from result files and ended batches."""
+    lines = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            lines += [json.loads(line) for line in f if line.strip()]
+    for batch_id in sorted(batch_ids):
+        status, batch_lines = fetch_batch(batch_id, base_url)
+        if status not in BATCH_ENDED:
+            logger.warning(f"Batch {batch_id} is {status}: its results are not ready")
+        elif status != "completed":
+            logger.warning(f"Batch {batch_id} {status}: collecting its partial results")
+        lines += batch_lines
+    return {line["custom_id"]: line for line in lines}
+
+
+def batch_collect(
+    program_paths: list[Path],
+    settings: RunSettings,
+    results: list[str] | None = None,
+    base_url: str | None = None,
+    discount: float = 1.0,
+) -> list[str]:
+    """Score every submitted program from the results of its batch request.
+
+    results are result files of the Batch API, or batch ids; by default the
+    batches recorded when submitting are fetched. Each response is stored in
+    the response cache and the ledger (so that a normal --resume run reuses
+    it) and the report is saved as in a normal run, with its cost times
+    discount (the batch price). Return the names of the programs not scored.
+    """
+    failed = []
+    jobs = {}
+    for program_path in program_paths:
+        job = load_job(program_path, settings)
+        job.done = settings.ledger.completed(job.program, job.source_hash)
+        if "batch" not in job.done:
+            logger.error(f"{Path(program_path).name}: not submitted in a batch")
+            failed.append(Path(program_path).name)
+        else:
+            jobs[program_path] = job
+
+    files = [r for r in results or [] if Path(r).is_file()]
+    batch_ids = {r for r in results or [] if r not in files}
+    if not results:
+        batch_ids = {j.done["batch"]["batch_id"] for j in jobs.values()} - {None}
+        if not batch_ids and jobs:
+            raise FileNotFoundError(
+                "The batch was not uploaded: pass its result file with --results"
+            )
+    lines = load_results(files, batch_ids, base_url)
+
+    for program_path, job in jobs.items():
+        name = Path(program_path).name
+        batch = job.done["batch"]
+        line = lines.get(batch["custom_id"])
+        if line is None:
+            logger.warning(f"{name}: no batch result yet")
+            failed.append(name)
+            continue
+        try:
+            save_batch_result(job, batch, line, settings, discount)
+        except Exception as e:
+            logger.error(f"{name}: evaluation failed: {e}")
+            failed.append(name)
+    return failed
+
+
+def save_batch_result(
+    job: Job, batch: dict, line: dict, settings: RunSettings, discount: float
+) -> Path:
+    """Score a program from its batch result line and save its report."""
+    parsed, usage = parse_batch_result(line)
+    provider = settings.provider
+    parsed, repairs = repair_evaluation(parsed, list(settings.llm_weights))
+    if repairs:
+        logger.warning(
+            f"{batch['program_info']['name']}: repaired the model result "
+            f"({'; '.join(repairs)})"
+        )
+    if settings.cache:
+        settings.cache.put(batch["key"], parsed, usage, provider)
+    record_stage(
+        settings,
+        job,
+        "llm",
+        "done",
+        {
+            "key": batch["key"],
+            "parsed": parsed,
+            "usage": usage,
+            "provider": provider,
+            "model": settings.model,
+            "batch": batch["custom_id"],
+        },
+    )
+
+    tokens = normalize_usage_dispatch(provider, usage)
+    call_cost = compute_cost(settings.model, tokens, settings.pricing)
+    savings = cache_savings(settings.model, tokens, settings.pricing)
+    if isinstance(call_cost, int | float):
+        call_cost *= discount
+    savings *= discount
+    settings.totals.add(tokens, call_cost, savings)
+    tokens["cache_savings"] = savings
+    tokens["cache_hit"] = False
+    tokens.update(batch["code_tokens"])
+
+    submission = Submission(
+        batch["program_info"],
+        batch["metrics"],
+        batch["pvcheck_csv_scores"],
+        "",
+        "",
+        job,
+        batch["code_tokens"],
+        settings.model,
+        batch["program_lines"],
+        repairs=repairs,
+    )
+    return save_submission(submission, settings, parsed, provider, tokens, call_cost)
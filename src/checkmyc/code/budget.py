@@ -0,0 +1,172 @@
+import logging
+from dataclasses import dataclass
+
+from ..api.model_runner import compute_cost
+
+logger = logging.getLogger(__name__)
+
+# Shortest prompt prefix the providers serve from their prompt cache
+CACHE_MIN_PREFIX = 1024
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised for a model call that the budget cannot pay for."""
+
+
+@dataclass
+class CallEstimate:
+    """Projected prompt tokens of a program's calls, and how many are cached.
+
+    calls is the number of answers expected, each with its completion tokens.
+    """
+
+    prompt_tokens: int
+    cached_tokens: int = 0
+    calls: int = 1
+
+
+def call_cost(model: str, estimate: CallEstimate, completion: int, pricing) -> float:
+    """Return the projected USD cost of calls (0 for a model without prices).
+
+    completion is the expected completion tokens of each call.
+    """
+    cost = compute_cost(
+        model,
+        {
+            "prompt_tokens": estimate.prompt_tokens,
+            "cached_tokens": estimate.cached_tokens,
+            "completion_tokens": completion * estimate.calls,
+        },
+        pricing,
+    )
+    return cost if isinstance(cost, int | float) else 0.0
+
+
+class Budget:
+    """Spending limit of a batch, enforced before each model call.
+
+    The calls still to make are projected from their estimated prompt tokens
+    and the expected completion tokens (the mean of the calls made so far,
+    completion_tokens until there are any); once calls return, prompt
+    estimates are scaled by the ratio of actual to estimated tokens. A call
+    goes to model if the spent and reserved amount, its own cost and the
+    cost of finishing the other pending calls on the fallback model stay
+    within the limit; if not, to the fallback model as long as the call
+    itself fits, and otherwise it is not made at all. Without a fallback
+    model the pending calls are not counted, so the batch runs until the
+    next call would overrun the limit.
+    """
+
+    def __init__(
+        self,
+        limit: float,
+        model: str,
+        pricing: dict,
+        completion_tokens: int = 1000,
+        fallback_model: str | None = None,
+    ):
+        self.limit = limit
+        self.model = model
+        self.fallback_model = fallback_model
+        self.pricing = pricing
+        self.spent = 0.0
+        # Set once a call could not be paid for: later programs are skipped
+        self.exhausted = False
+        # (program, ledger stage) of each call in flight: (cost, prompt tokens)
+        self.reserved: dict[tuple[str, str], tuple[float, int]] = {}
+        self.pending: dict[str, CallEstimate] = {}
+        self._completion_tokens = completion_tokens
+        self._completions: list[int] = []
+        self._estimated_prompt = 0
+        self._actual_prompt = 0
+        for name in filter(None, (model, fallback_model)):
+            if name not in pricing:
+                logger.warning(f"No price for {name} in llm.toml: its calls count 0")
+
+    def expected_completion(self) -> int:
+        if not self._completions:
+            return self._completion_tokens
+        return round(sum(self._completions) / len(self._completions))
+
+    def cost(self, model: str | None, estimate: CallEstimate) -> float:
+        if model is None:
+            return 0.0
+        if self._estimated_prompt:
+            ratio = self._actual_prompt / self._estimated_prompt
+            estimate = CallEstimate(
+                round(estimate.prompt_tokens * ratio),
+                round(estimate.cached_tokens * ratio),
+                estimate.calls,
+            )
+        return call_cost(model, estimate, self.expected_completion(), self.pricing)
+
+    def _committed(self) -> float:
+        return self.spent + sum(cost for cost, _ in self.reserved.values())
+
+    def reserve(
+        self,
+        program: str,
+        prompt_tokens: int,
+        model: str | None = None,
+        stage: str = "llm",
+        calls: int = 1,
+    ) -> str:
+        """Choose the model of a program's call and reserve its cost.
+
+        model (self.model by default) is the one the call asks for; stage
+        tells apart the calls of a program, and calls is the number of
+        answers the call samples. The call is taken off the program's
+        pending projection, which keeps its other calls until release().
+        Raise BudgetExceeded when neither model fits in the budget.
+        """
+        planned = self.pending.get(program, CallEstimate(prompt_tokens))
+        cached = planned.cached_tokens / max(planned.prompt_tokens, 1)
+        estimate = CallEstimate(prompt_tokens, round(prompt_tokens * cached), calls)
+        if program in self.pending:
+            left = CallEstimate(
+                max(0, planned.prompt_tokens - estimate.prompt_tokens),
+                max(0, planned.cached_tokens - estimate.cached_tokens),
+                max(0, planned.calls - calls),
+            )
+            if left.calls:
+                self.pending[program] = left
+            else:
+                del self.pending[program]
+        committed = self._committed()
+        rest = sum(self.cost(self.fallback_model, e) for e in self.pending.values())
+        choices = [(model or self.model, rest)]
+        if self.fallback_model:
+            # Nothing is cheaper than the fallback: it runs while it fits
+            choices.append((self.fallback_model, 0.0))
+        for model, floor in choices:
+            cost = self.cost(model, estimate)
+            if committed + cost + floor <= self.limit:
+                self.reserved[program, stage] = (cost, prompt_tokens)
+                return model
+        self.exhausted = True
+        raise BudgetExceeded(
+            f"budget of ${self.limit:.4f} exhausted "
+            f"(${committed:.4f} spent or reserved)"
+        )
+
+    def settle(
+        self, program: str, cost, tokens: dict, stage: str = "llm", calls: int = 1
+    ) -> None:
+        """Replace the reservation of a returned call with its actual cost.
+
+        tokens is the normalized usage of the call, which sampled calls answers.
+        """
+        _, estimated = self.reserved.pop((program, stage), (0.0, 0))
+        if isinstance(cost, int | float):
+            self.spent += cost
+        if tokens.get("completion_tokens"):
+            self._completions.append(round(tokens["completion_tokens"] / calls))
+        if estimated and tokens.get("prompt_tokens"):
+            self._estimated_prompt += estimated
+            self._actual_prompt += tokens["prompt_tokens"]
+
+    def release(self, program: str) -> None:
+        """Drop what is left of a program's projection (call not made or failed)."""
+        self.pending.pop(program, None)
+        for key in [k for k in self.reserved if k[0] == program]:
+            del self.reserved[key]
@@ -0,0 +1,159 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from collections.abc import Iterator
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+# Part of every key: bumped when what is stored for a build changes, so
+# that older entries are no longer found (they are evicted in time)
+KEY_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    key TEXT PRIMARY KEY,
+    returncode INTEGER NOT NULL,
+    warnings INTEGER NOT NULL,
+    diagnostics TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+
+@functools.cache
+def compiler_id(compiler: str = "gcc") -> str:
+    """Return the compiler's version banner, which identifies its output."""
+    try:
+        result = subprocess.run(
+            [compiler, "--version"], capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return compiler
+    return result.stdout.splitlines()[0] if result.stdout else compiler
+
+
+def build_key(source: bytes, compiler: str, flags: list[str]) -> str:
+    """Hash everything that determines a build into a cache key."""
+    material = json.dumps([KEY_VERSION, compiler_id(compiler), flags]).encode("utf-8")
+    return hashlib.sha256(material + b"\x00" + source).hexdigest()
+
+
+class BuildCache:
+    """Content-addressed cache of compiled programs and their diagnostics.
+
+    Entries are shared by every program with the same source, so stored
+    diagnostics should not name the program's own file. Binaries are stored
+    as files named by key in the cache directory; the outcome of each build
+    is indexed in an SQLite database next to them. Failed builds are cached
+    too, without a binary.
+    """
+
+    def __init__(self, path: Path, max_size_mb: float = 256, max_age_days=30):
+        self.path = Path(path)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 3600
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = self.path / "builds.sqlite"
+        with closing(sqlite3.connect(db, timeout=30)) as conn, conn:
+            yield conn
+
+    def _binary(self, key: str) -> Path:
+        return self.path / key
+
+    def get(self, key: str, exec_path: Path):
+        """Return (returncode, warnings, diagnostics) for key, or None on a miss.
+
+        On a hit of a successful build the binary is copied to exec_path.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT returncode, warnings, diagnostics, created_at FROM builds "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            returncode, warnings, diagnostics, created_at = row
+            binary = self._binary(key)
+            if time.time() - created_at > self.max_age or (
+                returncode == 0 and not binary.exists()
+            ):
+                conn.execute("DELETE FROM builds WHERE key = ?", (key,))
+                binary.unlink(missing_ok=True)
+                return None
+            conn.execute(
+                "UPDATE builds SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        if returncode == 0:
+            shutil.copy2(binary, exec_path)
+        return returncode, warnings, json.loads(diagnostics)
+
+    def put(
+        self, key: str, exec_path: Path, returncode: int, warnings: int, diagnostics
+    ) -> None:
+        size = 0
+        if returncode == 0:
+            # Copied under a temporary name, so that readers never see a
+            # partial binary
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+            os.close(fd)
+            shutil.copy2(exec_path, tmp)
+            os.replace(tmp, self._binary(key))
+            size = self._binary(key).stat().st_size
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO builds "
+                "(key, returncode, warnings, diagnostics, size, created_at, "
+                "accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    returncode,
+                    warnings,
+                    json.dumps(diagnostics, ensure_ascii=False),
+                    size,
+                    now,
+                    now,
+                ),
+            )
+
+    def evict(self) -> int:
+        """Drop expired builds, then least recently used ones above max size."""
+        cutoff = time.time() - self.max_age
+        with self._connect() as conn:
+            stale = conn.execute(
+                "SELECT key FROM builds WHERE created_at < ?", (cutoff,)
+            ).fetchall()
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM builds WHERE created_at >= ?",
+                (cutoff,),
+            ).fetchone()[0]
+            if total > self.max_size:
+                rows = conn.execute(
+                    "SELECT key, size FROM builds WHERE created_at >= ? "
+                    "ORDER BY accessed_at",
+                    (cutoff,),
+                ).fetchall()
+                for key, size in rows:
+                    if total <= self.max_size:
+                        break
+                    stale.append((key,))
+                    total -= size
+            conn.executemany("DELETE FROM builds WHERE key = ?", stale)
+        for (key,) in stale:
+            self._binary(key).unlink(missing_ok=True)
+        return len(stale)
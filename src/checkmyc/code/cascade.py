@@ -0,0 +1,165 @@
+import re
+
+# Confidence signals that make the cascade escalate, as named in llm.toml
+SIGNALS = ("boundary", "evidences", "repair", "tests")
+_LINES_RE = re.compile(r"^\s*(\d+)\s*(?:-\s*(\d+)\s*)?$")
+_CRITICALITIES = ("high", "medium", "low")
+
+
+def _score(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def repair_evaluation(parsed, topics: list[str]) -> tuple[dict, list[str]]:
+    """Bring a model result back to the evaluation schema.
+
+    Topic names are matched case-insensitively, unknown and repeated topics
+    are dropped, scores are made numbers between 0 and 10, and evidences get
+    valid lines ("N" or "N-M"), criticality and goodness. Return the repaired
+    result and a description of each repair; missing topics are reported but
+    left out (they score 0 in the final score, as before).
+    """
+    problems = []
+    if not isinstance(parsed, dict):
+        return {"evaluations": []}, ["the result is not a JSON object"]
+    parsed = dict(parsed)
+    names = {t.lower(): t for t in topics}
+    evaluations, seen = [], set()
+    for evaluation in parsed.get("evaluations") or []:
+        if not isinstance(evaluation, dict):
+            problems.append("an evaluation is not an object")
+            continue
+        evaluation = dict(evaluation)
+        name = names.get(str(evaluation.get("name", "")).strip().lower())
+        if name is None or name in seen:
+            problems.append(f"unknown or repeated topic {evaluation.get('name')!r}")
+            continue
+        if name != evaluation.get("name"):
+            problems.append(f"topic name {evaluation.get('name')!r}")
+        evaluation["name"] = name
+        seen.add(name)
+
+        score = _score(evaluation.get("score"))
+        if score is None or not 0 <= score <= 10:
+            problems.append(f"{name}: score {evaluation.get('score')!r}")
+            score = min(max(score or 0.0, 0.0), 10.0)
+        evaluation["score"] = score
+        evaluation["evidences"] = _repair_evidences(
+            name, evaluation.get("evidences"), problems
+        )
+        evaluations.append(evaluation)
+
+    missing = [t for t in topics if t not in seen]
+    if missing:
+        problems.append(f"missing topics: {', '.join(missing)}")
+    parsed["evaluations"] = evaluations
+    return parsed, problems
+
+
+def _repair_evidences(name: str, evidences, problems: list[str]) -> list[dict]:
+    repaired = []
+    for evidence in evidences or []:
+        if not isinstance(evidence, dict):
+            problems.append(f"{name}: an evidence is not an object")
+            continue
+        evidence = dict(evidence)
+        lines = []
+        for ref in evidence.get("lines") or []:
+            m = _LINES_RE.match(str(ref))
+            if m is None:
+                problems.append(f"{name}: evidence lines {ref!r}")
+                continue
+            lines.append("-".join(filter(None, m.groups())))
+        evidence["lines"] = lines
+        criticality = evidence.get("criticality")
+        if criticality not in _CRITICALITIES:
+            problems.append(f"{name}: criticality {criticality!r}")
+            criticality = str(criticality).strip().lower()
+            evidence["criticality"] = (
+                criticality if criticality in _CRITICALITIES else "medium"
+            )
+        if evidence.get("goodness") not in ("+", "-"):
+            problems.append(f"{name}: goodness {evidence.get('goodness')!r}")
+            evidence["goodness"] = "-"
+        evidence.setdefault("comment", "")
+        repaired.append(evidence)
+    return repaired
+
+
+def _line_range(ref: str) -> tuple[int, int]:
+    first, _, last = ref.partition("-")
+    return int(first), int(last or first)
+
+
+def evidence_issues(parsed: dict, program_lines: int, config: dict) -> list[str]:
+    """Return the inconsistencies between topic scores and their evidences.
+
+    A topic is inconsistent without evidences, when a high score
+    (high_score or more) comes with a high-criticality negative evidence,
+    when a low score (low_score or less) has no negative evidence, and when
+    its evidences point outside the program.
+    """
+    high, low = config.get("high_score", 7), config.get("low_score", 4)
+    issues = []
+    for evaluation in parsed["evaluations"]:
+        name, score = evaluation["name"], evaluation["score"]
+        evidences = evaluation["evidences"]
+        negative = [e for e in evidences if e["goodness"] == "-"]
+        if not evidences:
+            issues.append(f"{name}: no evidences")
+        elif score >= high and any(e["criticality"] == "high" for e in negative):
+            issues.append(f"{name}: score {score:g} with a high-criticality issue")
+        elif score <= low and not negative:
+            issues.append(f"{name}: score {score:g} with no issue")
+        for e in evidences:
+            for ref in e["lines"]:
+                first, last = _line_range(ref)
+                if not 1 <= first <= last <= program_lines:
+                    issues.append(f"{name}: lines {ref} outside the program")
+    return issues
+
+
+def confidence_signals(
+    parsed: dict,
+    repairs: list[str],
+    scores: dict,
+    program_lines: int,
+    config: dict,
+) -> list[str]:
+    """Return why a model result should not be trusted, [] if it can be.
+
+    scores is the result of compute_final_score for it. The signals checked
+    are those listed in config["escalate_on"] (all of SIGNALS by default):
+    topic scores within margin of a rubric boundary, inconsistent evidences,
+    repairs to the schema, and an LLM score further than max_disagreement
+    from the objective tests' one.
+    """
+    enabled = config.get("escalate_on", SIGNALS)
+    signals = []
+    if "boundary" in enabled:
+        margin = config.get("margin", 0.5)
+        for evaluation in parsed["evaluations"]:
+            for boundary in config.get("boundaries", [5.5]):
+                if abs(evaluation["score"] - boundary) <= margin:
+                    signals.append(
+                        f"{evaluation['name']}: score {evaluation['score']:g} "
+                        f"near {boundary:g}"
+                    )
+    if "evidences" in enabled:
+        signals += evidence_issues(parsed, program_lines, config)
+    if "repair" in enabled:
+        signals += [f"repaired {r}" for r in repairs]
+    tests = scores["tests_scores"]
+    if "tests" in enabled and any(
+        isinstance(v, int | float) for k, v in tests.items() if k != "final"
+    ):
+        gap = scores["llm_scores"]["final"] - tests["final"]
+        if abs(gap) > config.get("max_disagreement", 3.0):
+            signals.append(
+                f"LLM score {scores['llm_scores']['final']:.1f} against tests "
+                f"{tests['final']:.1f}"
+            )
+    return signals
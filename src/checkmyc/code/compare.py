@@ -0,0 +1,114 @@
+import csv
+import json
+import logging
+import statistics
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+COMPARISON_FIELDS = (
+    "model",
+    "provider",
+    "programs",
+    "final_score",
+    "llm_score",
+    "latency_s",
+    "max_latency_s",
+    "prompt_tokens",
+    "cached_tokens",
+    "completion_tokens",
+    "cost",
+)
+
+
+def _mean(values: list) -> float | str:
+    return round(statistics.mean(values), 3) if values else ""
+
+
+def model_row(model: str, provider: str | None, reports: list[dict]) -> dict:
+    """Summarize the reports of a model: mean scores, latency, tokens and cost.
+
+    Latency is the mean and maximum over the programs actually sent to the
+    model, leaving out cache hits and reused evaluations.
+    """
+    usages = [r.get("usage", {}) for r in reports]
+    latencies = [
+        u["latency_s"] for u in usages if "latency_s" in u and not u.get("cache_hit")
+    ]
+    costs = [
+        r["call_cost"] for r in reports if isinstance(r.get("call_cost"), int | float)
+    ]
+    return {
+        "model": model,
+        "provider": provider or "",
+        "programs": len(reports),
+        "final_score": _mean([r["final_score"] for r in reports]),
+        "llm_score": _mean([r["llm_scores"]["final"] for r in reports]),
+        "latency_s": _mean(latencies),
+        "max_latency_s": max(latencies, default=""),
+        "prompt_tokens": sum(u.get("prompt_tokens", 0) for u in usages),
+        "cached_tokens": sum(u.get("cached_tokens", 0) for u in usages),
+        "completion_tokens": sum(u.get("completion_tokens", 0) for u in usages),
+        "cost": round(sum(costs), 6),
+    }
+
+
+def write_comparison(
+    report_paths: dict[tuple[str, str | None], dict[str, Path]], output_dir: Path
+) -> tuple[Path, Path]:
+    """Write the cross-model comparison of a run as two CSV files.
+
+    report_paths maps each (model, provider) to {program name: report path}.
+    The first file has one row per model (COMPARISON_FIELDS), the second
+    the final score of each program by model. Return their paths.
+    """
+    reports = {
+        key: {
+            name: json.loads(Path(path).read_text(encoding="utf-8"))
+            for name, path in paths.items()
+        }
+        for key, paths in report_paths.items()
+    }
+    timestamp = datetime.now().strftime("%H-%M-%S")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    summary_path = output_dir / f"{timestamp}_comparison.csv"
+    rows = [
+        model_row(model, provider, list(by_program.values()))
+        for (model, provider), by_program in reports.items()
+    ]
+    with summary_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=COMPARISON_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    programs_path = output_dir / f"{timestamp}_comparison_programs.csv"
+    programs = sorted({name for by_program in reports.values() for name in by_program})
+    with programs_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["program", *(model for model, _ in reports)])
+        for name in programs:
+            writer.writerow(
+                [
+                    name,
+                    *(
+                        (
+                            round(by_program[name]["final_score"], 3)
+                            if name in by_program
+                            else ""
+                        )
+                        for by_program in reports.values()
+                    ),
+                ]
+            )
+
+    for row in rows:
+        logger.info(
+            f"{row['model']}: {row['programs']} programs, final score "
+            f"{row['final_score']}, latency {row['latency_s']}s, "
+            f"{row['prompt_tokens']} prompt and {row['completion_tokens']} "
+            f"completion tokens, cost ${row['cost']:.4f}"
+        )
+    logger.info(f"Model comparison saved in {summary_path} and {programs_path}")
+    return summary_path, programs_path
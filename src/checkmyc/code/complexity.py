@@ -0,0 +1,126 @@
+import logging
+import math
+import statistics
+from pathlib import Path
+
+from .evals import _timing_key, benchmark
+
+logger = logging.getLogger(__name__)
+
+# Candidate growth models, from the slowest growing
+MODELS = {
+    "O(1)": lambda n: 1.0,
+    "O(log n)": math.log,
+    "O(n)": lambda n: n,
+    "O(n log n)": lambda n: n * math.log(n),
+    "O(n^2)": lambda n: n**2,
+    "O(n^3)": lambda n: n**3,
+}
+
+
+def count_lines(path: Path) -> int:
+    with path.open("rb") as f:
+        return max(2, sum(1 for _ in f))
+
+
+def scaling_dir_inputs(scaling_dir: Path) -> list[tuple[int, Path]]:
+    """Return (size, path) of the inputs of an exam's scaling/ directory.
+
+    The size of an input is its number of lines.
+    """
+    inputs = [(count_lines(p), p) for p in scaling_dir.iterdir() if p.is_file()]
+    return sorted(inputs)
+
+
+def measure_scaling(
+    exec_path: Path, inputs: list[tuple[int, Path]], runs: int, timeout: float
+) -> list[tuple[int, float]]:
+    """Return (size, median time) for each input, in order.
+
+    Stops at the first input on which the program fails or times out.
+    """
+    points = []
+    for size, path in inputs:
+        failed, stats = benchmark(exec_path, path, runs, timeout=timeout)
+        if failed is not None:
+            break
+        points.append((size, stats[_timing_key()]))
+    return points
+
+
+def fit_complexity(points: list[tuple[int, float]], min_time: float) -> dict | None:
+    """Estimate the growth of the running time from (size, time) points.
+
+    The time of the smallest input is taken as the fixed cost (start-up and
+    the like) and subtracted from the others; points
+    whose remaining time is under min_time are too noisy to use. The
+    exponent is the slope of a least-squares line over log-log points, and
+    the class is the model of MODELS that fits them best in log space.
+    Return None when fewer than three points are usable.
+    """
+    if len(points) < 4:
+        return None
+    base = points[0][1]
+    usable = [(n, t - base) for n, t in points[1:] if t - base >= min_time]
+    if len(usable) < 3:
+        return None
+
+    sizes = [n for n, _ in usable]
+    log_n = [math.log(n) for n in sizes]
+    log_t = [math.log(t) for _, t in usable]
+    exponent = statistics.linear_regression(log_n, log_t).slope
+
+    # Fitting t = c * f(n) in log space: log c is the mean residual
+    errors = {}
+    for name, model in MODELS.items():
+        residuals = [
+            lt - math.log(model(n)) for n, lt in zip(sizes, log_t, strict=True)
+        ]
+        c = statistics.fmean(residuals)
+        errors[name] = sum((r - c) ** 2 for r in residuals)
+    return {
+        "class": min(errors, key=errors.get),
+        "exponent": exponent,
+        "points": points,
+    }
+
+
+def complexity_score(fit: dict, reference_fit: dict, config: dict) -> float:
+    """Score a program's complexity class against the reference solution's.
+
+    config["scores"][k] is the score of a class k steps slower than the
+    reference's (the last value for anything slower); faster or equal
+    classes get the first one.
+    """
+    classes = list(MODELS)
+    steps = classes.index(fit["class"]) - classes.index(reference_fit["class"])
+    scores = config["scores"]
+    return float(scores[min(max(steps, 0), len(scores) - 1)])
+
+
+def complexity_test(
+    exec_path: Path,
+    inputs: list[tuple[int, Path]],
+    reference_fit: dict,
+    config: dict,
+    complexity_stats=None,
+) -> float:
+    """Estimate the complexity class of a program and score it.
+
+    The program runs on the scaled inputs of the exam session; -1 is
+    returned when its growth cannot be estimated. The fit is stored in
+    complexity_stats when given.
+    """
+    points = measure_scaling(
+        exec_path, inputs, config.get("runs", 3), config.get("timeout", 5.0)
+    )
+    fit = fit_complexity(points, config.get("min_time", 0.002))
+    if fit is None:
+        logger.info("Complexity could not be estimated")
+        return -1
+    if complexity_stats is not None:
+        complexity_stats.update(
+            fit,
+            reference={k: reference_fit[k] for k in ("class", "exponent")},
+        )
+    return complexity_score(fit, reference_fit, config)
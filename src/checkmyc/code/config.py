@@ -1,4 +1,5 @@
 import json
+import tomllib
 from argparse import Namespace
 from dataclasses import dataclass
 from pathlib import Path
@@ -11,7 +12,12 @@ DATA_DIR = PKG_ROOT / "data"
 TEMPLATES_DIR = DATA_DIR / "templates"
 
 
-def generate_schema(topics: list[str]) -> dict:
+def generate_schema(topics: list[str], summary: bool = True) -> dict:
+    """Build the JSON schema of an evaluation of the given topics.
+
+    Without summary the priority issues and practical tips are left out;
+    with no topics the schema has only them (split topic calls).
+    """
     n = len(topics)
     base_schema = {
         "type": "object",
@@ -75,11 +81,27 @@ def generate_schema(topics: list[str]) -> dict:
         },
         "required": ["evaluations", "priority issues", "practical_tips"],
     }
+    if not topics:
+        del base_schema["properties"]["evaluations"]
+    if not summary:
+        del base_schema["properties"]["priority issues"]
+        del base_schema["properties"]["practical_tips"]
+    base_schema["required"] = list(base_schema["properties"])
     return base_schema
 
 
 def save_json_and_html(
-    program_info, output_path, parsed, model, provider, tokens, call_cost, combined
+    program_info,
+    output_path,
+    parsed,
+    model,
+    provider,
+    tokens,
+    call_cost,
+    combined,
+    cascade=None,
+    samples=None,
+    repairs=None,
 ):
     """Save JSON and HTML report from parsed evaluation data"""
     output_data = {
@@ -90,7 +112,17 @@ def save_json_and_html(
         "call_cost": call_cost,
         **combined,
     }
+    if cascade:
+        output_data["cascade"] = cascade
+    if samples:
+        output_data["samples"] = samples
+    if repairs:
+        output_data["repairs"] = repairs
+    write_report(output_path, output_data)
 
+
+def write_report(output_path, output_data):
+    """Write an evaluation as JSON and render its HTML report next to it"""
     with output_path.open("w", encoding="utf-8") as f:
         json.dump(output_data, f, indent=2, ensure_ascii=False)
 
@@ -153,6 +185,7 @@ class ExamContext:
     quest_weights: dict
     pvcheck_flag: bool
     exam_path: Path | None
+    solution_path: Path | None = None
 
 
 def load_exam_context(input_args, paths, questions) -> tuple[bool, ExamContext]:
@@ -195,6 +228,7 @@ def load_exam_context(input_args, paths, questions) -> tuple[bool, ExamContext]:
         quest_weights,
         pvcheck_flag,
         exam_path if exam_dir else None,
+        Path(sol_program) if sol_program and Path(sol_program).is_file() else None,
     )
 
 
@@ -224,11 +258,12 @@ def get_paths(config: dict, config_flag: bool, args: Namespace) -> dict:
         "llm_config": r(base.get("llm")),
         "questions_config": r(base.get("questions")),
         "output": r(Path(base.get("output_path")) / (args.output or "")),
+        "response_cache": r(base.get("response_cache")),
+        "build_cache": r(base.get("build_cache")),
     }
     if config_flag:
         paths.update(
             {
-                "schema": r(Path(base.get("schema_path")) / args.schema),
                 "programs": r(Path(base.get("programs_path")) / args.program),
                 "exam_text": r(Path(base.get("exam_text_path")) / (args.exam or "")),
                 "sys_prompt": r(Path(base.get("sys_prompt_path")) / args.system_prompt),
@@ -242,9 +277,9 @@ def get_paths(config: dict, config_flag: bool, args: Namespace) -> dict:
         # sensible defaults when not using config paths (all must be specified in the cli)
         paths.update(
             {
-                "schema": args.schema,
-                "programs": args.program,
-                "exam_text": args.exam or "",
+                "programs": Path(args.program),
+                # Absolute: programs run in their build directory
+                "exam_text": Path(args.exam).resolve() if args.exam else Path(""),
                 "sys_prompt": args.system_prompt,
                 "usr_prompt": args.user_prompt,
             }
@@ -253,6 +288,14 @@ def get_paths(config: dict, config_flag: bool, args: Namespace) -> dict:
     return paths
 
 
+def load_toml(path: str | Path | None, name: str) -> dict:
+    """Load a TOML configuration file referenced by config.toml."""
+    if not path:
+        raise FileNotFoundError(f"{name} path missing in config.toml")
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
 def load_file(path: str | Path, mode="r", encoding="utf-8"):
     """Load text or JSON file based on its extension. Return empty string if path is falsy."""
     if not path:
@@ -274,11 +317,9 @@ def programs_loading(paths, extension):
         program_paths = [p]
     elif p.is_dir():
         # directory case
-        program_paths = [
-            p / prog
-            for prog in p.iterdir()
-            if (prog.is_file() and prog.endswith(extension))
-        ]
+        program_paths = sorted(
+            prog for prog in p.iterdir() if prog.is_file() and prog.suffix == extension
+        )
         if not program_paths:
             raise FileNotFoundError(
                 f"Program files not found in {p} with extension {extension}"
@@ -0,0 +1,29 @@
+import re
+from collections.abc import Iterator
+
+# Lexical tokens of C source, by kind: unterminated comments and literals
+# still make one token, so that any text can be split
+TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+    |(?P<literal>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    |(?P<name>[A-Za-z_]\w*)
+    |(?P<number>\.?\d[\w.]*)
+    |(?P<space>\s+)
+    |(?P<other>.)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+
+def tokenize_c(source: str) -> Iterator[tuple[str, str, int]]:
+    """Yield (kind, text, line) for each token of source, spaces included.
+
+    kind is the TOKEN_RE group that matched; line is the 1-based line the
+    token starts on.
+    """
+    line = 1
+    for m in TOKEN_RE.finditer(source):
+        text = m.group()
+        yield m.lastgroup, text, line
+        line += text.count("\n")
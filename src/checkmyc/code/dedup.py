@@ -0,0 +1,209 @@
+import asyncio
+import copy
+import difflib
+import hashlib
+import logging
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .ctokens import tokenize_c
+
+logger = logging.getLogger(__name__)
+
+# Identifiers kept as they are; any other name is renamed by first use
+_C_NAMES = """
+    auto break case char const continue default do double else enum extern
+    float for goto if inline int long register restrict return short signed
+    sizeof static struct switch typedef union unsigned void volatile while
+    bool true false NULL EOF FILE size_t main include define stdin stdout stderr
+    printf fprintf sprintf snprintf scanf fscanf sscanf fgets fputs puts putchar
+    getchar fgetc fputc fopen fclose feof fflush malloc calloc realloc free
+    exit atoi atof atol strtol strtod strlen strcpy strncpy strcat strncat
+    strcmp strncmp strchr strrchr strstr strtok strdup memset memcpy memmove
+    memcmp qsort bsearch abs fabs sqrt pow isdigit isalpha isspace toupper
+    tolower
+"""
+_KEPT_NAMES = frozenset(_C_NAMES.split())
+
+SHINGLE_SIZE = 5
+# MinHash signature of NUM_PERM bins, split in BANDS bands for LSH: programs
+# from about 0.5 similarity share a band and are compared exactly
+NUM_PERM = 64
+BANDS = 16
+_EMPTY = 1 << 64
+
+
+def normalize_tokens(source: str) -> list[tuple[str, int]]:
+    """Return the canonical tokens of a C source with their line numbers.
+
+    Comments and whitespace are dropped, keywords and common library names
+    are kept, and every other identifier becomes v1, v2, ... by first use,
+    so renaming variables or functions does not change the result.
+    """
+    names: dict[str, str] = {}
+    tokens = []
+    for kind, text, line in tokenize_c(source):
+        if kind == "name" and text not in _KEPT_NAMES:
+            text = names.setdefault(text, f"v{len(names) + 1}")
+        if kind not in ("comment", "space"):
+            tokens.append((text, line))
+    return tokens
+
+
+def _shingles(tokens: list[str]) -> set[int]:
+    k = min(SHINGLE_SIZE, len(tokens)) or 1
+    return {
+        int.from_bytes(
+            hashlib.blake2b(
+                "\x1f".join(tokens[i : i + k]).encode(), digest_size=8
+            ).digest()
+        )
+        for i in range(max(1, len(tokens) - k + 1))
+    }
+
+
+def _minhash(shingles: set[int]) -> list[int]:
+    """One-permutation MinHash: the minimum hash in each of NUM_PERM bins."""
+    signature = [_EMPTY] * NUM_PERM
+    for h in shingles:
+        b, v = h % NUM_PERM, h // NUM_PERM
+        if v < signature[b]:
+            signature[b] = v
+    return signature
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def _normalized_lines(tokens: list[tuple[str, int]]) -> list[tuple[int, str]]:
+    lines: dict[int, list[str]] = {}
+    for text, line in tokens:
+        lines.setdefault(line, []).append(text)
+    return [(line, " ".join(texts)) for line, texts in lines.items()]
+
+
+def line_map(rep_tokens, dup_tokens) -> dict[int, int]:
+    """Map the lines of the representative to those of a duplicate.
+
+    Lines are matched through the alignment of their normalized tokens; a
+    line without a match (blank, comment or edited) keeps its distance from
+    the closest matched line above it.
+    """
+    rep_lines = _normalized_lines(rep_tokens)
+    dup_lines = _normalized_lines(dup_tokens)
+    matcher = difflib.SequenceMatcher(
+        None, [t for _, t in rep_lines], [t for _, t in dup_lines], autojunk=False
+    )
+    mapping: dict[int, int] = {}
+    for i, j, n in matcher.get_matching_blocks():
+        for k in range(n):
+            mapping[rep_lines[i + k][0]] = dup_lines[j + k][0]
+    last_line = rep_lines[-1][0] if rep_lines else 0
+    anchor = (0, 0)
+    for line in range(1, last_line + 1):
+        if line in mapping:
+            anchor = (line, mapping[line])
+        else:
+            mapping[line] = anchor[1] + line - anchor[0]
+    return mapping
+
+
+@dataclass
+class Duplicate:
+    """A program whose model evaluation is taken from its representative's."""
+
+    representative: Path
+    similarity: float
+    lines: dict[int, int] = field(default_factory=dict)
+
+    def _map(self, line: int) -> int:
+        if line in self.lines or not self.lines:
+            return self.lines.get(line, line)
+        last = max(self.lines)
+        return self.lines[last] + line - last
+
+    def remap_lines(self, parsed):
+        """Return a copy of an LLM result with its evidence lines remapped."""
+        parsed = copy.deepcopy(parsed)
+        for evaluation in parsed.get("evaluations", []):
+            for evidence in evaluation.get("evidences", []):
+                evidence["lines"] = [
+                    (
+                        "-".join(str(self._map(int(n))) for n in ref.split("-"))
+                        if re.fullmatch(r"\d+(-\d+)?", ref)
+                        else ref
+                    )
+                    for ref in evidence.get("lines", [])
+                ]
+        return parsed
+
+
+def find_duplicates(program_paths: list[Path], threshold: float) -> dict:
+    """Group near-duplicate programs; return {duplicate path: Duplicate}.
+
+    Programs are taken in order: one whose token shingles have at least
+    threshold Jaccard similarity with an earlier representative joins it
+    (the most similar one), otherwise it becomes a representative. MinHash
+    signatures split in LSH bands select the representatives to compare.
+    """
+    reps: list[tuple[Path, list, set]] = []
+    buckets: dict[tuple, list[int]] = {}
+    duplicates = {}
+    rows = NUM_PERM // BANDS
+    for path in program_paths:
+        try:
+            source = Path(path).read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            continue
+        tokens = normalize_tokens(source)
+        shingles = _shingles([t for t, _ in tokens])
+        signature = _minhash(shingles)
+        bands = [(b, tuple(signature[b * rows : (b + 1) * rows])) for b in range(BANDS)]
+
+        candidates = {i for band in bands for i in buckets.get(band, [])}
+        best, best_sim = None, threshold
+        for i in sorted(candidates):
+            sim = _jaccard(shingles, reps[i][2])
+            if sim >= best_sim:
+                best, best_sim = i, sim
+        if best is None:
+            for band in bands:
+                buckets.setdefault(band, []).append(len(reps))
+            reps.append((Path(path), tokens, shingles))
+            continue
+        rep_path, rep_tokens, _ = reps[best]
+        duplicates[str(Path(path).resolve())] = Duplicate(
+            rep_path, round(best_sim, 4), line_map(rep_tokens, tokens)
+        )
+    return duplicates
+
+
+class DuplicateGroups:
+    """Hands each representative's model result to its duplicates."""
+
+    def __init__(self, duplicates: dict[str, Duplicate]):
+        self.duplicates = duplicates
+        self._results: dict[str, asyncio.Future] = {}
+        self.representatives = {
+            str(Path(d.representative).resolve()) for d in duplicates.values()
+        }
+
+    def _future(self, key: str) -> asyncio.Future:
+        if key not in self._results:
+            self._results[key] = asyncio.get_running_loop().create_future()
+        return self._results[key]
+
+    def of(self, program_path) -> Duplicate | None:
+        return self.duplicates.get(str(Path(program_path).resolve()))
+
+    def publish(self, program_path, result) -> None:
+        """Store a representative's (parsed, provider, model), None if it failed."""
+        key = str(Path(program_path).resolve())
+        if key in self.representatives and not self._future(key).done():
+            self._future(key).set_result(result)
+
+    async def wait(self, duplicate: Duplicate):
+        """Return the representative's (parsed, provider, model), or None."""
+        return await self._future(str(Path(duplicate.representative).resolve()))
@@ -1,20 +1,99 @@
-import csv
-import io
+import atexit
+import functools
+import json
 import logging
+import os
 import platform
+import re
 import shutil
+import signal
+import statistics
 import subprocess
+import sys
+import tempfile
 import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 
+from .build_cache import BuildCache, build_key
+from .ctokens import tokenize_c
+from .pvcheck import CODE_TIMEOUT, PvTestCase, run_tests
+from .sandbox import current_sandbox
 
-def add_line_numbers(code: str) -> str:
-    """Add line numbers for relative comments in the output."""
-    lines = []
-    for i, line in enumerate(code.splitlines(), start=1):
-        lines.append(f"{i:4d} | {line}")
+TMPFS_DIR = Path("/dev/shm")
+COMPILE_FLAGS = ["-Wall", "-Wextra"]
+JSON_DIAGNOSTICS_FLAG = "-fdiagnostics-format=json"
+DIAGNOSTIC_RE = re.compile(
+    r"^(?P<file>[^\n:]+):(?P<line>\d+):(?P<column>\d+): "
+    r"(?P<kind>warning|error|fatal error|note): "
+    r"(?P<message>.*?)(?: \[(?P<option>-W[^\]]+)\])?$",
+    re.MULTILINE,
+)
+# Shortest block of comment-only lines that folding replaces
+FOLD_MIN_COMMENT_LINES = 3
+RUSAGE_RUNNER_SRC = (
+    Path(__file__).resolve().parents[1] / "data" / "tools" / "rusage_run.c"
+)
 
-    return "".join(lines)
+
+def _comment_only_lines(code: str) -> set[int]:
+    """Return the numbers of the lines holding nothing but comments."""
+    commented, with_code = set(), set()
+    for kind, text, line in tokenize_c(code):
+        if kind == "comment":
+            commented.update(range(line, line + text.count("\n") + 1))
+        elif kind != "space":
+            with_code.update(range(line, line + text.count("\n") + 1))
+    return commented - with_code
+
+
+def add_line_numbers(
+    code: str,
+    compact: bool = False,
+    fold_blank: bool = False,
+    fold_comments: bool = False,
+    numbered: bool = True,
+) -> str:
+    """Add line numbers for relative comments in the output.
+
+    The compact style marks lines as "12|" instead of "  12 | " and drops
+    trailing whitespace. Folding drops blank lines, and replaces each block
+    of FOLD_MIN_COMMENT_LINES or more comment-only lines with a one-line
+    placeholder, marked with the range it stands for; since every line
+    keeps its own number, line references stay those of the original file.
+    Without numbered only the folding is applied (for the reference
+    solution, which is not referred to by line).
+    """
+    lines = [line.rstrip("\r") for line in code.split("\n")]
+    if lines and not lines[-1]:
+        lines.pop()
+    folded = _comment_only_lines(code) if fold_comments else set()
+    out = []
+    n = 0
+    while n < len(lines):
+        first = last = n + 1
+        while last + 1 in folded and first in folded:
+            last += 1
+        if last - first + 1 >= FOLD_MIN_COMMENT_LINES:
+            marker = f"{first}-{last}"
+            line = f"/* {last - first + 1} comment lines folded */"
+        else:
+            marker, line, last = str(first), lines[n], first
+        n = last
+
+        if compact:
+            line = line.rstrip()
+        if fold_blank and not line.strip():
+            continue
+        if not numbered:
+            out.append(line)
+        elif compact:
+            out.append(f"{marker}|{line}")
+        else:
+            out.append(f"{marker:>4} | {line}")
+    return "\n".join(out)
 
 
 def get_exec_name() -> str:
@@ -22,100 +101,453 @@ def get_exec_name() -> str:
     return "a.exe" if platform.system() == "Windows" else "a.out"
 
 
-def compilation_test(file_path: str) -> float:
-    """Compile C code with GCC and compute a warning-based score."""
+def _tmpfs_base() -> str | None:
+    """Return the tmpfs mount if binaries can be executed from it."""
+    if not TMPFS_DIR.is_dir() or not os.access(TMPFS_DIR, os.W_OK):
+        return None
+    if os.statvfs(TMPFS_DIR).f_flag & os.ST_NOEXEC:
+        return None
+    return str(TMPFS_DIR)
+
+
+@contextmanager
+def build_dir(prefix: str = "checkmyc-") -> Iterator[Path]:
+    """Yield a private scratch directory for one evaluation, on tmpfs if possible."""
+    with tempfile.TemporaryDirectory(prefix=prefix, dir=_tmpfs_base()) as tmp:
+        yield Path(tmp)
+
+
+@functools.cache
+def compile_flags() -> list[str]:
+    """Return the gcc flags, asking for JSON diagnostics when gcc supports them."""
+    try:
+        probe = subprocess.run(
+            ["gcc", JSON_DIAGNOSTICS_FLAG, "-fsyntax-only", "-x", "c", "-"],
+            input="",
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return COMPILE_FLAGS
+    return (
+        COMPILE_FLAGS + [JSON_DIAGNOSTICS_FLAG]
+        if probe.returncode == 0
+        else COMPILE_FLAGS
+    )
+
+
+def _json_diagnostic(d: dict) -> dict:
+    caret = d["locations"][0]["caret"] if d.get("locations") else {}
+    return {
+        "file": Path(caret["file"]).name if "file" in caret else None,
+        "line": caret.get("line"),
+        "column": caret.get("column"),
+        "kind": d["kind"],
+        "option": d.get("option"),
+        "message": d["message"],
+    }
+
+
+def parse_diagnostics(stderr: str) -> list[dict]:
+    """Parse gcc's diagnostics into dicts (file, line, column, kind, option, message).
+
+    gcc's JSON output is used when present (linker messages still come as
+    text after it); otherwise the text diagnostics are parsed.
+    """
+    for line in stderr.splitlines():
+        if line.startswith("["):
+            try:
+                return [_json_diagnostic(d) for d in json.loads(line)]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                break
+    diagnostics = []
+    for m in DIAGNOSTIC_RE.finditer(stderr):
+        d = m.groupdict()
+        diagnostics.append(
+            {
+                "file": Path(d["file"]).name,
+                "line": int(d["line"]),
+                "column": int(d["column"]),
+                "kind": d["kind"],
+                "option": d["option"],
+                "message": d["message"],
+            }
+        )
+    return diagnostics
+
+
+def warning_score(
+    diagnostics: list[dict], warning_weights: dict | None = None
+) -> float:
+    """Return 10 minus the weighted number of warnings, at least 0.
+
+    A warning weighs warning_weights[<option without -W>] if set, else
+    warning_weights["default"], else 1.
+    """
+    weights = warning_weights or {}
+    default = weights.get("default", 1.0)
+    penalty = sum(
+        weights.get((d["option"] or "").removeprefix("-W").rstrip("="), default)
+        for d in diagnostics
+        if d["kind"] == "warning"
+    )
+    return float(max(0, 10 - penalty))
+
+
+def format_diagnostics(diagnostics: list[dict]) -> str:
+    """Render warnings and errors compactly, one per line, for the prompt."""
+    lines = [
+        f"- L{d['line']}:{d['column']} {d['kind']}"
+        + (f" [{d['option']}]" if d["option"] else "")
+        + f": {d['message']}"
+        for d in diagnostics
+        if d["kind"] != "note"
+    ]
+    return "\n".join(lines)
+
+
+def compilation_test(
+    file_path: str,
+    exec_path: Path,
+    cache: BuildCache | None = None,
+    compile_stats=None,
+    warning_weights: dict | None = None,
+) -> float:
+    """Compile C code with GCC into exec_path and compute a warning-based score.
+
+    With a build cache, a program already built from the same source with the
+    same compiler and flags is copied from it instead of being compiled; its
+    diagnostics are stored with file None for the source itself.
+    Warnings are weighted by option with warning_weights. The return code,
+    warning count and parsed diagnostics are stored in compile_stats when given.
+    """
     if not shutil.which("gcc"):
         logging.error("gcc not found")
         return -1
 
-    compile_cmd = ["gcc", "-Wall", "-Wextra", file_path]
-    try:
-        result = subprocess.run(compile_cmd, capture_output=True, text=True, timeout=10)
-        if result.returncode != 0:
-            logging.info("Compilation error")
+    flags = compile_flags()
+    source_name = Path(file_path).name
+    hit = key = None
+    if cache is not None:
+        key = build_key(Path(file_path).read_bytes(), "gcc", flags)
+        hit = cache.get(key, exec_path)
+
+    if hit is not None:
+        returncode, warnings, diagnostics = hit
+        diagnostics = [{**d, "file": d["file"] or source_name} for d in diagnostics]
+    else:
+        compile_cmd = ["gcc", *flags, file_path, "-o", str(exec_path)]
+        try:
+            result = subprocess.run(
+                compile_cmd, capture_output=True, text=True, timeout=10
+            )
+        except subprocess.TimeoutExpired:
+            logging.info("Compilation timed out")
             return 0
+        returncode = result.returncode
+        diagnostics = parse_diagnostics(result.stderr)
+        warnings = sum(1 for d in diagnostics if d["kind"] == "warning")
+        if cache is not None:
+            cache.put(
+                key,
+                exec_path,
+                returncode,
+                warnings,
+                [
+                    {**d, "file": None if d["file"] == source_name else d["file"]}
+                    for d in diagnostics
+                ],
+            )
 
-        warnings = result.stderr.count("warning:")
-        score = float(max(0, 10 - warnings))
-        return float(score)
-    except subprocess.TimeoutExpired:
-        logging.info("Compilation timed out")
+    if compile_stats is not None:
+        compile_stats.update(
+            returncode=returncode, warnings=warnings, diagnostics=diagnostics
+        )
+    if returncode != 0:
+        logging.info("Compilation error")
         return 0
+    return warning_score(diagnostics, warning_weights)
 
 
-def time_test(p_input) -> float:
-    """Run compiled program and assign a score based on runtime."""
-    exec_name = get_exec_name()
-    exec_path = Path(exec_name)
-    if not exec_path.exists():
-        logging.error(f"Executable {exec_name} not found")
-        return -1
+@dataclass
+class RunResult:
+    """Outcome and resource usage of one run of a program."""
 
-    if not p_input.exists():
-        logging.error(f"Input file {p_input} not found")
-        return -1
+    returncode: int | None  # None when killed on timeout
+    wall: float  # seconds
+    user: float  # CPU seconds in user mode
+    sys: float  # CPU seconds in kernel mode
+    max_rss_kb: int  # peak resident set size
+    limit: str | None = None  # sandbox limit that stopped the run
 
-    run_cmd = [f"./{exec_name}", str(p_input)]
-    res = 0
+    @property
+    def cpu(self) -> float:
+        return self.user + self.sys
+
+
+@functools.cache
+def _rusage_runner() -> Path | None:
+    """Build the measuring helper once per process; None if it cannot be built."""
+    if platform.system() == "Windows" or not shutil.which("gcc"):
+        return None
+    out_dir = Path(tempfile.mkdtemp(prefix="checkmyc-tools-", dir=_tmpfs_base()))
+    atexit.register(shutil.rmtree, out_dir, ignore_errors=True)
+    runner = out_dir / "rusage_run"
     try:
+        result = subprocess.run(
+            ["gcc", "-O2", str(RUSAGE_RUNNER_SRC), "-o", str(runner)],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.warning(f"Cannot build the measuring helper: {e}")
+        return None
+    if result.returncode != 0:
+        logging.warning(f"Cannot build the measuring helper: {result.stderr}")
+        return None
+    return runner
+
+
+def measure_run(exec_path: Path, p_input, timeout: float = 5) -> RunResult:
+    """Run exec_path on p_input once and measure its time and memory.
+
+    The program is started by the rusage_run helper, which reports the
+    program's own CPU time and peak RSS and applies the limits of the
+    configured sandbox. Without the helper only the wall time is measured.
+    """
+    runner = _rusage_runner()
+    with current_sandbox().run() as box:
         start = time.perf_counter()
-        result = subprocess.run(run_cmd, capture_output=True, timeout=5)
-        elapsed = time.perf_counter() - start
+        proc = box.popen(
+            runner,
+            # The program runs in its build directory
+            [str(exec_path), str(Path(p_input).resolve())],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE if runner else subprocess.DEVNULL,
+            cwd=exec_path.parent,
+            start_new_session=bool(runner),
+        )
+        try:
+            _, report = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            if runner:
+                # Kill the whole session: the helper and the program under it
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+            proc.communicate()
+            return RunResult(None, time.perf_counter() - start, 0.0, 0.0, 0, "time")
+        wall = time.perf_counter() - start
+
+        if not runner:
+            return RunResult(
+                proc.returncode, wall, 0.0, 0.0, 0, box.limit_hit(proc.returncode)
+            )
+        try:
+            status, wall, user, sys_time, max_rss = report.split()
+        except ValueError:
+            # The helper could not run the program
+            return RunResult(proc.returncode or 127, wall, 0.0, 0.0, 0)
+        returncode = os.waitstatus_to_exitcode(int(status))
+        # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+        max_rss = int(max_rss) // 1024 if sys.platform == "darwin" else int(max_rss)
+        result = RunResult(
+            returncode, float(wall), float(user), float(sys_time), max_rss
+        )
+        if returncode != 0:
+            result.limit = box.limit_hit(returncode, result.cpu)
+        return result
+
+
+def _mad(values: list[float]) -> float:
+    """Median absolute deviation."""
+    med = statistics.median(values)
+    return statistics.median(abs(v - med) for v in values)
 
+
+def benchmark(
+    exec_path: Path, p_input, runs: int = 1, warmup: int = 0, timeout: float = 5
+) -> tuple[RunResult | None, dict]:
+    """Run warmup untimed runs, then runs timed ones.
+
+    Return (failed run or None, statistics of the timed runs). Stops at the
+    first run that crashes or times out.
+    """
+    results = []
+    for i in range(warmup + max(1, runs)):
+        result = measure_run(exec_path, p_input, timeout)
         if result.returncode != 0:
-            logging.info(f"Program crashed or returned error {result.returncode}")
-            return 0
+            return result, {}
+        if i >= warmup:
+            results.append(result)
+
+    walls = [r.wall for r in results]
+    cpus = [r.cpu for r in results]
+    return None, {
+        "runs": len(results),
+        "warmup": warmup,
+        "wall_median": statistics.median(walls),
+        "wall_mad": _mad(walls),
+        "wall_min": min(walls),
+        "cpu_median": statistics.median(cpus),
+        "cpu_mad": _mad(cpus),
+        "user_median": statistics.median(r.user for r in results),
+        "sys_median": statistics.median(r.sys for r in results),
+        "max_rss_kb": max(r.max_rss_kb for r in results),
+    }
+
+
+def _timing_key() -> str:
+    """Statistic that performance scores are based on."""
+    return "cpu_median" if _rusage_runner() else "wall_median"
+
+
+def performance_ratios(stats: dict, reference: dict, perf_config: dict) -> dict:
+    """Return the time and memory ratios of a benchmark to the reference one.
+
+    Values below min_time / min_rss_kb are raised to them, so that process
+    start-up noise does not turn into large ratios.
+    """
+    min_time = perf_config.get("min_time", 0.0)
+    min_rss = perf_config.get("min_rss_kb", 0)
+    key = _timing_key()
+    return {
+        "time_ratio": max(stats[key], min_time) / max(reference[key], min_time, 1e-9),
+        "memory_ratio": max(stats["max_rss_kb"], min_rss)
+        / max(reference["max_rss_kb"], min_rss, 1),
+    }
+
+
+def band_score(ratio: float, perf_config: dict) -> float:
+    """Score of the first band whose upper ratio bound is not exceeded."""
+    for bound, score in zip(perf_config["ratios"], perf_config["scores"], strict=True):
+        if ratio <= bound:
+            return float(score)
+    return float(perf_config["worst_score"])
+
+
+def relative_performance_score(ratios: dict, perf_config: dict) -> float:
+    """Weighted band score of the time and memory ratios."""
+    time_w = perf_config.get("time_weight", 1.0)
+    memory_w = perf_config.get("memory_weight", 0.0)
+    return (
+        time_w * band_score(ratios["time_ratio"], perf_config)
+        + memory_w * band_score(ratios["memory_ratio"], perf_config)
+    ) / (time_w + memory_w)
+
+
+def time_test(
+    exec_path: Path,
+    p_input,
+    runs: int = 1,
+    warmup: int = 0,
+    perf_stats=None,
+    reference: dict | None = None,
+    perf_config: dict | None = None,
+) -> float:
+    """Benchmark the compiled program and assign a score based on its runtime.
+
+    Timings use the median CPU time (user + sys) of the timed runs, which
+    unlike wall-clock time does not grow when the machine is loaded; the
+    wall-clock median is used where CPU time is not measured. With the
+    reference solution's statistics and a [performance] config, the score
+    comes from the time and memory ratios to the reference; otherwise from
+    fixed time thresholds. The statistics are stored in perf_stats when given.
+    """
+    if not exec_path.exists():
+        logging.error(f"Executable {exec_path} not found")
+        return -1
+
+    if not p_input or not Path(p_input).exists():
+        logging.error(f"Input file {p_input} not found")
+        return -1
 
+    failed, stats = benchmark(exec_path, p_input, runs, warmup)
+    if failed is not None:
+        if failed.returncode is None:
+            logging.info("Execution timed out")
         else:
-            if elapsed < 1:
-                res = 10
-            elif elapsed < 2:
-                res = 8
-            else:
-                res = 6
-    except subprocess.TimeoutExpired:
-        logging.info("Execution timed out")
+            logging.info(f"Program crashed or returned error {failed.returncode}")
+        if failed.limit and perf_stats is not None:
+            perf_stats["limit"] = failed.limit
+        return 0
 
+    if reference and perf_config:
+        stats["reference"] = {k: reference[k] for k in (_timing_key(), "max_rss_kb")}
+        stats.update(performance_ratios(stats, reference, perf_config))
+        res = relative_performance_score(stats, perf_config)
+    else:
+        elapsed = stats[_timing_key()]
+        if elapsed < 1:
+            res = 10
+        elif elapsed < 2:
+            res = 8
+        else:
+            res = 6
+    if perf_stats is not None:
+        perf_stats.update(stats)
     return float(res)
 
 
 def pvcheck_test(
-    pvcheck_weights: dict, pvcheck_csv_scores: dict, exam_dir_path: str
+    pvcheck_weights: dict,
+    pvcheck_csv_scores: dict,
+    pvcheck_tests: list[PvTestCase],
+    exec_path: Path,
+    pvcheck_stats=None,
 ) -> float:
-    """Run pvcheck tool and compute weighted normalized score."""
-    if not shutil.which("pvcheck"):
-        logging.error("pvcheck not found")
+    """Run the pvcheck test cases on exec_path and compute weighted normalized score.
+
+    The cases run concurrently, each with its own timeout; the results are
+    stored in pvcheck_csv_scores with the columns of pvcheck's CSV output.
+    The sandbox limits hit by test case are stored in pvcheck_stats when given.
+    """
+    if not exec_path.exists():
+        logging.error(f"Executable {exec_path} not found")
         return -1
 
-    exec_name = get_exec_name()
-    pv_file = Path(exam_dir_path) / "pvcheck.test"
-    if not pv_file.exists():
-        logging.error(f"pvcheck.test not found in {exam_dir_path}")
+    if not pvcheck_tests:
+        logging.error("No pvcheck test cases loaded")
         return -1
-    pvcheck_cmd = ["pvcheck", "-F", "csv", "-f", str(pv_file), f"./{exec_name}"]
-    try:
-        result = subprocess.run(pvcheck_cmd, capture_output=True, text=True, timeout=10)
-        if result.returncode != 0:
-            logging.warning(f"pvcheck exited with code {result.returncode}")
 
-        reader = csv.DictReader(io.StringIO(result.stdout))
-        for row in reader:
-            for k, v in row.items():
-                pvcheck_csv_scores[k].append(v)
+    limits_hit = {}
+    for k, v in run_tests(
+        exec_path, pvcheck_tests, limits_hit=limits_hit, runner=_rusage_runner()
+    ).items():
+        pvcheck_csv_scores[k].extend(v)
+    if limits_hit:
+        logging.info(f"pvcheck: sandbox limits hit: {limits_hit}")
+        if pvcheck_stats is not None:
+            pvcheck_stats["limits"] = limits_hit
+    codes = pvcheck_csv_scores["CODE"][:-1]
+    if any(code == CODE_TIMEOUT for code in codes):
+        logging.info(f"pvcheck: {codes.count(CODE_TIMEOUT)} test cases timed out")
+    return pvcheck_score(pvcheck_weights, pvcheck_rows(pvcheck_csv_scores))
 
-        # Extract and normalize scores
-        scores_list = [float(v[-1]) for k, v in list(pvcheck_csv_scores.items())[2:]]
-        norm_scores = [s / 10 for s in scores_list]
 
-        weights_list = list(pvcheck_weights.values())
-        total_weights = sum(weights_list)
-        if not total_weights:
-            return 0
-        norm_weights = [w / total_weights for w in weights_list]
-        return sum(v * w for v, w in zip(norm_scores, norm_weights, strict=False))
-    except subprocess.TimeoutExpired:
-        logging.info("pvcheck execution timed out")
+def pvcheck_rows(pvcheck_csv_scores: dict) -> dict:
+    """Return per-question pvcheck scores, dropping the TEST and CODE columns.
+
+    The last value of each question is the TOTAL row (mean over the tests).
+    """
+    return {
+        k: [(float(x) if x not in ("MISS", "") else 0) for x in v]
+        for k, v in list(pvcheck_csv_scores.items())[2:]
+    }
+
+
+def pvcheck_score(pvcheck_weights: dict, pv_data: dict) -> float:
+    """Compute the weighted normalized score from the TOTAL row of each question."""
+    norm_scores = [v[-1] / 10 for v in pv_data.values()]
+
+    weights_list = list(pvcheck_weights.values())
+    total_weights = sum(weights_list)
+    if not total_weights:
         return 0
+    norm_weights = [w / total_weights for w in weights_list]
+    return sum(v * w for v, w in zip(norm_scores, norm_weights, strict=False))
 
 
 def compute_final_score(
@@ -125,10 +557,17 @@ def compute_final_score(
     llm_weights: dict,
     combined_weights: dict,
     quest_weights: dict,
-    pvcheck_csv_scores: dict,
+    pv_data: dict,
 ) -> dict:
     """Compute combined final score from objective and LLM metrics."""
-    valid_tests = {t: v for t, v in objective_metrics.items() if v != -1.0}
+    # Work on copies: the weights are shared by every program of a batch
+    objective_metrics = dict(objective_metrics)
+    tests_weights = dict(tests_weights)
+
+    # Only weighted tests count; other entries (e.g. statistics) are reported
+    valid_tests = {
+        t: v for t, v in objective_metrics.items() if t in tests_weights and v != -1.0
+    }
     if valid_tests:
         weighted_sum = sum(tests_weights[t] * v for t, v in valid_tests.items())
         total_weight = sum(tests_weights[t] for t in valid_tests)
@@ -154,11 +593,6 @@ def compute_final_score(
         combined_weights["tests"] * tests_score + combined_weights["llm"] * llm_score
     ) / total_combined_weights
 
-    pv_data = {
-        k: [(float(x) if x != "MISS" else 0) for x in v]
-        for k, v in list(pvcheck_csv_scores.items())[2:]
-    }
-
     return {
         "pvcheck": pv_data,
         "tests_scores": {**objective_metrics, "final": tests_score},
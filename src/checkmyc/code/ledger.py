@@ -0,0 +1,69 @@
+import json
+import sqlite3
+import time
+from collections.abc import Iterator
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    program TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (program, stage)
+)
+"""
+
+
+class JobLedger:
+    """SQLite record of which stages of which programs completed in a run."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+            yield conn
+
+    def completed(self, program: str, source_hash: str) -> dict:
+        """Return {stage: result} of the stages done for this exact source."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT stage, result FROM stages "
+                "WHERE program = ? AND source_hash = ? AND status = 'done'",
+                (program, source_hash),
+            ).fetchall()
+        return {stage: json.loads(result) if result else None for stage, result in rows}
+
+    def prune_stale(self, program: str, source_hash: str) -> None:
+        """Delete the records left by a different version of the program."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM stages WHERE program = ? AND source_hash != ?",
+                (program, source_hash),
+            )
+
+    def record(self, program, source_hash, stage, status, result=None) -> None:
+        """Store the outcome ('done' or 'failed') of a stage."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stages "
+                "(program, source_hash, stage, status, result, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    program,
+                    source_hash,
+                    stage,
+                    status,
+                    json.dumps(result, ensure_ascii=False, default=str),
+                    time.time(),
+                ),
+            )
@@ -0,0 +1,1247 @@
+import asyncio
+import hashlib
+import json
+import logging
+import statistics
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from datetime import datetime
+from pathlib import Path
+
+from ..api.clients import aclose_clients
+from ..api.limits import ProviderLimiter
+from ..api.model_runner import (
+    cache_savings,
+    compute_cost,
+    native_samples,
+    normalize_usage_dispatch,
+    provider_group,
+    run_model_dispatch_async,
+)
+from ..api.response_cache import ResponseCache, cache_key
+from ..api.retry import RetryPolicy, call_with_retry
+from ..api.utils_api import InvalidResponseError
+from .budget import (
+    CACHE_MIN_PREFIX,
+    Budget,
+    BudgetExceeded,
+    CallEstimate,
+    call_cost,
+)
+from .build_cache import BuildCache
+from .cascade import confidence_signals, repair_evaluation
+from .compare import write_comparison
+from .complexity import complexity_test
+from .config import ExamContext, generate_schema, load_file, save_json_and_html
+from .dedup import DuplicateGroups, find_duplicates
+from .evals import (
+    add_line_numbers,
+    build_dir,
+    compilation_test,
+    compute_final_score,
+    format_diagnostics,
+    get_exec_name,
+    pvcheck_rows,
+    pvcheck_test,
+    time_test,
+)
+from .ledger import JobLedger
+from .samples import aggregate_samples
+from .session import ExamSession
+from .tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]  # repo root
+
+# Objective test (key of tests_weights and of the report) of each ledger stage
+STAGE_TESTS = {
+    "compiled": "warning",
+    "timed": "performance",
+    "pvchecked": "pvcheck",
+    "scaled": "complexity",
+}
+
+# Compiler diagnostics section added to the user prompt with --diagnostics
+DIAGNOSTICS_PROMPT = (
+    "\n\n## Compiler Diagnostics (gcc -Wall -Wextra)\n\n"
+    "Already reported to the student; refer to them by line instead of "
+    "describing them again.\n\n{}\n"
+)
+
+
+# Scope of each call with --split_topics, appended after the program
+TOPIC_PROMPT = (
+    "\n\n## Scope of This Answer\n\n"
+    'Evaluate only the topic "{}": `evaluations` must contain that single '
+    "topic. The other topics and the summary are evaluated separately.\n"
+)
+SUMMARY_PROMPT = (
+    "\n\n## Scope of This Answer\n\n"
+    "Do not score the topics, which are evaluated separately: return only "
+    "the `priority issues` and the `practical_tips` for the whole program.\n"
+)
+
+
+@dataclass
+class UsageTotals:
+    """Tokens and cost of the model calls billed during a run."""
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    savings: float = 0.0
+    code_tokens_saved: int = 0
+    # End-to-end model latency of each program evaluated by the model
+    latencies: list[float] = field(default_factory=list)
+
+    def add(self, tokens: dict, cost, savings: float) -> None:
+        self.calls += 1
+        self.prompt_tokens += tokens.get("prompt_tokens", 0)
+        self.cached_tokens += tokens.get("cached_tokens", 0)
+        self.completion_tokens += tokens.get("completion_tokens", 0)
+        if isinstance(cost, int | float):
+            self.cost += cost
+        self.savings += savings
+
+    def summary(self) -> str:
+        ratio = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0
+        return (
+            f"{self.calls} model calls: {self.prompt_tokens} prompt tokens "
+            f"({ratio:.1%} from the provider prompt cache), "
+            f"{self.completion_tokens} completion tokens, "
+            f"cost ${self.cost:.4f} (${self.savings:.4f} saved by prompt caching)"
+            + (
+                f", about {self.code_tokens_saved} prompt tokens saved by the "
+                "compact rendering of programs"
+                if self.code_tokens_saved
+                else ""
+            )
+            + (
+                f", model latency per program {statistics.mean(self.latencies):.2f}s "
+                f"on average, {max(self.latencies):.2f}s at most"
+                if self.latencies
+                else ""
+            )
+        )
+
+
+@dataclass
+class RunSettings:
+    """Everything shared by the evaluations of a single invocation."""
+
+    model: str
+    provider: str | None
+    temperature: float
+    debug: bool
+    tests: list[str]
+    tests_weights: dict
+    questions: dict
+    llm_weights: dict
+    combined_weights: dict
+    pricing: dict
+    schema: dict
+    topics_md: str
+    sys_prompt_path: Path
+    usr_prompt_path: Path
+    exam_dir: bool
+    exam_ctx: ExamContext
+    output_dir: Path
+    session: ExamSession
+    cache: ResponseCache | None = None
+    build_cache: BuildCache | None = None
+    refresh: bool = False
+    retry: RetryPolicy = field(default_factory=RetryPolicy)
+    performance: dict = field(default_factory=dict)
+    complexity: dict | None = None
+    bench_runs: int = 1
+    bench_warmup: int = 0
+    totals: UsageTotals = field(default_factory=UsageTotals)
+    ledger: JobLedger | None = None
+    resume: bool = False
+    diagnostics_prompt: bool = False
+    dedup_threshold: float | None = None
+    duplicates: DuplicateGroups | None = None
+    # Keyword arguments of add_line_numbers for the program in the prompt
+    code_render: dict = field(default_factory=dict)
+    budget: Budget | None = None
+    # Completion tokens expected of a call, for cost projections
+    completion_tokens: int = 1000
+    # Cheap model evaluating first with --cascade, and the [cascade] config
+    cascade_model: str | None = None
+    cascade: dict = field(default_factory=dict)
+    # One concurrent call per topic plus one for the summary
+    split_topics: bool = False
+    # Evaluations aggregated per program, and the [samples] section of llm.toml
+    samples: int = 1
+    sampling: dict = field(default_factory=dict)
+
+
+@dataclass
+class Job:
+    """Ledger identity of a program and the stages it already completed."""
+
+    program: str
+    source_hash: str
+    done: dict = field(default_factory=dict)
+    # Test stages done with other settings, which run again
+    stale: set[str] = field(default_factory=set)
+
+
+@dataclass
+class Submission:
+    """A program whose objective tests are done and whose prompts are rendered."""
+
+    program_info: dict
+    metrics: dict
+    pvcheck_csv_scores: dict
+    system_prompt: str
+    user_prompt: str
+    job: Job
+    code_tokens: dict = field(default_factory=dict)
+    # Model of the call: settings.model unless the budget downgrades it
+    model: str = ""
+    program_lines: int = 0
+    cascade: dict | None = None
+    # Schema, topics and ledger stage of a call that differs from the default
+    # (one of the calls of --split_topics)
+    schema: dict | None = None
+    topics: list[str] | None = None
+    stage: str = "llm"
+    # Sample of --samples the call stands for (its cache key variant), and
+    # how many answers it asks the provider for
+    variant: str | None = None
+    candidates: int = 1
+    samples: dict | None = None
+    # Repairs made to the model result to fit the schema, kept in the report
+    repairs: list[str] = field(default_factory=list)
+
+
+def _digest(value) -> str:
+    text = json.dumps(
+        value,
+        sort_keys=True,
+        default=lambda o: sorted(o) if isinstance(o, set) else str(o),
+    )
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def stage_settings(settings: RunSettings) -> dict[str, str]:
+    """Return a digest of the settings each objective test stage depends on.
+
+    On resume, a stage recorded with other settings runs again, as a model
+    call does when its call_key changed.
+    """
+    session = settings.session
+    reference_class = (session.reference_complexity or {}).get("class")
+    return {
+        "compiled": _digest(settings.questions.get("warning_weights")),
+        "timed": _digest(
+            [
+                settings.exam_ctx.program_input,
+                settings.bench_runs,
+                settings.bench_warmup,
+                settings.performance,
+                bool(session.reference_stats),
+            ]
+        ),
+        "pvchecked": _digest(
+            [
+                settings.questions.get("questions_weights"),
+                [asdict(case) for case in session.pvcheck_tests],
+            ]
+        ),
+        "scaled": _digest(
+            [settings.complexity, reference_class, session.scaling_inputs]
+        ),
+    }
+
+
+def load_job(program_path: Path, settings: RunSettings) -> Job:
+    """Identify a program by path and content; on resume, fetch its done stages.
+
+    Records of an earlier version of the program are pruned. Test stages
+    recorded with other settings are left out, and so is the report when one
+    of them is.
+    """
+    program_path = Path(program_path)
+    job = Job(
+        str(program_path.resolve()),
+        hashlib.sha256(program_path.read_bytes()).hexdigest(),
+    )
+    if settings.ledger:
+        settings.ledger.prune_stale(job.program, job.source_hash)
+    if settings.ledger and settings.resume:
+        done = settings.ledger.completed(job.program, job.source_hash)
+        keys = stage_settings(settings)
+        job.stale = {
+            stage
+            for stage, key in keys.items()
+            if stage in done and (done[stage] or {}).get("settings") != key
+        }
+        stale = job.stale | {"report"} if job.stale else set()
+        job.done = {s: r for s, r in done.items() if s not in stale}
+    return job
+
+
+def record_stage(
+    settings: RunSettings, job: Job, stage: str, status: str, result=None
+) -> None:
+    if settings.ledger:
+        settings.ledger.record(job.program, job.source_hash, stage, status, result)
+
+
+def run_objective_tests(program_path: Path, settings: RunSettings, job: Job):
+    """Run the objective tests, skipping those already done.
+
+    Return (metrics, pvcheck_csv_scores). The statistics of the performance
+    and complexity tests are added to metrics as `<test>_stats`.
+    """
+    metrics = dict.fromkeys(settings.tests, -1.0)
+    pvcheck_csv_scores = defaultdict(list)
+    stages = {"compiled": STAGE_TESTS["compiled"], "timed": STAGE_TESTS["timed"]}
+    if settings.exam_dir and settings.exam_ctx.pvcheck_flag:
+        stages["pvchecked"] = STAGE_TESTS["pvchecked"]
+    if settings.complexity and settings.session.reference_complexity:
+        stages["scaled"] = STAGE_TESTS["scaled"]
+    stats = {stage: {} for stage in stages}
+    keys = stage_settings(settings)
+    if job.stale & stages.keys():
+        logger.info(
+            f"{Path(program_path).name}: settings changed, running "
+            f"{', '.join(s for s in stages if s in job.stale)} again"
+        )
+
+    def record(stage, result):
+        status = "failed" if result["score"] == -1 else "done"
+        record_stage(settings, job, stage, status, {**result, "settings": keys[stage]})
+
+    for stage, test in stages.items():
+        if stage in job.done:
+            metrics[test] = job.done[stage]["score"]
+            stats[stage].update(job.done[stage].get("stats", {}))
+    pvcheck_csv_scores.update(job.done.get("pvchecked", {}).get("csv", {}))
+
+    if not all(stage in job.done for stage in stages):
+        # The executable is rebuilt whenever a later stage still has to run
+        with build_dir() as work_dir:
+            exec_path = work_dir / get_exec_name()
+            metrics[stages["compiled"]] = compilation_test(
+                str(program_path),
+                exec_path,
+                settings.build_cache,
+                stats["compiled"],
+                settings.questions.get("warning_weights"),
+            )
+            record(
+                "compiled",
+                {"score": metrics[stages["compiled"]], "stats": stats["compiled"]},
+            )
+            if "timed" not in job.done:
+                metrics[stages["timed"]] = time_test(
+                    exec_path,
+                    settings.exam_ctx.program_input,
+                    settings.bench_runs,
+                    settings.bench_warmup,
+                    stats["timed"],
+                    settings.session.reference_stats,
+                    settings.performance,
+                )
+                record(
+                    "timed",
+                    {"score": metrics[stages["timed"]], "stats": stats["timed"]},
+                )
+            if "pvchecked" in stages and "pvchecked" not in job.done:
+                metrics[stages["pvchecked"]] = pvcheck_test(
+                    settings.questions["questions_weights"],
+                    pvcheck_csv_scores,
+                    settings.session.pvcheck_tests,
+                    exec_path,
+                    stats["pvchecked"],
+                )
+                record(
+                    "pvchecked",
+                    {
+                        "score": metrics[stages["pvchecked"]],
+                        "csv": pvcheck_csv_scores,
+                        "stats": stats["pvchecked"],
+                    },
+                )
+            if "scaled" in stages and "scaled" not in job.done:
+                metrics[stages["scaled"]] = complexity_test(
+                    exec_path,
+                    settings.session.scaling_inputs,
+                    settings.session.reference_complexity,
+                    settings.complexity,
+                    stats["scaled"],
+                )
+                record(
+                    "scaled",
+                    {"score": metrics[stages["scaled"]], "stats": stats["scaled"]},
+                )
+
+    for stage, test in stages.items():
+        if stats[stage]:
+            metrics[f"{test}_stats"] = stats[stage]
+    return metrics, pvcheck_csv_scores
+
+
+def render_savings(source: str, program_text: str, model: str) -> dict:
+    """Compare the tokens of a rendered program with the default rendering."""
+    tokens = estimate_tokens(program_text, model)
+    baseline = estimate_tokens(add_line_numbers(source), model)
+    return {"code_tokens": tokens, "code_tokens_saved": baseline - tokens}
+
+
+def prepare_submission(
+    program_path: Path, settings: RunSettings, job: Job | None = None
+) -> Submission:
+    """Run the objective tests on a program and render its prompts."""
+    program_name = Path(program_path).name
+    abs_program_path = "file://" + str(Path(program_path).resolve())
+    program_info = {"name": program_name, "path": abs_program_path}
+    source = load_file(program_path)
+    program_text = add_line_numbers(source, **settings.code_render)
+    code_tokens = {}
+    if settings.code_render:
+        code_tokens = render_savings(source, program_text, settings.model)
+        baseline = code_tokens["code_tokens"] + code_tokens["code_tokens_saved"]
+        logger.info(
+            f"{program_name}: program rendered in {code_tokens['code_tokens']} "
+            f"tokens ({code_tokens['code_tokens_saved']} saved, "
+            f"{code_tokens['code_tokens_saved'] / max(baseline, 1):.0%})"
+        )
+    job = job or load_job(program_path, settings)
+
+    # OBJECTIVE TESTS
+    metrics, pvcheck_csv_scores = run_objective_tests(program_path, settings, job)
+
+    # PROMPT COMPILING (static sections come pre-rendered from the exam session)
+    system_prompt, user_prompt = settings.session.render_prompts(program_text)
+    if settings.diagnostics_prompt:
+        # Appended after the program, so the cached prompt prefix is unchanged
+        compile_stats = metrics.get(f"{STAGE_TESTS['compiled']}_stats", {})
+        if compile_stats.get("diagnostics"):
+            user_prompt += DIAGNOSTICS_PROMPT.format(
+                format_diagnostics(compile_stats["diagnostics"])
+            )
+
+    if settings.debug:
+        with open(
+            PROJECT_ROOT / "rendered_prompts" / "system_prompt.md",
+            "w",
+            encoding="utf-8",
+        ) as f:
+            f.write(system_prompt)
+        with open(
+            PROJECT_ROOT / "rendered_prompts" / "user_prompt.md",
+            "w",
+            encoding="utf-8",
+        ) as f:
+            f.write(user_prompt)
+
+    return Submission(
+        program_info,
+        metrics,
+        pvcheck_csv_scores,
+        system_prompt,
+        user_prompt,
+        job,
+        code_tokens,
+        settings.model,
+        len(source.splitlines()),
+    )
+
+
+def call_key(submission: Submission, settings: RunSettings, model: str) -> str:
+    return cache_key(
+        settings.provider,
+        model,
+        submission.system_prompt,
+        submission.user_prompt,
+        submission.schema or settings.schema,
+        settings.temperature,
+        submission.variant,
+    )
+
+
+def cached_response(submission: Submission, settings: RunSettings, key: str):
+    """Return (parsed, usage, provider) from the response cache, if there."""
+    if not settings.cache or settings.refresh:
+        return None
+    cached = settings.cache.get(key)
+    if cached is not None:
+        logger.info(f"{submission.program_info['name']}: cached response")
+        record_stage(
+            settings,
+            submission.job,
+            submission.stage,
+            "done",
+            {
+                "key": key,
+                "parsed": cached[0],
+                "usage": cached[1],
+                "provider": cached[2],
+                "model": submission.model,
+            },
+        )
+    return cached
+
+
+async def call_model(
+    submission: Submission, settings: RunSettings, limiter: ProviderLimiter
+):
+    """Dispatch the model call, answering from the response cache when possible.
+
+    A response recorded in the job ledger for the same prompt is reused on
+    resume. With a budget, the call may be downgraded to the fallback model
+    or refused (BudgetExceeded) just before dispatch. Return (parsed, usage,
+    provider, cache_hit).
+    """
+    name = submission.program_info["name"]
+    recorded = submission.job.done.get(submission.stage)
+    if recorded:
+        model = recorded.get("model", settings.model)
+        if recorded["key"] == call_key(submission, settings, model):
+            logger.info(f"{name}: response from the ledger")
+            submission.model = model
+            return recorded["parsed"], recorded["usage"], recorded["provider"], False
+    key = call_key(submission, settings, submission.model)
+    cached = await asyncio.to_thread(cached_response, submission, settings, key)
+    if cached is not None:
+        return *cached, True
+
+    if settings.budget:
+        model = settings.budget.reserve(
+            submission.job.program,
+            estimate_tokens(
+                submission.system_prompt + submission.user_prompt, submission.model
+            ),
+            submission.model,
+            submission.stage,
+            submission.candidates,
+        )
+        if model != submission.model:
+            logger.warning(
+                f"{name}: over budget with {submission.model}, using {model}"
+            )
+            submission.model = model
+            key = call_key(submission, settings, model)
+            cached = await asyncio.to_thread(cached_response, submission, settings, key)
+            if cached is not None:
+                settings.budget.settle(
+                    submission.job.program, 0.0, {}, submission.stage
+                )
+                return *cached, True
+
+    parsed, usage, provider = await call_with_retry(
+        lambda: run_model_dispatch_async(
+            settings.provider,
+            submission.model,
+            submission.system_prompt,
+            submission.user_prompt,
+            submission.schema or settings.schema,
+            settings.temperature,
+            settings.debug,
+            settings.session.prompt_cache_key,
+            submission.candidates,
+        ),
+        limiter.slot(provider_group(settings.provider)),
+        settings.retry,
+        name,
+    )
+    # SQLite writes wait on a locked database: keep them off the event loop
+    if settings.cache:
+        await asyncio.to_thread(settings.cache.put, key, parsed, usage, provider)
+    await asyncio.to_thread(
+        record_stage,
+        settings,
+        submission.job,
+        submission.stage,
+        "done",
+        {
+            "key": key,
+            "parsed": parsed,
+            "usage": usage,
+            "provider": provider,
+            "model": submission.model,
+        },
+    )
+    return parsed, usage, provider, False
+
+
+@dataclass
+class ModelResult:
+    """A model call of a submission, repaired to the schema and billed."""
+
+    parsed: dict  # a list of them for a call sampling several candidates
+    provider: str | None
+    tokens: dict
+    cost: float
+    savings: float
+    cache_hit: bool
+    repairs: list[str] = field(default_factory=list)
+
+
+async def model_step(
+    submission: Submission, settings: RunSettings, limiter: ProviderLimiter
+) -> ModelResult:
+    """Call the model for a submission, repair its result and bill the call."""
+    start = time.perf_counter()
+    parsed, usage, provider, cache_hit = await call_model(submission, settings, limiter)
+    latency = time.perf_counter() - start
+    topics = submission.topics
+    if topics is None:
+        topics = list(settings.llm_weights)
+    if submission.candidates > 1:
+        repaired = [repair_evaluation(p, topics) for p in parsed]
+        parsed = [p for p, _ in repaired]
+        repairs = [
+            f"sample {i}: {problem}"
+            for i, (_, problems) in enumerate(repaired, 1)
+            for problem in problems
+        ]
+    else:
+        parsed, repairs = repair_evaluation(parsed, topics)
+    if repairs and not settings.cascade_model:
+        logger.warning(
+            f"{submission.program_info['name']}: repaired the model result "
+            f"({'; '.join(repairs)})"
+        )
+    tokens = normalize_usage_dispatch(provider, usage)
+    # A cached response is not billed again
+    if cache_hit:
+        call_cost, savings = 0.0, 0.0
+    else:
+        call_cost = compute_cost(submission.model, tokens, settings.pricing)
+        savings = cache_savings(submission.model, tokens, settings.pricing)
+        settings.totals.add(tokens, call_cost, savings)
+        if settings.budget:
+            settings.budget.settle(
+                submission.job.program,
+                call_cost,
+                tokens,
+                submission.stage,
+                submission.candidates,
+            )
+        settings.totals.code_tokens_saved += submission.code_tokens.get(
+            "code_tokens_saved", 0
+        )
+    tokens["latency_s"] = round(latency, 3)
+    return ModelResult(parsed, provider, tokens, call_cost, savings, cache_hit, repairs)
+
+
+async def split_step(
+    submission: Submission, settings: RunSettings, limiter: ProviderLimiter
+) -> ModelResult:
+    """Evaluate each topic, and the summary, in concurrent calls and merge them.
+
+    Each call has the full prompt, with an instruction on its scope appended
+    after the program (so the cached prompt prefix is shared) and a schema
+    restricted to its part. The merged result has the usual structure; its
+    usage sums the calls, with the latency of each one and of the whole.
+    """
+    parts = [
+        replace(
+            submission,
+            user_prompt=submission.user_prompt + TOPIC_PROMPT.format(topic),
+            schema=generate_schema([topic], summary=False),
+            topics=[topic],
+            stage=f"{submission.stage}:{topic}",
+        )
+        for topic in settings.llm_weights
+    ]
+    parts.append(
+        replace(
+            submission,
+            user_prompt=submission.user_prompt + SUMMARY_PROMPT,
+            schema=generate_schema([]),
+            topics=[],
+            stage=f"{submission.stage}:summary",
+        )
+    )
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(model_step(part, settings, limiter) for part in parts)
+    )
+    latency = time.perf_counter() - start
+
+    summary = results[-1].parsed
+    parsed = {
+        "evaluations": [e for r in results[:-1] for e in r.parsed["evaluations"]],
+        "priority issues": summary.get("priority issues", []),
+        "practical_tips": summary.get("practical_tips", []),
+    }
+    return await asyncio.to_thread(
+        merge_results,
+        submission,
+        settings,
+        parts,
+        results,
+        parsed,
+        latency,
+        {"split": True},
+    )
+
+
+async def sample_step(
+    submission: Submission, settings: RunSettings, limiter: ProviderLimiter
+) -> ModelResult:
+    """Evaluate a submission settings.samples times and aggregate the results.
+
+    Providers that sample several answers to a request (native_samples) get
+    a single call; the others one concurrent call per sample, each with its
+    own cache key. The statistics of the samples go to submission.samples.
+    """
+    count = settings.samples
+    start = time.perf_counter()
+    if native_samples(settings.provider) and not settings.split_topics:
+        parts = [
+            replace(
+                submission,
+                variant=f"{count} samples",
+                candidates=count,
+                stage=f"{submission.stage}:samples",
+            )
+        ]
+        results = [await model_step(parts[0], settings, limiter)]
+        samples = results[0].parsed
+    else:
+        step = split_step if settings.split_topics else model_step
+        parts = [
+            replace(
+                submission,
+                variant=f"sample {i}",
+                stage=f"{submission.stage}:sample{i}",
+            )
+            for i in range(1, count + 1)
+        ]
+        results = await asyncio.gather(
+            *(step(part, settings, limiter) for part in parts)
+        )
+        samples = [result.parsed for result in results]
+    latency = time.perf_counter() - start
+    if not samples:
+        raise InvalidResponseError("The provider returned no samples")
+
+    parsed, stats = aggregate_samples(
+        samples, list(settings.llm_weights), settings.sampling
+    )
+    submission.samples = stats
+    variances = [topic["variance"] for topic in stats["topics"].values()]
+    logger.info(
+        f"{submission.program_info['name']}: {stats['count']} samples, "
+        f"score variance up to {max(variances, default=0):g}"
+    )
+    return await asyncio.to_thread(
+        merge_results,
+        submission,
+        settings,
+        parts,
+        results,
+        parsed,
+        latency,
+        {"samples": stats},
+    )
+
+
+def merge_results(
+    submission: Submission,
+    settings: RunSettings,
+    parts: list[Submission],
+    results: list[ModelResult],
+    parsed: dict,
+    latency: float,
+    record: dict,
+) -> ModelResult:
+    """Combine the concurrent calls of a submission into its parsed result.
+
+    Usage is summed, with the latency of the whole and of each call (named
+    after its stage). The result is recorded under the submission's ledger
+    stage, with the fields of record added.
+    """
+    tokens = {}
+    for result in results:
+        for name, value in result.tokens.items():
+            if isinstance(value, int | float) and name != "latency_s":
+                tokens[name] = tokens.get(name, 0) + value
+    tokens["latency_s"] = round(latency, 3)
+    tokens["call_latency_s"] = {
+        part.stage.removeprefix(f"{submission.stage}:"): result.tokens["latency_s"]
+        for part, result in zip(parts, results, strict=True)
+    }
+    submission.model = "+".join(
+        dict.fromkeys(model for part in parts for model in part.model.split("+"))
+    )
+    record_stage(
+        settings,
+        submission.job,
+        submission.stage,
+        "done",
+        {
+            "key": None,
+            "parsed": parsed,
+            "usage": {},
+            "provider": results[0].provider,
+            "model": submission.model,
+            **record,
+        },
+    )
+    return ModelResult(
+        parsed,
+        results[0].provider,
+        tokens,
+        sum(_cost(r.cost) for r in results),
+        sum(r.savings for r in results),
+        all(r.cache_hit for r in results),
+        [
+            f"{part.stage}: {repair}"
+            for part, result in zip(parts, results, strict=True)
+            for repair in result.repairs
+        ],
+    )
+
+
+async def evaluate_step(
+    submission: Submission, settings: RunSettings, limiter: ProviderLimiter
+) -> ModelResult:
+    if settings.samples > 1:
+        return await sample_step(submission, settings, limiter)
+    if settings.split_topics:
+        return await split_step(submission, settings, limiter)
+    return await model_step(submission, settings, limiter)
+
+
+def _cost(value) -> float:
+    return value if isinstance(value, int | float) else 0.0
+
+
+async def escalate(
+    submission: Submission,
+    settings: RunSettings,
+    limiter: ProviderLimiter,
+    first: ModelResult,
+) -> ModelResult:
+    """Re-evaluate with settings.model when the cheap result is not trusted.
+
+    The steps taken, with their signals, tokens and cost, are stored in
+    submission.cascade; the returned result costs the whole cascade.
+    """
+    steps = [
+        {"model": submission.model, "tokens": dict(first.tokens), "cost": first.cost}
+    ]
+    submission.cascade = {"escalated": False, "steps": steps, "cost": first.cost}
+    # A result of the strong (or budget fallback) model, e.g. from the ledger
+    if submission.model != settings.cascade_model:
+        return first
+
+    scores = compute_final_score(
+        submission.metrics,
+        first.parsed,
+        settings.tests_weights,
+        settings.llm_weights,
+        settings.combined_weights,
+        settings.exam_ctx.quest_weights,
+        pvcheck_rows(submission.pvcheck_csv_scores),
+    )
+    signals = confidence_signals(
+        first.parsed,
+        first.repairs,
+        scores,
+        submission.program_lines,
+        settings.cascade,
+    )
+    steps[0]["signals"] = signals
+    if not signals:
+        return first
+
+    logger.info(
+        f"{submission.program_info['name']}: escalating to {settings.model} "
+        f"({'; '.join(signals[:3])}{'; ...' if len(signals) > 3 else ''})"
+    )
+    submission.model = settings.model
+    result = await evaluate_step(submission, settings, limiter)
+    steps.append(
+        {"model": submission.model, "tokens": dict(result.tokens), "cost": result.cost}
+    )
+    if result.repairs:
+        steps[-1]["repairs"] = result.repairs
+    result.cost = _cost(first.cost) + _cost(result.cost)
+    result.savings += first.savings
+    result.tokens["latency_s"] = round(
+        first.tokens["latency_s"] + result.tokens["latency_s"], 3
+    )
+    submission.cascade.update(escalated=True, cost=result.cost)
+    return result
+
+
+async def finish_submission(
+    submission: Submission, settings: RunSettings, limiter: ProviderLimiter
+) -> Path:
+    """Call the model for a prepared submission, score it and save the report.
+
+    A near-duplicate of another program of the batch takes the model result
+    of that program instead, with its line references remapped.
+    """
+    groups = settings.duplicates
+    duplicate = groups.of(submission.job.program) if groups else None
+    reused = await groups.wait(duplicate) if duplicate else None
+
+    if reused is not None:
+        parsed, provider = duplicate.remap_lines(reused[0]), reused[1]
+        submission.model = reused[2]
+        submission.program_info["duplicate_of"] = {
+            "name": duplicate.representative.name,
+            "path": "file://" + str(duplicate.representative.resolve()),
+            "similarity": duplicate.similarity,
+        }
+        await asyncio.to_thread(
+            record_stage,
+            settings,
+            submission.job,
+            "llm",
+            "done",
+            {
+                "key": None,
+                "parsed": parsed,
+                "usage": {},
+                "provider": provider,
+                "model": submission.model,
+                "duplicate_of": str(duplicate.representative),
+            },
+        )
+        tokens = dict.fromkeys(
+            ("prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens"), 0
+        )
+        call_cost, savings, cache_hit = 0.0, 0.0, False
+    else:
+        # MODEL CALL (with --cascade, the cheap model first)
+        if settings.cascade_model:
+            submission.model = settings.cascade_model
+        try:
+            result = await evaluate_step(submission, settings, limiter)
+            if settings.cascade_model:
+                result = await escalate(submission, settings, limiter, result)
+        except Exception as e:
+            await asyncio.to_thread(
+                record_stage,
+                settings,
+                submission.job,
+                "llm",
+                "failed",
+                {"error": str(e)},
+            )
+            raise
+        parsed, provider, tokens = result.parsed, result.provider, result.tokens
+        call_cost, savings, cache_hit = result.cost, result.savings, result.cache_hit
+        submission.repairs = result.repairs
+        if not cache_hit:
+            settings.totals.latencies.append(tokens["latency_s"])
+        if groups:
+            groups.publish(submission.job.program, (parsed, provider, submission.model))
+    tokens["cache_savings"] = savings
+    tokens["cache_hit"] = cache_hit
+    tokens.update(submission.code_tokens)
+    return await asyncio.to_thread(
+        save_submission, submission, settings, parsed, provider, tokens, call_cost
+    )
+
+
+def save_submission(
+    submission: Submission,
+    settings: RunSettings,
+    parsed: dict,
+    provider: str | None,
+    tokens: dict,
+    call_cost,
+) -> Path:
+    """Score the model result of a submission and save its report."""
+    # FINAL SCORE
+    combined = compute_final_score(
+        submission.metrics,
+        parsed,
+        settings.tests_weights,
+        settings.llm_weights,
+        settings.combined_weights,
+        settings.exam_ctx.quest_weights,
+        pvcheck_rows(submission.pvcheck_csv_scores),
+    )
+
+    # SAVE OUTPUT
+    timestamp = datetime.now().strftime("%H-%M-%S")
+    settings.output_dir.mkdir(parents=True, exist_ok=True)
+    output_name = (
+        f"{timestamp}_{submission.program_info['name']}_"
+        f"{settings.sys_prompt_path.stem}_{settings.usr_prompt_path.stem}.json"
+    )
+    output_path = settings.output_dir / output_name
+
+    save_json_and_html(
+        submission.program_info,
+        output_path,
+        parsed,
+        submission.model,
+        provider,
+        tokens,
+        call_cost,
+        combined,
+        submission.cascade,
+        submission.samples,
+        submission.repairs,
+    )
+    record_stage(settings, submission.job, "report", "done", {"path": str(output_path)})
+    return output_path
+
+
+def preflight(program_paths: list[Path], settings: RunSettings) -> dict:
+    """Estimate the prompt tokens of the model call of each program.
+
+    Return {program: CallEstimate}, leaving out near-duplicates and, on
+    resume, programs whose call is already recorded. The cacheable prompt
+    prefix counts as cached from the second call on; the compiler
+    diagnostics of --diagnostics are not known yet and not counted. With
+    --split_topics a program makes one call per topic plus one, and with
+    --samples each of them is repeated (in one request where the provider
+    can sample several answers).
+    """
+    prefix = estimate_tokens(settings.session.prompt_prefix, settings.model)
+    calls = len(settings.llm_weights) + 1 if settings.split_topics else 1
+    requests = calls
+    if settings.samples > 1:
+        calls *= settings.samples
+        if settings.split_topics or not native_samples(settings.provider):
+            requests = calls
+    estimates = {}
+    for path in program_paths:
+        if settings.duplicates and settings.duplicates.of(path):
+            continue
+        if settings.resume and "llm" in load_job(path, settings).done:
+            continue
+        text = add_line_numbers(load_file(path), **settings.code_render)
+        system_prompt, user_prompt = settings.session.render_prompts(text)
+        tokens = estimate_tokens(system_prompt + user_prompt, settings.model)
+        cached = prefix if estimates and prefix >= CACHE_MIN_PREFIX else 0
+        estimates[str(Path(path).resolve())] = CallEstimate(
+            tokens * requests, min(cached, tokens) * requests, calls
+        )
+    return estimates
+
+
+def log_projection(estimates: dict, settings: RunSettings) -> None:
+    """Log the projected cost of the batch, and whether the budget covers it."""
+    if not estimates:
+        return
+    prompt = sum(e.prompt_tokens for e in estimates.values())
+    cached = sum(e.cached_tokens for e in estimates.values())
+    completion = settings.completion_tokens
+    calls = sum(e.calls for e in estimates.values())
+
+    def batch_cost(model: str) -> float:
+        return sum(
+            call_cost(model, e, completion, settings.pricing)
+            for e in estimates.values()
+        )
+
+    cost = batch_cost(settings.cascade_model or settings.model)
+    logger.info(
+        f"Projected cost of {calls} model calls: ${cost:.4f} "
+        f"({prompt} prompt tokens, {cached} of them cached, "
+        f"{completion * calls} completion tokens)"
+        + (
+            f", up to ${batch_cost(settings.model):.4f} more if every program "
+            f"escalates to {settings.model}"
+            if settings.cascade_model
+            else ""
+        )
+    )
+    budget = settings.budget
+    if budget is None or cost <= budget.limit:
+        return
+    if budget.fallback_model:
+        fallback = batch_cost(budget.fallback_model)
+        logger.warning(
+            f"Projected cost over the ${budget.limit:.4f} budget: calls will "
+            f"move to {budget.fallback_model} (${fallback:.4f} for all of them)"
+        )
+    else:
+        logger.warning(
+            f"Projected cost over the ${budget.limit:.4f} budget: the batch "
+            f"will stop when it is reached"
+        )
+
+
+def for_model(submission: Submission, settings: RunSettings, job: Job) -> Submission:
+    """Return a prepared submission ready to be evaluated by another model."""
+    return replace(
+        submission,
+        program_info=dict(submission.program_info),
+        job=job,
+        code_tokens=dict(submission.code_tokens),
+        model=settings.model,
+    )
+
+
+async def evaluate_program(
+    program_path: Path,
+    ensemble: list[RunSettings],
+    tests_pool: ThreadPoolExecutor,
+    limiter: ProviderLimiter,
+) -> list:
+    """Run the objective tests in tests_pool, then the model calls on the loop.
+
+    ensemble holds the settings of each model: the tests run once, with the
+    ledger of the first model that still has to evaluate the program, and
+    the prompt goes to all of them concurrently. Return the report path, or
+    the exception, of each. On resume, a model whose report of the program
+    was already written is skipped; once a model's budget is exhausted, the
+    program is not tested for it and gets BudgetExceeded.
+    """
+    loop = asyncio.get_running_loop()
+    results, pending = [], []
+    for i, settings in enumerate(ensemble):
+        job = await loop.run_in_executor(tests_pool, load_job, program_path, settings)
+        report = job.done.get("report")
+        if report and "llm" in job.done and Path(report["path"]).exists():
+            logger.info(
+                f"{Path(program_path).name}: already evaluated by "
+                f"{settings.model}, skipping"
+            )
+            if settings.duplicates:
+                llm = job.done["llm"]
+                settings.duplicates.publish(
+                    job.program,
+                    (llm["parsed"], llm["provider"], llm.get("model", settings.model)),
+                )
+            results.append(Path(report["path"]))
+        elif settings.budget and settings.budget.exhausted:
+            results.append(BudgetExceeded("budget exhausted"))
+        else:
+            results.append(None)
+            pending.append((i, job))
+    if not pending:
+        return results
+
+    first, job = pending[0]
+    submission = await loop.run_in_executor(
+        tests_pool, prepare_submission, program_path, ensemble[first], job
+    )
+    outcomes = await asyncio.gather(
+        *(
+            finish_submission(
+                submission if i == first else for_model(submission, ensemble[i], job),
+                ensemble[i],
+                limiter,
+            )
+            for i, job in pending
+        ),
+        return_exceptions=True,
+    )
+    for (i, _), outcome in zip(pending, outcomes, strict=True):
+        results[i] = outcome
+    return results
+
+
+async def run_batch(
+    program_paths: list[Path],
+    ensemble: list[RunSettings],
+    jobs: int,
+    limiter: ProviderLimiter,
+    fail_fast: bool = False,
+) -> list[str]:
+    """Evaluate programs concurrently and return the names of the failed ones.
+
+    Programs a model's budget could not pay for are skipped, not failed:
+    after the first, the remaining ones are not even tested. They are listed
+    at the end, to be evaluated later with --resume.
+
+    Objective tests run in a pool of `jobs` threads, each in its own build
+    directory. Model calls are plain coroutines on the event loop, so every
+    prepared program can wait on its provider at once; the limiter's adaptive
+    window caps how many requests each provider actually has in flight, and
+    transient errors are retried with backoff. Each report is
+    written as soon as its call returns. With several models in ensemble,
+    every program is tested once and evaluated by all of them, and a
+    comparison of the models is written in the output directory. With
+    fail_fast the first error is raised instead of being logged.
+    """
+    failed, skipped = [], []
+    reports = {(s.model, s.provider): {} for s in ensemble}
+
+    async def run_one(program_path):
+        name = Path(program_path).name
+        try:
+            outcomes = await evaluate_program(
+                program_path, ensemble, tests_pool, limiter
+            )
+        except Exception as e:
+            if fail_fast:
+                raise
+            logger.error(f"{name}: evaluation failed: {e}")
+            failed.append(name)
+            return
+        finally:
+            for settings in ensemble:
+                # Duplicates of a failed program call the model themselves
+                if settings.duplicates:
+                    settings.duplicates.publish(program_path, None)
+                if settings.budget:
+                    settings.budget.release(str(Path(program_path).resolve()))
+        for settings, outcome in zip(ensemble, outcomes, strict=True):
+            label = name if len(ensemble) == 1 else f"{name} ({settings.model})"
+            if isinstance(outcome, BudgetExceeded):
+                logger.warning(f"{label}: skipped ({outcome})")
+                skipped.append(label)
+            elif isinstance(outcome, Exception):
+                if fail_fast:
+                    raise outcome
+                logger.error(f"{label}: evaluation failed: {outcome}")
+                failed.append(label)
+            else:
+                reports[settings.model, settings.provider][name] = outcome
+
+    settings = ensemble[0]
+    if settings.dedup_threshold:
+        duplicates = find_duplicates(program_paths, settings.dedup_threshold)
+        for model_settings in ensemble:
+            model_settings.duplicates = DuplicateGroups(duplicates)
+        logger.info(
+            f"{len(duplicates)} near-duplicate programs will reuse the model "
+            f"evaluation of {len(settings.duplicates.representatives)} others"
+        )
+
+    for settings in ensemble:
+        estimates = preflight(program_paths, settings)
+        log_projection(estimates, settings)
+        if settings.budget:
+            settings.budget.pending = estimates
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as tests_pool:
+        try:
+            await asyncio.gather(*(run_one(p) for p in program_paths))
+        finally:
+            await aclose_clients()
+
+    evaluations = len(program_paths) * len(ensemble)
+    done = evaluations - len(failed) - len(skipped)
+    logger.info(
+        f"Evaluated {done}/{evaluations} programs"
+        if len(ensemble) == 1
+        else f"Completed {done}/{evaluations} evaluations "
+        f"of {len(program_paths)} programs by {len(ensemble)} models"
+    )
+    if skipped:
+        logger.warning(
+            f"{len(skipped)} skipped by the budget, to evaluate with --resume: "
+            f"{', '.join(skipped)}"
+        )
+    for settings in ensemble:
+        if settings.totals.calls:
+            prefix = f"{settings.model}: " if len(ensemble) > 1 else ""
+            logger.info(prefix + settings.totals.summary())
+    if len(ensemble) > 1:
+        write_comparison(reports, ensemble[0].output_dir.parent)
+    return failed
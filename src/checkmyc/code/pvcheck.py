@@ -0,0 +1,308 @@
+import os
+import re
+import signal
+import subprocess
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import zip_longest
+from pathlib import Path
+
+from .sandbox import current_sandbox
+
+# Same header rule as pvcheck: any text may precede '[', so that a header
+# printed right after a prompt for input is still recognised
+HEADER_RE = re.compile(r"[^[]*\[\s*(?P<tag>[-._a-zA-Z][-._\w]*)\s*\]\s*")
+_RE_INT = re.compile(r"(-|\+)?[0-9]+")
+_RE_REAL = re.compile(r"(-|\+)?[0-9]+\.(?P<frac>[0-9]*)")
+
+# pvcheck defaults: seconds per test case, lines kept of stdout and stderr
+CASE_TIMEOUT = 10
+OUTPUT_LIMIT = 10000
+
+# Values of the CODE column, as in pvcheck's CSV output
+CODE_OK, CODE_TIMEOUT, CODE_SEGFAULT, CODE_ERROR, CODE_NOTFILE = "0", "1", "2", "3", "4"
+
+
+@dataclass
+class PvTestCase:
+    """A test case of a pvcheck.test file.
+
+    sections maps each expected output section to its lines; the special
+    sections (.ARGS, .INPUT, .FILE, .SECTIONS) are kept apart.
+    """
+
+    name: str
+    sections: dict[str, list[str]] = field(default_factory=dict)
+    args: list[str] = field(default_factory=list)
+    input: str = ""
+    file: str | None = None
+    options: dict[str, set[str]] = field(default_factory=dict)
+
+
+def parse_sections(lines: Iterable[str]) -> Iterator[tuple[str, list[str]]]:
+    """Yield (tag, lines) for each section, skipping blank lines and comments.
+
+    Lines found before the first header go into a section with an empty tag.
+    """
+    tag, content = "", []
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        m = HEADER_RE.match(line)
+        if m:
+            if tag or content:
+                yield tag, content
+            tag, content = m.group("tag"), []
+        else:
+            content.append(line.rstrip())
+    if tag or content:
+        yield tag, content
+
+
+def _section_text(lines: list[str]) -> str:
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _build_case(name: str, sections: list[tuple[str, list[str]]]) -> PvTestCase:
+    case = PvTestCase(name)
+    merged: dict[str, list[str]] = {}
+    for tag, content in sections:
+        if tag == ".SECTIONS":
+            case.options.update(
+                (words[0], set(words[1:]))
+                for words in (line.split() for line in content)
+                if words
+            )
+        else:
+            merged.setdefault(tag, []).extend(content)
+
+    for tag, content in merged.items():
+        if tag == ".ARGS":
+            case.args = [a.strip() for a in content]
+        elif tag == ".INPUT":
+            case.input = _section_text(content)
+        elif tag == ".FILE":
+            case.file = _section_text(content)
+        elif tag and not tag.startswith("."):
+            case.sections[tag] = content
+    return case
+
+
+def parse_test_file(path: str | Path) -> list[PvTestCase]:
+    """Parse a pvcheck test file into its test cases.
+
+    Sections before the first [.TEST] are shared by every case; a file
+    without [.TEST] headers is a single unnamed case.
+    """
+    with Path(path).open(encoding="utf-8") as f:
+        sections = list(parse_sections(f))
+
+    prefix, groups = [], []
+    for tag, content in sections:
+        if tag == ".TEST":
+            name = content[0].strip() if content else f"Test-{len(groups) + 1}"
+            groups.append((name, []))
+        elif groups:
+            groups[-1][1].append((tag, content))
+        else:
+            prefix.append((tag, content))
+
+    if not groups:
+        return [_build_case("", prefix)]
+    return [_build_case(name, prefix + secs) for name, secs in groups]
+
+
+def section_names(cases: list[PvTestCase]) -> list[str]:
+    """Return the expected output sections in order of first appearance."""
+    names = {}
+    for case in cases:
+        names.update(dict.fromkeys(case.sections))
+    return list(names)
+
+
+def _compare_elements(value: str, expected: str) -> bool:
+    """Compare a token: reals up to the expected digits, integers by value."""
+    m = _RE_REAL.fullmatch(expected)
+    if m is not None:
+        try:
+            return float(expected) == round(float(value), len(m.group("frac")))
+        except ValueError:
+            return False
+    if _RE_INT.fullmatch(expected):
+        try:
+            return int(expected) == int(value)
+        except ValueError:
+            return False
+    return value == expected
+
+
+def _compare_lines(actual: str, expected: str) -> float:
+    """Return the fraction of mismatching tokens, 0 for a perfect match."""
+    act, exp = actual.split(), expected.split()
+    ok = sum(1 for a, e in zip(act, exp, strict=False) if _compare_elements(a, e))
+    den = max(len(act), len(exp))
+    return (den - ok) / max(den, 1)
+
+
+def compare_sections(actual: list[str], expected: list[str], ordered=True):
+    """Return the per-line differences between an output and an expected section."""
+    if ordered:
+        return [
+            1.0 if a is None or e is None else _compare_lines(a, e)
+            for a, e in zip_longest(actual, expected)
+        ]
+    remaining = list(expected)
+    diffs = []
+    for line in actual:
+        for i, exp in enumerate(remaining):
+            if _compare_lines(line, exp) == 0:
+                diffs.append(0.0)
+                del remaining[i]
+                break
+        else:
+            diffs.append(1.0)
+    return diffs + [1.0] * len(remaining)
+
+
+def _equality(diffs: list[float]) -> str:
+    if not diffs:
+        return "100.00"
+    return "%.2f" % ((len(diffs) - sum(diffs)) * 100 / len(diffs))
+
+
+def _truncate(text: str) -> tuple[str, bool]:
+    lines = text.splitlines(True)
+    if len(lines) > OUTPUT_LIMIT:
+        return "".join(lines[:OUTPUT_LIMIT]), True
+    return text, False
+
+
+def run_case(
+    exec_path: Path,
+    case: PvTestCase,
+    index: int,
+    timeout: float = CASE_TIMEOUT,
+    runner: Path | None = None,
+) -> tuple[str, dict[str, str], str | None]:
+    """Run a test case; return its CODE, the equality of each section and
+    the sandbox limit that stopped the program, if any.
+
+    Equalities are percentages formatted like pvcheck's ("100.00"), "MISS"
+    for a section missing from the output, "0" for all sections when the
+    program does not terminate normally. The program's output goes to files
+    in its directory, whose size the sandbox limits. The limits are set by
+    the rusage_run helper (runner) when given.
+    """
+    work_dir = exec_path.parent
+    out_path = work_dir / f"case{index}.stdout"
+    err_path = work_dir / f"case{index}.stderr"
+    tmp_paths = [out_path, err_path]
+    args = list(case.args)
+    if case.file is not None:
+        tmp_paths.append(work_dir / f"case{index}.pvcheck.tmp")
+        tmp_paths[-1].write_text(case.file, encoding="utf-8")
+        args = [str(tmp_paths[-1]) if a == ".FILE" else a for a in args]
+
+    try:
+        with (
+            current_sandbox().run() as box,
+            out_path.open("wb") as out_f,
+            err_path.open("wb") as err_f,
+        ):
+            try:
+                proc = box.popen(
+                    runner,
+                    [str(exec_path), *args],
+                    measure=False,
+                    stdin=subprocess.PIPE,
+                    stdout=out_f,
+                    stderr=err_f,
+                    cwd=work_dir,
+                    start_new_session=True,
+                )
+            except (OSError, subprocess.SubprocessError):
+                return CODE_NOTFILE, dict.fromkeys(case.sections, "0"), None
+            try:
+                proc.communicate(
+                    case.input.encode("utf-8", errors="ignore"), timeout=timeout
+                )
+                returncode = proc.returncode
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+                returncode = None
+            limit = box.limit_hit(returncode) if returncode != 0 else None
+        output = out_path.read_bytes().decode("utf-8", errors="ignore")
+        errors = err_path.read_bytes().decode("utf-8", errors="ignore")
+    finally:
+        for path in tmp_paths:
+            path.unlink(missing_ok=True)
+
+    if returncode is None:
+        code = CODE_TIMEOUT
+    else:
+        code = {0: CODE_OK, -signal.SIGSEGV: CODE_SEGFAULT}.get(returncode, CODE_ERROR)
+    output, cut = _truncate(output)
+    if code == CODE_OK and (cut or _truncate(errors)[1]):
+        # pvcheck fails the run when an output exceeds the limit
+        code = CODE_ERROR
+    if code != CODE_OK:
+        return code, dict.fromkeys(case.sections, "0"), limit
+
+    answers = {}
+    for tag, content in parse_sections(output.splitlines()):
+        answers.setdefault(tag, content)
+    results = {}
+    for tag, expected in case.sections.items():
+        if tag not in answers:
+            results[tag] = "MISS"
+            continue
+        ordered = "unordered" not in case.options.get(tag, set())
+        results[tag] = _equality(compare_sections(answers[tag], expected, ordered))
+    return code, results, None
+
+
+def run_tests(
+    exec_path: Path,
+    cases: list[PvTestCase],
+    timeout: float = CASE_TIMEOUT,
+    workers: int | None = None,
+    limits_hit: dict | None = None,
+    runner: Path | None = None,
+) -> dict[str, list[str]]:
+    """Run the test cases concurrently and return pvcheck's CSV as columns.
+
+    The columns are TEST, CODE and one per section, with a row per test
+    case and a final TOTAL row holding the mean of each section over the
+    cases that have it (MISS counting as 0). The sandbox limits hit are
+    stored in limits_hit by test name when given; runner is the
+    rusage_run helper that applies them.
+    """
+    workers = workers or min(len(cases), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(
+            pool.map(
+                lambda item: run_case(exec_path, item[1], item[0], timeout, runner),
+                enumerate(cases),
+            )
+        )
+
+    sections = section_names(cases)
+    columns = defaultdict(list)
+    for case, (code, equalities, limit) in zip(cases, results, strict=True):
+        if limit and limits_hit is not None:
+            limits_hit[case.name] = limit
+        columns["TEST"].append(case.name)
+        columns["CODE"].append(code)
+        for tag in sections:
+            columns[tag].append(equalities.get(tag, ""))
+
+    columns["TEST"].append("TOTAL")
+    columns["CODE"].append("")
+    for tag in sections:
+        values = [0.0 if v == "MISS" else float(v) for v in columns[tag] if v != ""]
+        columns[tag].append("%.2f" % (sum(values) / len(values) if values else 0))
+    return dict(columns)
@@ -0,0 +1,150 @@
+import argparse
+import json
+import logging
+import tomllib
+from pathlib import Path
+
+from .config import PROJECT_ROOT, _resolve_path, load_toml, write_report
+from .evals import (
+    compute_final_score,
+    pvcheck_score,
+    relative_performance_score,
+    warning_score,
+)
+
+logger = logging.getLogger(__name__)
+
+# Fields of a saved evaluation that are recomputed from the weights
+SCORE_FIELDS = ("pvcheck", "tests_scores", "llm_scores", "final_score", "weights")
+
+
+def init_argparser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="checkmyc rescore",
+        description="Recompute final scores of saved evaluations with the "
+        "current weights, without rerunning tests or models",
+    )
+    parser.add_argument(
+        "output_dir", type=str, help="Directory containing the evaluation JSON files"
+    )
+    parser.add_argument(
+        "--dry_run",
+        "-n",
+        action="store_true",
+        help="Only report which evaluations would change",
+    )
+    return parser
+
+
+def load_weights() -> dict:
+    """Load every weight used by compute_final_score from the config files."""
+    with (PROJECT_ROOT / "config.toml").open("rb") as f:
+        general_config = tomllib.load(f)
+    base = general_config.get("paths", {})
+    llm_config = load_toml(_resolve_path(base.get("llm")), "llm_config")
+    questions = load_toml(_resolve_path(base.get("questions")), "questions_config")
+    return {
+        "tests": questions["tests_weights"],
+        "complexity": questions.get("complexity", {}).get("weight", 2.0),
+        "questions": questions["questions_weights"],
+        "llm": {t["name"]: t["weight"] for t in llm_config["topics"]},
+        "combined": general_config.get("combined_weights", {}),
+        "performance": questions.get("performance", {}),
+        "warnings": questions.get("warning_weights", {}),
+    }
+
+
+def rescore_evaluation(data: dict, weights: dict) -> dict:
+    """Return the score fields of a saved evaluation recomputed with weights."""
+    stored_tests = data["tests_scores"]
+    tests_weights = dict(weights["tests"])
+    # The complexity test is weighted only in the evaluations of --scaling runs
+    if "complexity" in data["weights"].get("tests", {}):
+        tests_weights["complexity"] = weights["complexity"]
+    metrics = {}
+    for t in tests_weights:
+        v = stored_tests.get(t)
+        metrics[t] = v if isinstance(v, int | float) else -1.0
+    # Unweighted entries (e.g. benchmark statistics) are carried over
+    metrics.update(
+        (t, v)
+        for t, v in stored_tests.items()
+        if t not in tests_weights and t != "final"
+    )
+
+    # Diagnostics are kept, so warnings can be weighed again
+    warn_stats = metrics.get("warning_stats")
+    if (
+        isinstance(warn_stats, dict)
+        and warn_stats.get("returncode") == 0
+        and "diagnostics" in warn_stats
+    ):
+        metrics["warning"] = warning_score(
+            warn_stats["diagnostics"], weights["warnings"]
+        )
+
+    # Ratios to the reference solution are kept, so the bands can change
+    perf_stats = metrics.get("performance_stats")
+    if (
+        weights["performance"]
+        and isinstance(perf_stats, dict)
+        and "time_ratio" in perf_stats
+    ):
+        metrics["performance"] = relative_performance_score(
+            perf_stats, weights["performance"]
+        )
+
+    # pvcheck rows are kept per question, so its score follows the new weights
+    pv_data = data.get("pvcheck", {})
+    quest_weights = data["weights"].get("pvcheck_questions", {})
+    if quest_weights:
+        quest_weights = weights["questions"]
+        if pv_data and metrics.get("pvcheck", -1.0) != -1.0:
+            metrics["pvcheck"] = pvcheck_score(quest_weights, pv_data)
+
+    return compute_final_score(
+        metrics,
+        data["LLM"],
+        tests_weights,
+        weights["llm"],
+        weights["combined"],
+        quest_weights,
+        pv_data,
+    )
+
+
+def main(argv=None):
+    input_args = init_argparser().parse_args(argv)
+    output_dir = Path(input_args.output_dir)
+    if not output_dir.is_dir():
+        output_dir = PROJECT_ROOT / "output" / input_args.output_dir
+    if not output_dir.is_dir():
+        raise FileNotFoundError(f"Output dir not found: {input_args.output_dir}")
+
+    weights = load_weights()
+    changed = unchanged = skipped = 0
+    for json_path in sorted(output_dir.rglob("*.json")):
+        try:
+            with json_path.open(encoding="utf-8") as f:
+                data = json.load(f)
+            combined = rescore_evaluation(data, weights)
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            logger.warning(f"Skipping {json_path}: not a rescorable evaluation ({e})")
+            skipped += 1
+            continue
+
+        if all(data.get(k) == combined[k] for k in SCORE_FIELDS):
+            unchanged += 1
+            continue
+
+        changed += 1
+        logger.info(
+            f"{json_path.name}: final score {data.get('final_score')} -> "
+            f"{combined['final_score']}"
+        )
+        if not input_args.dry_run:
+            write_report(json_path, {**data, **combined})
+
+    logger.info(
+        f"Rescored: {changed} changed, {unchanged} unchanged, {skipped} skipped"
+    )
@@ -0,0 +1,124 @@
+import math
+import statistics
+
+# How the scores of a topic across samples are combined, as named in llm.toml
+AGGREGATES = ("median", "trimmed_mean")
+
+
+def _line_set(refs: list[str]) -> set[int]:
+    lines = set()
+    for ref in refs:
+        first, _, last = ref.partition("-")
+        lines.update(range(int(first), int(last or first) + 1))
+    return lines
+
+
+def aggregate_scores(scores: list[float], method: str, trim: float) -> float:
+    """Combine the scores of a topic: median, or mean without the trim tails."""
+    if method == "median":
+        return statistics.median(scores)
+    if method != "trimmed_mean":
+        raise ValueError(f"Unknown aggregate {method!r}: use one of {AGGREGATES}")
+    cut = math.floor(len(scores) * trim)
+    kept = sorted(scores)[cut : len(scores) - cut] or scores
+    return statistics.mean(kept)
+
+
+def merge_evidences(evidences: list[list[dict]], min_support: int) -> list[dict]:
+    """Merge the evidences of a topic from each sample by line overlap.
+
+    Evidences of different samples with the same goodness and overlapping
+    lines describe the same finding: each group keeps the first evidence
+    with its most common criticality, and counts in `support` the samples
+    that reported it. Groups reported by fewer than min_support samples are
+    dropped, unless no group reaches it (the best supported are then kept).
+    """
+    groups = []
+    for sample, sample_evidences in enumerate(evidences):
+        for evidence in sample_evidences:
+            lines = _line_set(evidence["lines"])
+            group = next(
+                (
+                    g
+                    for g in groups
+                    if lines & g["lines"] and g["goodness"] == evidence["goodness"]
+                ),
+                None,
+            )
+            if group is None:
+                group = {"lines": set(), "goodness": evidence["goodness"], "items": []}
+                groups.append(group)
+            group["lines"] |= lines
+            group["items"].append((sample, evidence))
+
+    for group in groups:
+        group["support"] = len({sample for sample, _ in group["items"]})
+    best = max((g["support"] for g in groups), default=0)
+    merged = []
+    for group in groups:
+        if group["support"] < min(min_support, best):
+            continue
+        criticalities = [e["criticality"] for _, e in group["items"]]
+        criticality = max(criticalities, key=criticalities.count)
+        evidence = next(e for _, e in group["items"] if e["criticality"] == criticality)
+        merged.append({**evidence, "support": group["support"]})
+    return merged
+
+
+def aggregate_samples(
+    samples: list[dict], topics: list[str], config: dict
+) -> tuple[dict, dict]:
+    """Combine repaired model results of the same program into one.
+
+    Topic scores are aggregated as config["aggregate"] says (median by
+    default, or trimmed_mean cutting config["trim"] of the scores at each
+    end) and evidences merged by line overlap, keeping those reported by at
+    least config["min_support"] of the samples. The summary comes from the
+    sample whose scores are closest to the aggregated ones. Return the
+    result and its statistics: the scores of each topic and their variance.
+    """
+    method = config.get("aggregate", "median")
+    trim = config.get("trim", 0.2)
+    min_support = math.ceil(len(samples) * config.get("min_support", 0.5))
+
+    evaluations, stats = [], {}
+    for topic in topics:
+        found = [
+            next((e for e in sample["evaluations"] if e["name"] == topic), None)
+            for sample in samples
+        ]
+        found = [e for e in found if e is not None]
+        if not found:
+            continue
+        scores = [e["score"] for e in found]
+        score = round(aggregate_scores(scores, method, trim), 2)
+        evaluations.append(
+            {
+                "name": topic,
+                "score": score,
+                "evidences": merge_evidences(
+                    [e["evidences"] for e in found], min_support
+                ),
+            }
+        )
+        stats[topic] = {
+            "scores": scores,
+            "score": score,
+            "variance": round(statistics.pvariance(scores), 3),
+        }
+
+    def distance(sample: dict) -> float:
+        return sum(
+            abs(e["score"] - stats[e["name"]]["score"])
+            for e in sample["evaluations"]
+            if e["name"] in stats
+        )
+
+    closest = min(range(len(samples)), key=lambda i: distance(samples[i]))
+    parsed = {**samples[closest], "evaluations": evaluations}
+    return parsed, {
+        "count": len(samples),
+        "aggregate": method,
+        "summary_sample": closest + 1,
+        "topics": stats,
+    }
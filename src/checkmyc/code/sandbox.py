@@ -0,0 +1,253 @@
+import itertools
+import logging
+import math
+import os
+import signal
+import subprocess
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_CGROUP_CONTROLLERS = ("cpu", "memory", "pids")
+
+
+@dataclass
+class SandboxLimits:
+    """Resource limits of each run of a student program; None leaves one unset.
+
+    cpu_time is in CPU seconds, memory_mb caps the address space, output_mb
+    the size of any file the program writes (its captured output included).
+    With cgroup, each run gets its own cgroup v2 group under cgroup_parent,
+    capped to cgroup_cpus CPUs, cgroup_memory_mb of memory and processes
+    tasks. Otherwise processes is enforced by RLIMIT_NPROC, which counts
+    every process of the user: it is added to the number the user runs
+    when the sandbox is configured.
+    """
+
+    cpu_time: float | None = 20
+    memory_mb: int | None = 2048
+    open_files: int | None = 64
+    processes: int | None = 64
+    output_mb: int | None = 16
+    cgroup: bool = False
+    cgroup_parent: str = "/sys/fs/cgroup/checkmyc"
+    cgroup_cpus: float | None = 1.0
+    cgroup_memory_mb: int | None = 1024
+
+
+def _user_processes() -> int:
+    uid = os.getuid()
+    count = 0
+    for entry in Path("/proc").iterdir():
+        if entry.name.isdigit():
+            with suppress(OSError):
+                count += entry.stat().st_uid == uid
+    return count
+
+
+@dataclass
+class SandboxRun:
+    """A single sandboxed run: start the program with popen, then ask limit_hit."""
+
+    options: list[str] = field(default_factory=list)
+    cgroup_dir: Path | None = None
+    cpu_time: float | None = None
+
+    def _attach(self, pid: int) -> None:
+        try:
+            (self.cgroup_dir / "cgroup.procs").write_text(str(pid))
+        except OSError as e:
+            logger.warning(f"Cannot move process {pid} to {self.cgroup_dir}: {e}")
+
+    def popen(
+        self, runner: Path | None, cmd: list[str], measure: bool = True, **kwargs
+    ) -> subprocess.Popen:
+        """Start cmd within the limits of the run; kwargs go to Popen.
+
+        The program is started by the rusage_run helper (runner), which sets
+        the rlimits between fork and exec. With measure, the helper reports
+        the program's resource usage on its standard error; otherwise it
+        execs into the program, keeping its return code. The helper is moved
+        to the run's cgroup by this process before it starts the program.
+        Without the helper no rlimits apply and the program is moved to the
+        cgroup only once started.
+        """
+        if runner is None:
+            proc = subprocess.Popen(cmd, **kwargs)
+            if self.cgroup_dir is not None:
+                self._attach(proc.pid)
+            return proc
+        args = [str(runner), *self.options, *([] if measure else ["-x"])]
+        if self.cgroup_dir is None:
+            return subprocess.Popen([*args, "--", *cmd], **kwargs)
+        # The helper waits for the end of this pipe to start the program
+        gate, release = os.pipe()
+        try:
+            proc = subprocess.Popen(
+                [*args, "-g", str(gate), "--", *cmd], pass_fds=(gate,), **kwargs
+            )
+            self._attach(proc.pid)
+        finally:
+            os.close(gate)
+            os.close(release)
+        return proc
+
+    def _event(self, file: str, name: str) -> int:
+        try:
+            for line in (self.cgroup_dir / file).read_text().splitlines():
+                key, value = line.split()
+                if key == name:
+                    return int(value)
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    def limit_hit(self, returncode: int | None, cpu: float | None = None) -> str | None:
+        """Return the limit that stopped the run, if it can be told.
+
+        One of "time" (wall-clock timeout, returncode None), "cpu", "output",
+        "memory" and "processes" (the last two with cgroups only: hitting the
+        address-space rlimit just makes allocations fail). cpu is the CPU
+        time the run used, when measured.
+        """
+        if returncode is None:
+            return "time"
+        if self.cgroup_dir is not None:
+            if self._event("memory.events", "oom_kill"):
+                return "memory"
+            if self._event("pids.events", "max"):
+                return "processes"
+        if returncode == -signal.SIGXFSZ:
+            return "output"
+        if returncode == -signal.SIGXCPU:
+            return "cpu"
+        # A program ignoring SIGXCPU is killed at the hard limit, one second later
+        if (
+            returncode == -signal.SIGKILL
+            and self.cpu_time
+            and cpu is not None
+            and cpu >= self.cpu_time
+        ):
+            return "cpu"
+        return None
+
+
+class Sandbox:
+    """Applies SandboxLimits to the runs of student programs (Linux only)."""
+
+    def __init__(self, limits: SandboxLimits | None = None):
+        self.limits = limits
+        self._options = []
+        self._cgroup_parent = None
+        self._nproc = None
+        self._counter = itertools.count()
+        if limits is None or sys.platform != "linux":
+            self.limits = None
+            return
+        self._options = self._helper_options(limits)
+        if limits.cgroup:
+            self._cgroup_parent = self._setup_cgroup(Path(limits.cgroup_parent))
+        if limits.processes:
+            # Counted once rather than by a /proc scan per run; also used
+            # for the runs whose cgroup cannot be created
+            self._nproc = _user_processes() + limits.processes
+
+    @staticmethod
+    def _helper_options(limits: SandboxLimits) -> list[str]:
+        """Return the rusage_run options of the limits fixed for every run."""
+        options = []
+        if limits.cpu_time:
+            options += ["-c", str(math.ceil(limits.cpu_time))]
+        if limits.memory_mb:
+            options += ["-m", str(limits.memory_mb * 1024 * 1024)]
+        if limits.open_files:
+            options += ["-n", str(limits.open_files)]
+        if limits.output_mb:
+            options += ["-o", str(limits.output_mb * 1024 * 1024)]
+        return options
+
+    def _setup_cgroup(self, parent: Path) -> Path | None:
+        try:
+            if not (parent.parent / "cgroup.controllers").exists():
+                raise OSError("not inside a cgroup v2 hierarchy")
+            parent.mkdir(exist_ok=True)
+            available = (parent / "cgroup.controllers").read_text().split()
+            missing = [c for c in _CGROUP_CONTROLLERS if c not in available]
+            if missing:
+                raise OSError(f"controllers not delegated: {', '.join(missing)}")
+            (parent / "cgroup.subtree_control").write_text(
+                " ".join(f"+{c}" for c in _CGROUP_CONTROLLERS)
+            )
+        except OSError as e:
+            logger.warning(f"cgroup v2 limits disabled ({parent}: {e})")
+            return None
+        return parent
+
+    def _create_cgroup(self) -> Path | None:
+        limits = self.limits
+        path = self._cgroup_parent / f"run-{os.getpid()}-{next(self._counter)}"
+        try:
+            path.mkdir()
+            if limits.cgroup_cpus:
+                quota = int(limits.cgroup_cpus * 100000)
+                (path / "cpu.max").write_text(f"{quota} 100000")
+            if limits.cgroup_memory_mb:
+                size = limits.cgroup_memory_mb * 1024 * 1024
+                (path / "memory.max").write_text(str(size))
+                (path / "memory.swap.max").write_text("0")
+            if limits.processes:
+                (path / "pids.max").write_text(str(limits.processes))
+        except OSError as e:
+            logger.warning(f"Cannot create cgroup {path}: {e}")
+            self._remove_cgroup(path)
+            return None
+        return path
+
+    @staticmethod
+    def _remove_cgroup(path: Path) -> None:
+        try:
+            # Kill what the program left behind (cgroup.kill: Linux 5.14+)
+            if (path / "cgroup.kill").exists():
+                (path / "cgroup.kill").write_text("1")
+            path.rmdir()
+        except OSError:
+            pass
+
+    @contextmanager
+    def run(self) -> Iterator[SandboxRun]:
+        """Prepare a run of a program; its cgroup is removed on exit."""
+        if self.limits is None:
+            yield SandboxRun()
+            return
+        cgroup_dir = self._create_cgroup() if self._cgroup_parent else None
+        options = list(self._options)
+        if self._nproc and cgroup_dir is None:
+            options += ["-p", str(self._nproc)]
+        try:
+            yield SandboxRun(options, cgroup_dir, self.limits.cpu_time)
+        finally:
+            if cgroup_dir is not None:
+                self._remove_cgroup(cgroup_dir)
+
+
+_sandbox: Sandbox | None = None
+
+
+def configure_sandbox(config: dict) -> Sandbox:
+    """Set the sandbox of every program run from the [sandbox] config section."""
+    global _sandbox
+    config = dict(config)
+    enabled = config.pop("enabled", True)
+    _sandbox = Sandbox(SandboxLimits(**config) if enabled else None)
+    return _sandbox
+
+
+def current_sandbox() -> Sandbox:
+    """Return the configured sandbox (default limits if none was configured)."""
+    if _sandbox is None:
+        return configure_sandbox({})
+    return _sandbox
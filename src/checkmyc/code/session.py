@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .complexity import fit_complexity, measure_scaling, scaling_dir_inputs
+from .config import ExamContext, render_prompts
+from .evals import _tmpfs_base, benchmark, compilation_test, get_exec_name
+from .pvcheck import PvTestCase, parse_test_file, section_names
+
+logger = logging.getLogger(__name__)
+
+# Placeholders rendered in place of the student program; two distinct ones
+# reveal templates that transform or repeat the program
+_PROBES = ("\x00checkmyc-program-a\x00", "\x00checkmyc-program-b\x00")
+
+# Timed runs of the reference solution (after one warm-up run)
+REFERENCE_RUNS = 3
+
+
+@dataclass
+class PromptTemplate:
+    """A rendered prompt split around the place of the student program.
+
+    tail is None when the prompt does not contain the program at all.
+    """
+
+    head: str
+    tail: str | None = None
+
+    def render(self, program: str) -> str:
+        return self.head if self.tail is None else self.head + program + self.tail
+
+
+def split_prompt(rendered: tuple[str, str]) -> PromptTemplate | None:
+    """Build a PromptTemplate from a prompt rendered with each of _PROBES.
+
+    Return None if the program is not inserted verbatim exactly once.
+    """
+    a, b = rendered
+    if a == b:
+        return PromptTemplate(a)
+    if a.count(_PROBES[0]) != 1 or b.count(_PROBES[1]) != 1:
+        return None
+    head, tail = a.split(_PROBES[0])
+    if b != head + _PROBES[1] + tail:
+        return None
+    return PromptTemplate(head, tail)
+
+
+@dataclass
+class ExamSession:
+    """Per-exam work shared by every submission of a run.
+
+    The static parts of the prompts are rendered once, the reference
+    solution is compiled and timed once, and pvcheck.test is parsed once.
+    """
+
+    sys_prompt_path: Path
+    usr_prompt_path: Path
+    templ_context: dict
+    system_prompt: PromptTemplate | None = None
+    user_prompt: PromptTemplate | None = None
+    pvcheck_tests: list[PvTestCase] = field(default_factory=list)
+    reference_exec: Path | None = None
+    reference_stats: dict = field(default_factory=dict)
+    scaling_inputs: list[tuple[int, Path]] = field(default_factory=list)
+    reference_complexity: dict | None = None
+    prompt_cache_key: str | None = None
+    # Text before the program, the same for every prompt of the exam
+    prompt_prefix: str = ""
+    _work_dir: tempfile.TemporaryDirectory | None = None
+
+    @classmethod
+    def build(
+        cls,
+        exam_ctx: ExamContext,
+        sys_prompt_path: Path,
+        usr_prompt_path: Path,
+        templ_context: dict,
+        questions_weights: dict,
+        complexity: dict | None = None,
+    ) -> "ExamSession":
+        """Do the shared work for an exam. Call close() when the run is over.
+
+        With a complexity config, the reference solution's complexity is also
+        estimated on the inputs of the exam's scaling/ directory.
+        """
+        session = cls(sys_prompt_path, usr_prompt_path, templ_context)
+        session._prerender_prompts()
+        if exam_ctx.pvcheck_flag and exam_ctx.exam_path:
+            session._load_pvcheck(
+                exam_ctx.exam_path / "pvcheck.test", questions_weights
+            )
+        if exam_ctx.solution_path:
+            session._build_reference(exam_ctx.solution_path, exam_ctx.program_input)
+        if complexity is not None:
+            session._build_scaling(exam_ctx, complexity)
+        return session
+
+    def _prerender_prompts(self) -> None:
+        system, user = zip(
+            *(
+                render_prompts(
+                    str(self.sys_prompt_path),
+                    str(self.usr_prompt_path),
+                    {**self.templ_context, "program": probe},
+                )
+                for probe in _PROBES
+            ),
+            strict=True,
+        )
+        self.system_prompt = split_prompt(system)
+        self.user_prompt = split_prompt(user)
+        if self.system_prompt is None or self.user_prompt is None:
+            logger.info("Prompt templates are rendered per program")
+            return
+
+        # Providers cache the longest prompt prefix seen before: everything up
+        # to the program is the same for the whole exam
+        if self.system_prompt.tail is not None:
+            prefix, tail = self.system_prompt.head, self.system_prompt.tail
+            tail += self.user_prompt.render("")
+        else:
+            prefix = self.system_prompt.head + self.user_prompt.head
+            tail = self.user_prompt.tail or ""
+        if tail.strip("`\n "):
+            logger.warning(
+                "The prompts continue after the program: that part cannot be "
+                "served from the providers' prompt cache (see up5.md)"
+            )
+        self.prompt_prefix = prefix
+        digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        self.prompt_cache_key = f"checkmyc-{digest[:16]}"
+
+    def _load_pvcheck(self, test_path: Path, questions_weights: dict) -> None:
+        self.pvcheck_tests = parse_test_file(test_path)
+        sections = section_names(self.pvcheck_tests)
+        logger.info(
+            f"pvcheck: {len(self.pvcheck_tests)} test cases, {len(sections)} sections"
+        )
+        # Question weights are matched to the sections by position
+        if len(sections) != len(questions_weights):
+            logger.warning(
+                f"pvcheck.test has {len(sections)} sections but "
+                f"{len(questions_weights)} question weights are configured"
+            )
+
+    def _build_reference(self, solution_path: Path, program_input) -> None:
+        self._work_dir = tempfile.TemporaryDirectory(
+            prefix="checkmyc-ref-", dir=_tmpfs_base()
+        )
+        exec_path = Path(self._work_dir.name) / get_exec_name()
+        compilation_test(str(solution_path), exec_path)
+        if not exec_path.exists():
+            logger.warning(f"Reference solution {solution_path.name} does not build")
+            return
+        self.reference_exec = exec_path
+        if not program_input:
+            return
+
+        failed, self.reference_stats = benchmark(
+            exec_path, program_input, REFERENCE_RUNS, warmup=1
+        )
+        if failed is not None:
+            logger.warning("Reference solution failed on the exam input")
+            return
+        logger.info(
+            f"Reference solution: median CPU time "
+            f"{self.reference_stats['cpu_median']:.4f}s, "
+            f"peak memory {self.reference_stats['max_rss_kb']} KB"
+        )
+
+    def _build_scaling(self, exam_ctx: ExamContext, config: dict) -> None:
+        if self.reference_exec is None:
+            logger.warning("Complexity estimation needs a reference solution")
+            return
+
+        scaling_dir = exam_ctx.exam_path / "scaling" if exam_ctx.exam_path else None
+        if not scaling_dir or not scaling_dir.is_dir():
+            # Inputs made up from the exam input are often not valid ones
+            logger.warning(
+                "Complexity estimation needs a scaling/ directory of inputs "
+                "in the exam directory: skipped"
+            )
+            return
+        inputs = scaling_dir_inputs(scaling_dir)
+        points = measure_scaling(
+            self.reference_exec,
+            inputs,
+            config.get("runs", 3),
+            config.get("timeout", 5.0),
+        )
+
+        self.reference_complexity = fit_complexity(
+            points, config.get("min_time", 0.002)
+        )
+        if self.reference_complexity is None:
+            logger.warning(
+                "Cannot estimate the reference solution's complexity: "
+                "the scaled inputs are too small or it fails on them"
+            )
+            return
+        # Submissions run on the inputs the reference solution handled
+        self.scaling_inputs = inputs[: len(points)]
+        logger.info(
+            f"Reference solution: {self.reference_complexity['class']} "
+            f"(exponent {self.reference_complexity['exponent']:.2f}) "
+            f"over {len(self.scaling_inputs)} inputs"
+        )
+
+    def render_prompts(self, program: str) -> tuple[str, str]:
+        """Return the system and user prompts for a student program."""
+        if self.system_prompt is None or self.user_prompt is None:
+            return render_prompts(
+                str(self.sys_prompt_path),
+                str(self.usr_prompt_path),
+                {**self.templ_context, "program": program},
+            )
+        return self.system_prompt.render(program), self.user_prompt.render(program)
+
+    def close(self) -> None:
+        """Remove the reference build directory."""
+        if self._work_dir is not None:
+            self._work_dir.cleanup()
+            self._work_dir = None
+            self.reference_exec = None
@@ -0,0 +1,84 @@
+import functools
+import logging
+import re
+
+try:
+    import tiktoken
+except ImportError:  # optional: a heuristic count is used without it
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Heuristic fallback: BPE vocabularies of recent models keep a run of up to
+# about four letters or three digits in one token, and short runs of
+# punctuation (with the space before them) or of whitespace in another
+_PIECE_RE = re.compile(r" ?[A-Za-z]+| ?\d{1,3}| ?[^\w\s]{1,3}|[ \t]+|\n+|\S")
+_LETTERS_PER_TOKEN = 4
+
+# Tokens per heuristic token by model family, from the size of their
+# vocabularies (smaller ones split text in more tokens); rough figures
+FAMILY_FACTORS = {
+    "gpt-3.5": 1.05,
+    "gpt-4-": 1.05,
+    "gpt": 1.0,
+    "o1": 1.0,
+    "o3": 1.0,
+    "o4": 1.0,
+    "gemini": 1.0,
+    "gemma": 1.0,
+    "qwen": 1.0,
+    "deepseek": 1.05,
+    "llama": 1.05,
+    "mistral": 1.1,
+    "claude": 1.1,
+}
+_OPENAI_FAMILIES = ("gpt", "o1", "o3", "o4")
+
+
+def model_family(model: str | None) -> str | None:
+    """Return the FAMILY_FACTORS key of a model name, provider prefix aside."""
+    name = (model or "").rsplit("/", 1)[-1].lower()
+    if name == "gpt-4":
+        return "gpt-4-"
+    return next((f for f in FAMILY_FACTORS if name.startswith(f)), None)
+
+
+@functools.cache
+def _encoding(model: str | None):
+    family = model_family(model)
+    if tiktoken is None or not (family or "").startswith(_OPENAI_FAMILIES):
+        return None
+    name = model.rsplit("/", 1)[-1]
+    try:
+        try:
+            return tiktoken.encoding_for_model(name)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # encodings are downloaded on first use
+        logger.warning(f"tiktoken unavailable ({e}), token counts are estimated")
+        return None
+
+
+def _heuristic_tokens(text: str) -> int:
+    count = 0
+    for m in _PIECE_RE.finditer(text):
+        piece = m.group().lstrip(" ")
+        if piece.isalpha():
+            count += -(-len(piece) // _LETTERS_PER_TOKEN)
+        else:
+            count += 1
+    return count
+
+
+def estimate_tokens(text: str, model: str | None = None) -> int:
+    """Return the number of prompt tokens text takes, estimated.
+
+    The count is exact for OpenAI models when tiktoken is installed and its
+    encodings are available. Otherwise it is a rough approximation that
+    works offline, scaled by the model's family.
+    """
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    factor = FAMILY_FACTORS.get(model_family(model), 1.0)
+    return round(_heuristic_tokens(text) * factor)
@@ -0,0 +1,134 @@
+/*
+ * Run a program within resource limits and report its own resource usage
+ * on standard error.
+ *
+ * Usage: rusage_run [OPTIONS] [--] PROGRAM [ARGS...]
+ *   -c SECONDS  CPU time (RLIMIT_CPU; the hard limit is one second more)
+ *   -m BYTES    address space (RLIMIT_AS)
+ *   -n FILES    open files (RLIMIT_NOFILE)
+ *   -p PROCS    processes of the user (RLIMIT_NPROC)
+ *   -o BYTES    size of any file written (RLIMIT_FSIZE)
+ *   -g FD       wait for end of file on FD before starting the program, so
+ *               that the caller can first move this process to a cgroup
+ *   -x          only apply the limits and exec the program, without
+ *               measuring it; its standard error is kept
+ * Output: "<wait status> <wall s> <user s> <sys s> <max rss>"
+ * When measuring, the program's own standard error is discarded.
+ *
+ * The limits are set here, between fork and exec, rather than in the
+ * Python interpreter, where running code in a forked child of a
+ * multi-threaded process is unsafe. The program is forked from this small
+ * process: on Linux a child inherits its parent's peak RSS, which would
+ * hide the program's own.
+ */
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+#define MAX_LIMITS 8
+
+static struct {
+    int resource;
+    rlim_t soft, hard;
+} limits[MAX_LIMITS];
+static int n_limits;
+
+static double seconds(struct timeval tv)
+{
+    return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+static void add_limit(int resource, const char *value, rlim_t extra)
+{
+    rlim_t soft = strtoull(value, NULL, 10);
+
+    if (n_limits < MAX_LIMITS) {
+        limits[n_limits].resource = resource;
+        limits[n_limits].soft = soft;
+        limits[n_limits].hard = soft + extra;
+        n_limits++;
+    }
+}
+
+/* Limits cannot be raised above the current hard limits */
+static void apply_limits(void)
+{
+    struct rlimit rl;
+    int i;
+
+    for (i = 0; i < n_limits; i++) {
+        if (getrlimit(limits[i].resource, &rl) < 0)
+            continue;
+        if (rl.rlim_max != RLIM_INFINITY) {
+            if (limits[i].soft > rl.rlim_max)
+                limits[i].soft = rl.rlim_max;
+            if (limits[i].hard > rl.rlim_max)
+                limits[i].hard = rl.rlim_max;
+        }
+        rl.rlim_cur = limits[i].soft;
+        rl.rlim_max = limits[i].hard;
+        setrlimit(limits[i].resource, &rl);
+    }
+}
+
+int main(int argc, char **argv)
+{
+    struct timespec start, end;
+    struct rusage ru;
+    int status, opt, gate = -1, measure = 1;
+    char byte;
+    pid_t pid;
+
+    while ((opt = getopt(argc, argv, "+c:m:n:p:o:g:x")) != -1) {
+        switch (opt) {
+        case 'c': add_limit(RLIMIT_CPU, optarg, 1); break;
+        case 'm': add_limit(RLIMIT_AS, optarg, 0); break;
+        case 'n': add_limit(RLIMIT_NOFILE, optarg, 0); break;
+        case 'p': add_limit(RLIMIT_NPROC, optarg, 0); break;
+        case 'o': add_limit(RLIMIT_FSIZE, optarg, 0); break;
+        case 'g': gate = atoi(optarg); break;
+        case 'x': measure = 0; break;
+        default: return 127;
+        }
+    }
+    if (optind >= argc)
+        return 127;
+    argv += optind;
+
+    if (gate >= 0) {
+        while (read(gate, &byte, 1) > 0)
+            ;
+        close(gate);
+    }
+
+    if (!measure) {
+        apply_limits();
+        execv(argv[0], argv);
+        return 127;
+    }
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    pid = fork();
+    if (pid < 0)
+        return 127;
+    if (pid == 0) {
+        int null = open("/dev/null", O_WRONLY);
+        if (null >= 0)
+            dup2(null, STDERR_FILENO);
+        apply_limits();
+        execv(argv[0], argv);
+        _exit(127);
+    }
+    if (wait4(pid, &status, 0, &ru) < 0)
+        return 127;
+    clock_gettime(CLOCK_MONOTONIC, &end);
+
+    fprintf(stderr, "%d %.6f %.6f %.6f %ld\n", status,
+            (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1e9,
+            seconds(ru.ru_utime), seconds(ru.ru_stime), ru.ru_maxrss);
+    return 0;
+}
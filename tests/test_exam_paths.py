@@ -0,0 +1,47 @@
+import os
+import shutil
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+from checkmyc.code.config import get_paths, load_exam_context
+from checkmyc.code.evals import build_dir, compilation_test, get_exec_name, time_test
+
+EXAM = Path(__file__).resolve().parents[1] / "resources" / "20180720"
+
+
+def _args(exam: str) -> Namespace:
+    return Namespace(
+        program="soluzione.c",
+        exam=exam,
+        output=None,
+        system_prompt="sp.md",
+        user_prompt="up.md",
+    )
+
+
+def test_relative_exam_path_is_resolved(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    args = _args(os.path.relpath(EXAM))
+    paths = get_paths({"paths": {"output_path": "output"}}, False, args)
+    exam_dir, ctx = load_exam_context(args, paths, {"questions_weights": {}})
+
+    assert exam_dir
+    assert Path(ctx.program_input).is_absolute()
+    assert Path(ctx.program_input).is_file()
+    assert ctx.exam_path.is_absolute()
+
+
+@pytest.mark.skipif(not shutil.which("gcc"), reason="gcc not found")
+def test_program_reads_a_relative_input(monkeypatch):
+    # Programs run in their build directory, not in the caller's one
+    monkeypatch.chdir(EXAM.parent)
+    with build_dir() as work_dir:
+        exec_path = work_dir / get_exec_name()
+        compilation_test(str(EXAM / "soluzione.c"), exec_path)
+        stats = {}
+        score = time_test(exec_path, Path(EXAM.name) / "input.dat", 1, 0, stats)
+
+    assert score > 0
+    assert "limit" not in stats